@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Document Reference Passing Benchmark
+Compares the retriever -> orchestrator -> processor payloads carrying full
+documents with the same hops carrying document references, as document
+length grows. Reports bytes per hop and JSON encode+decode time for the
+four codec passes a request makes, and checks both produce the same summary.
+
+Usage:
+    python benchmarks/bench_document_refs.py --lengths 50 500 5000 50000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'processor-agent'))
+
+from common.document_refs import to_reference  # noqa: E402
+from processing import generate_label, summarize_documents  # noqa: E402
+
+CATEGORIES = ['AI', 'Cloud', 'Architecture', 'DevOps', 'API', 'Programming', 'Database', 'Security']
+WORDS = [f"term{i}" for i in range(5000)]
+
+
+def synthetic_hits(count, content_words, seed=42):
+    """Top-k hits shaped like a /retrieve response, with sentences of ~20 words"""
+    rng = random.Random(seed)
+    hits = []
+    for i in range(count):
+        sentences = [" ".join(rng.choices(WORDS, k=20)) for _ in range(max(1, content_words // 20))]
+        hits.append({
+            "id": f"doc-{i:07d}",
+            "title": " ".join(rng.choices(WORDS, k=4)).title(),
+            "content": ". ".join(sentences) + ".",
+            "category": rng.choice(CATEGORIES),
+            "score": round(rng.random() * 10, 4)
+        })
+    return hits
+
+
+def codec_time(payload, repeat):
+    """Seconds for one json.dumps + json.loads of payload"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        json.loads(json.dumps(payload))
+    return (time.perf_counter() - started) / repeat
+
+
+def measure(documents, repeat):
+    retrieve_response = {"request_id": "bench", "trace_id": "t", "query": "q",
+                         "documents": documents, "count": len(documents), "corpus_version": 1}
+    process_request = {"request_id": "bench", "query": "q", "documents": documents}
+    # Retriever encodes, orchestrator decodes; orchestrator encodes, processor decodes
+    seconds = codec_time(retrieve_response, repeat) + codec_time(process_request, repeat)
+    return len(json.dumps(retrieve_response)), len(json.dumps(process_request)), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[50, 500, 5000, 50000],
+                        help="content length in words")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'words':>7} {'mode':>5} {'retrieve B':>11} {'process B':>10} {'codec us':>9}")
+    for words in args.lengths:
+        hits = synthetic_hits(args.top_k, words)
+        refs = [to_reference(hit) for hit in hits]
+        assert summarize_documents(hits) == summarize_documents(refs)
+        assert generate_label(hits) == generate_label(refs)
+        for mode, documents in (('full', hits), ('refs', refs)):
+            retrieve_bytes, process_bytes, seconds = measure(documents, args.repeat)
+            print(f"{words:>7} {mode:>5} {retrieve_bytes:>11} {process_bytes:>10} {seconds * 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
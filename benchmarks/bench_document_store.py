@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Document Store Memory Benchmark
+Compares the retriever's original list-of-dicts corpus with the compact
+DocumentStore (in-memory and memory-mapped) on a synthetic corpus.
+
+Usage:
+    python benchmarks/bench_document_store.py --docs 200000
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retriever-agent'))
+
+from document_store import DocumentStore  # noqa: E402
+
+CATEGORIES = ['AI', 'Cloud', 'Architecture', 'DevOps', 'API', 'Programming', 'Database', 'Security']
+WORDS = [f"term{i}" for i in range(5000)]
+
+
+def synthetic_documents(count, content_words, seed=42):
+    """Generate documents shaped like retriever-agent/documents.json"""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            "id": f"doc-{i:07d}",
+            "title": " ".join(rng.choices(WORDS, k=4)).title(),
+            "content": " ".join(rng.choices(WORDS, k=content_words)) + ".",
+            "category": rng.choice(CATEGORIES)
+        }
+
+
+def measure(build):
+    """Return (result, traced heap bytes, seconds) for build()"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def time_top_k(get, count, k=10, rounds=2000):
+    """Average seconds to materialise k random documents"""
+    rng = random.Random(7)
+    picks = [[rng.randrange(count) for _ in range(k)] for _ in range(rounds)]
+    start = time.perf_counter()
+    for slots in picks:
+        for slot in slots:
+            get(slot)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=100000, help='number of documents')
+    parser.add_argument('--content-words', type=int, default=40, help='words per document body')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    # Parse the corpus from JSON like the service does, so the strings are
+    # not shared with the generator
+    corpus_json = json.dumps(list(synthetic_documents(args.docs, args.content_words)))
+
+    documents, dict_bytes, dict_seconds = measure(lambda: json.loads(corpus_json))
+    store, store_bytes, store_seconds = measure(lambda: DocumentStore(documents))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'documents.store')
+        store.save(path)
+        mapped, mmap_bytes, mmap_seconds = measure(lambda: DocumentStore.open(path))
+
+        results = {
+            "documents": args.docs,
+            "content_words": args.content_words,
+            "list_of_dicts": {
+                "heap_bytes": dict_bytes,
+                "bytes_per_doc": round(dict_bytes / args.docs, 1),
+                "build_seconds": round(dict_seconds, 3),
+                "top10_materialize_us": round(time_top_k(documents.__getitem__, args.docs) * 1e6, 2)
+            },
+            "document_store": {
+                "heap_bytes": store_bytes,
+                "bytes_per_doc": round(store_bytes / args.docs, 1),
+                "build_seconds": round(store_seconds, 3),
+                "top10_materialize_us": round(time_top_k(store.get, args.docs) * 1e6, 2)
+            },
+            "document_store_mmap": {
+                "heap_bytes": mmap_bytes,
+                "file_bytes": os.path.getsize(path),
+                "open_seconds": round(mmap_seconds, 3),
+                "top10_materialize_us": round(time_top_k(mapped.get, args.docs) * 1e6, 2)
+            }
+        }
+        del mapped
+
+    print(json.dumps(results, indent=2))
+    print(f"\nHeap reduction: {dict_bytes / max(store_bytes, 1):.1f}x (in-memory store), "
+          f"{dict_bytes / max(mmap_bytes, 1):.0f}x (memory-mapped)")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
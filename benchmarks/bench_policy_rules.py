@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Policy Rule Throughput Benchmark
+Measures queries/second of the compiled PolicyEngine against the original
+one-scan-per-rule loop as the number of rules grows.
+
+Usage:
+    python benchmarks/bench_policy_rules.py --rules 10 100 1000 10000
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'policy-service'))
+
+from policy_engine import PolicyEngine, PolicyRule  # noqa: E402
+
+
+def synthetic_rules(count, regex_share, seed=42):
+    """Random lowercase terms plus a share of simple regex rules"""
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        if rng.random() < regex_share:
+            digits = rng.randint(3, 6)
+            rules.append(PolicyRule(f'regex-{i}', 'regex', rf'\bid{i}-\d{{{digits}}}\b'))
+        else:
+            term = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(6, 12)))
+            rules.append(PolicyRule(f'term-{i}', 'term', term))
+    return rules
+
+
+def synthetic_queries(count, rules, hit_rate, seed=7):
+    """Queries of ordinary words; hit_rate of them contain a rule term"""
+    rng = random.Random(seed)
+    words = ['machine', 'learning', 'cloud', 'docker', 'api', 'gateway', 'security', 'database',
+             'microservices', 'kubernetes', 'python', 'neural', 'network', 'deployment']
+    terms = [rule.pattern for rule in rules if rule.type == 'term']
+    queries = []
+    for _ in range(count):
+        query = rng.choices(words, k=rng.randint(3, 10))
+        if terms and rng.random() < hit_rate:
+            query.insert(rng.randrange(len(query)), rng.choice(terms))
+        queries.append(' '.join(query))
+    return queries
+
+
+def original_check(rules, query, regexes):
+    """The pre-engine policy loop: lowercase and scan once per rule"""
+    for rule in rules:
+        if rule.type == 'term':
+            if rule.pattern.lower() in query.lower():
+                return False
+        elif regexes[rule.id].search(query):
+            return False
+    return True
+
+
+def throughput(check, queries, min_seconds=0.5):
+    """Queries per second for check over queries"""
+    done = 0
+    start = time.perf_counter()
+    while True:
+        for query in queries:
+            check(query)
+        done += len(queries)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, nargs='+', default=[3, 100, 1000, 10000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--regex-share', type=float, default=0.0, help='fraction of rules that are regexes')
+    parser.add_argument('--hit-rate', type=float, default=0.1, help='fraction of queries that violate a rule')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rules':>8} {'compile ms':>11} {'engine q/s':>12} {'original q/s':>13} {'speedup':>8}")
+    for count in args.rules:
+        rules = synthetic_rules(count, args.regex_share)
+        queries = synthetic_queries(args.queries, rules, args.hit_rate)
+
+        start = time.perf_counter()
+        engine = PolicyEngine(rules)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        regexes = {rule.id: re.compile(rule.pattern, re.IGNORECASE) for rule in rules if rule.type == 'regex'}
+        # Both implementations must agree on the verdict
+        for query in queries:
+            assert engine.check(query).allowed == original_check(rules, query, regexes), query
+
+        engine_qps = throughput(engine.check, queries)
+        original_qps = throughput(lambda query: original_check(rules, query, regexes), queries)
+        results.append({
+            "rules": count,
+            "compile_ms": round(compile_ms, 2),
+            "engine_qps": round(engine_qps),
+            "original_qps": round(original_qps),
+            "speedup": round(engine_qps / original_qps, 2)
+        })
+        print(f"{count:>8} {compile_ms:>11.1f} {engine_qps:>12.0f} {original_qps:>13.0f} "
+              f"{engine_qps / original_qps:>7.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Top-k Retrieval Benchmark
+Compares the retriever's MaxScore-pruned BM25 top-k evaluation with
+exhaustive scoring (every matching document scored, then the top k kept)
+on Zipf-distributed synthetic corpora of growing size. Both must return
+identical rankings, scores included; any mismatch fails the run.
+
+Usage:
+    python benchmarks/bench_top_k.py --docs 10000 40000 160000 --top-k 3 10 100
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retriever-agent'))
+
+from search_index import InvertedIndex  # noqa: E402
+
+CATEGORIES = ['AI', 'Cloud', 'Architecture', 'DevOps', 'API', 'Programming', 'Database', 'Security']
+
+
+def zipf_weights(vocabulary, exponent=1.0):
+    """Cumulative weights of a Zipf distribution over vocabulary ranks"""
+    total = 0.0
+    cumulative = []
+    for rank in range(1, vocabulary + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return cumulative
+
+
+def synthetic_documents(count, vocabulary, content_words, seed=42):
+    """Documents shaped like retriever-agent/documents.json with natural-language-like term frequencies"""
+    rng = random.Random(seed)
+    words = [f"term{i}" for i in range(vocabulary)]
+    weights = zipf_weights(vocabulary)
+    return [{
+        "id": f"doc-{i:07d}",
+        "title": " ".join(rng.choices(words, cum_weights=weights, k=4)),
+        "content": " ".join(rng.choices(words, cum_weights=weights, k=rng.randint(content_words // 2,
+                                                                                   content_words * 3 // 2))),
+        "category": rng.choice(CATEGORIES)
+    } for i in range(count)]
+
+
+def synthetic_queries(count, vocabulary, seed=7):
+    """Two to four terms drawn like the documents' words, so common terms are common in queries too"""
+    rng = random.Random(seed)
+    words = [f"term{i}" for i in range(vocabulary)]
+    weights = zipf_weights(vocabulary)
+    return [" ".join(rng.choices(words, cum_weights=weights, k=rng.randint(2, 4))) for _ in range(count)]
+
+
+def time_queries(rank, queries):
+    """(rankings, average milliseconds per query)"""
+    start = time.perf_counter()
+    rankings = [rank(query) for query in queries]
+    return rankings, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, nargs='+', default=[10000, 40000, 160000])
+    parser.add_argument('--top-k', type=int, nargs='+', default=[3, 10, 100])
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--vocabulary', type=int, default=50000, help='distinct words')
+    parser.add_argument('--content-words', type=int, default=60, help='average words per document body')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    queries = synthetic_queries(args.queries, args.vocabulary)
+    results = []
+    mismatches = 0
+    print(f"{'docs':>8} {'k':>5} {'exhaustive ms':>14} {'maxscore ms':>12} {'speedup':>8} {'mismatches':>11}")
+    for count in args.docs:
+        index = InvertedIndex(synthetic_documents(count, args.vocabulary, args.content_words))
+        for top_k in args.top_k:
+            exhaustive, exhaustive_ms = time_queries(lambda query: index.rank(query, top_k, prune=False), queries)
+            pruned, pruned_ms = time_queries(lambda query: index.rank(query, top_k), queries)
+            different = sum(a != b for a, b in zip(exhaustive, pruned))
+            mismatches += different
+            results.append({
+                "documents": count,
+                "top_k": top_k,
+                "exhaustive_ms": round(exhaustive_ms, 3),
+                "maxscore_ms": round(pruned_ms, 3),
+                "speedup": round(exhaustive_ms / pruned_ms, 2),
+                "mismatches": different
+            })
+            print(f"{count:>8} {top_k:>5} {exhaustive_ms:>14.3f} {pruned_ms:>12.3f} "
+                  f"{exhaustive_ms / pruned_ms:>7.1f}x {different:>11}")
+        del index
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if mismatches:
+        print(f"\n{mismatches} ranking(s) differ between MaxScore and exhaustive scoring", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
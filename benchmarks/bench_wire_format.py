@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Inter-service Wire Format Benchmark
+Compares JSON (as Flask's jsonify and requests' .json() produce and read it)
+with MessagePack on representative retriever and processor payloads:
+payload size, encode time and decode time.
+
+Usage:
+    python benchmarks/bench_wire_format.py --content-words 200 --batch 100
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common import wire  # noqa: E402
+from common.document_refs import to_reference  # noqa: E402
+
+CATEGORIES = ['AI', 'Cloud', 'Architecture', 'DevOps', 'API', 'Programming', 'Database', 'Security']
+WORDS = [f"term{i}" for i in range(5000)]
+
+
+def synthetic_content(rng, words):
+    """Text of ~20-word sentences"""
+    return ". ".join(" ".join(rng.choices(WORDS, k=20)) for _ in range(max(1, words // 20))) + "."
+
+
+def synthetic_hits(rng, count, content_words):
+    """Hits shaped like retriever-agent search results"""
+    return [{
+        "id": f"doc-{rng.randrange(10 ** 7):07d}",
+        "title": " ".join(rng.choices(WORDS, k=4)).title(),
+        "content": synthetic_content(rng, content_words),
+        "category": rng.choice(CATEGORIES),
+        "score": round(rng.random() * 10, 4)
+    } for _ in range(count)]
+
+
+def payloads(content_words, batch, seed=42):
+    rng = random.Random(seed)
+    hits = synthetic_hits(rng, 3, content_words)
+    batch_hits = [synthetic_hits(rng, 3, content_words) for _ in range(batch)]
+    retrieve = {"request_id": "req-1", "trace_id": "t", "query": "machine learning",
+                "documents": hits, "count": 3, "corpus_version": 1}
+    return {
+        "/retrieve response": retrieve,
+        "/retrieve response (refs)": dict(retrieve, documents=[to_reference(hit) for hit in hits]),
+        "/process request": {"request_id": "req-1", "query": "machine learning", "documents": hits},
+        f"/retrieve/batch response x{batch}": {
+            "trace_id": "t", "count": batch, "corpus_version": 1,
+            "results": [{"request_id": f"req-{i}", "query": "q", "documents": docs, "count": 3}
+                        for i, docs in enumerate(batch_hits)]
+        },
+        f"/process/batch request x{batch}": {
+            "items": [{"request_id": f"req-{i}", "query": "q", "documents": docs}
+                      for i, docs in enumerate(batch_hits)]
+        }
+    }
+
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--content-words', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    if wire.msgpack is None:
+        sys.exit("msgpack is not installed")
+
+    codecs = {
+        # Flask's default provider: sorted keys, compact separators
+        'json': (lambda p: json.dumps(p, sort_keys=True, separators=(',', ':')).encode('utf-8'), json.loads),
+        'msgpack': (lambda p: wire.encode(p, wire.MSGPACK), lambda b: wire.decode(b, wire.MSGPACK))
+    }
+
+    print(f"{'payload':<32} {'format':>8} {'bytes':>10} {'encode us':>10} {'decode us':>10}")
+    for name, payload in payloads(args.content_words, args.batch).items():
+        repeat = max(1, args.repeat // (args.batch if 'batch' in name else 1))
+        for fmt, (encode, decode) in codecs.items():
+            body, encode_seconds = timed(lambda: encode(payload), repeat)
+            decoded, decode_seconds = timed(lambda: decode(body), repeat)
+            assert decoded == payload
+            print(f"{name:<32} {fmt:>8} {len(body):>10} {encode_seconds * 1e6:>10.1f} {decode_seconds * 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
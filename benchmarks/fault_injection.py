@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Downstream Fault Injection
+Runs the orchestrator against stand-in policy, retriever and processor
+services that answer canned bodies after an injected delay, and reports
+/process-request latency and errors through a sequence of fault phases,
+once with the resilience layer off (RESILIENCE=false: fixed timeouts)
+and once with it on.
+
+Phases, in this order:
+    healthy    every stand-in answers after --base-delay
+    outage     every retriever call stalls for --outage-delay (longer than any timeout)
+    recovery   healthy again; the first --breaker-reset seconds are not measured
+    slow-tail  --slow-rate of retriever and processor calls stall for --slow-delay
+
+Latency covers every response, errors included, since the point is how
+long a failing dependency holds the orchestrator's request threads.
+
+Usage:
+    python benchmarks/fault_injection.py --duration 10 --concurrency 8
+    python benchmarks/fault_injection.py --resilience true --phases slow-tail --output faults.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import ROOT, ServiceProcess, percentile  # noqa: E402
+
+# Stand-in service -> canned JSON response per path
+RESPONSES = {
+    'policy-service': {
+        '/policy': {"allowed": True, "reason": "Policy check passed", "matched_rules": []}
+    },
+    'retriever-agent': {
+        '/retrieve': {"documents": [{"id": "doc-1", "title": "Stand-in", "content": "Stand-in document.",
+                                     "category": "AI", "score": 1.0}], "count": 1}
+    },
+    'processor-agent': {
+        '/process': {"summary": "Stand-in summary.", "label": "ARTIFICIAL_INTELLIGENCE", "document_count": 1}
+    }
+}
+
+PHASES = ('healthy', 'outage', 'recovery', 'slow-tail')
+
+
+class Fault:
+    """Delay (and error) injected into every call to one stand-in"""
+
+    def __init__(self, delay, slow_rate=0.0, slow_delay=0.0, error_rate=0.0):
+        self.delay = delay
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.error_rate = error_rate
+
+    def draw(self, rng):
+        """(HTTP status, seconds to wait before answering)"""
+        status = 500 if rng.random() < self.error_rate else 200
+        if rng.random() < self.slow_rate:
+            return status, self.slow_delay
+        return status, self.delay
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real services, so the orchestrator's pools are exercised
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this each answer
+    # waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except ConnectionError:
+            # The orchestrator timed out, or a hedge won, and closed the connection
+            self.close_connection = True
+
+    def do_GET(self):
+        self._reply(200, {"status": "healthy"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        stand_in = self.server.stand_in
+        status, delay = stand_in.fault.draw(stand_in.rng)
+        time.sleep(delay)
+        body = RESPONSES[stand_in.name].get(self.path)
+        if body is None:
+            self._reply(404, {"error": "Not found"})
+        elif status != 200:
+            self._reply(status, {"error": "Injected failure"})
+        else:
+            self._reply(200, body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Cancelled hedges and timed-out calls reset their connections
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandIn:
+    """One fake downstream service, served from a thread of this process"""
+
+    def __init__(self, name, port, fault):
+        self.name = name
+        self.fault = fault
+        self.rng = random.Random(name)
+        self.server = StandInServer(('127.0.0.1', port), StandInHandler)
+        self.server.stand_in = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def phase_faults(phase, args):
+    """{stand-in name: Fault} for one phase"""
+    faults = {name: Fault(args.base_delay) for name in RESPONSES}
+    if phase == 'slow-tail':
+        for name in ('retriever-agent', 'processor-agent'):
+            faults[name] = Fault(args.base_delay, slow_rate=args.slow_rate, slow_delay=args.slow_delay)
+    elif phase == 'outage':
+        faults['retriever-agent'] = Fault(args.outage_delay)
+    return faults
+
+
+def run_phase(url, concurrency, duration):
+    """Closed-loop /process-request load; every response's latency and status"""
+    samples = []
+    lock = threading.Lock()
+    end = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < end:
+            payload = {"request_id": f"fault-{uuid.uuid4().hex}", "query": "machine learning"}
+            sent = time.perf_counter()
+            try:
+                status = str(session.post(url, json=payload, timeout=60).status_code)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            local.append((time.perf_counter() - sent, status))
+        session.close()
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(seconds for seconds, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[status] = statuses.get(status, 0) + 1
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 1)  # noqa: E731
+    return {
+        "requests": len(samples),
+        "ok": statuses.get('200', 0),
+        "statuses": statuses,
+        "rps": round(len(samples) / duration, 1),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 0.50)),
+            "p95": ms(percentile(latencies, 0.95)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "max": ms(latencies[-1] if latencies else None)
+        }
+    }
+
+
+def run_setting(resilience, args, work_dir):
+    """Start an orchestrator with RESILIENCE=resilience and drive it through the phases"""
+    ports = {name: args.base_port + offset for offset, name in enumerate(RESPONSES, start=1)}
+    stand_ins = {name: StandIn(name, port, Fault(args.base_delay)) for name, port in ports.items()}
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+        AUDIT_LOG_PATH=os.path.join(work_dir, f'audit-{resilience}.jsonl'),
+        IDEMPOTENCY_DB_PATH=os.path.join(work_dir, f'idempotency-{resilience}.db'),
+        POLICY_SERVICE_URL=f"http://127.0.0.1:{ports['policy-service']}",
+        RETRIEVER_SERVICE_URL=f"http://127.0.0.1:{ports['retriever-agent']}",
+        PROCESSOR_SERVICE_URL=f"http://127.0.0.1:{ports['processor-agent']}",
+        WIRE_FORMAT='json',
+        WORKERS=str(args.workers),
+        RESILIENCE=resilience,
+        BREAKER_RESET_TIMEOUT=str(args.breaker_reset)
+    )
+    orchestrator = ServiceProcess('orchestrator', args.base_port, args.server, env, work_dir)
+    url = orchestrator.url + '/process-request'
+    results = []
+    try:
+        orchestrator.wait_healthy(args.startup_timeout)
+        # Let the adaptive timeouts and hedge delays learn the healthy latencies
+        run_phase(url, args.concurrency, args.warmup)
+        for phase in [phase for phase in PHASES if phase in args.phases]:
+            for name, fault in phase_faults(phase, args).items():
+                stand_ins[name].fault = fault
+            if phase == 'recovery':
+                # Until the breaker lets a probe through, calls still fail fast
+                time.sleep(args.breaker_reset)
+            record = dict(run_phase(url, args.concurrency, args.duration), phase=phase, resilience=resilience)
+            results.append(record)
+            latency = record["latency_ms"]
+            print(f"RESILIENCE={resilience:<5} {phase:<10} {record['rps']:>7.1f} req/s  ok={record['ok']:<6} "
+                  f"p50={latency['p50']}ms p99={latency['p99']}ms max={latency['max']}ms  "
+                  f"statuses={record['statuses']}", file=sys.stderr)
+        results.append({"phase": "downstream-stats", "resilience": resilience,
+                        "stats": requests.get(orchestrator.url + '/downstream/stats', timeout=5).json()})
+    finally:
+        orchestrator.stop()
+        for stand_in in stand_ins.values():
+            stand_in.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resilience', choices=('false', 'true', 'both'), default='both')
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help="measured seconds per phase")
+    parser.add_argument('--warmup', type=float, default=3.0, help="unmeasured healthy seconds first")
+    parser.add_argument('--base-delay', type=float, default=0.002, help="stand-in answer time (s)")
+    parser.add_argument('--slow-rate', type=float, default=0.02,
+                        help="fraction of stalled calls; hedging at p95 only covers a tail under 5%%")
+    parser.add_argument('--slow-delay', type=float, default=1.0, help="stall of a slow call (s)")
+    parser.add_argument('--outage-delay', type=float, default=30.0, help="stall of every retriever call (s)")
+    parser.add_argument('--breaker-reset', type=float, default=2.0, help="BREAKER_RESET_TIMEOUT (s)")
+    parser.add_argument('--server', choices=('gunicorn', 'dev'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=1, help="orchestrator WORKERS (gunicorn)")
+    parser.add_argument('--base-port', type=int, default=5300)
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--output', help="write the results as JSON here")
+    args = parser.parse_args()
+
+    settings = ['false', 'true'] if args.resilience == 'both' else [args.resilience]
+    work_dir = tempfile.mkdtemp(prefix='fault-injection-')
+    try:
+        results = [record for resilience in settings for record in run_setting(resilience, args, work_dir)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
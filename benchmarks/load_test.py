@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Load Test
+Starts the four services locally (no Docker or Kong) on a synthetic corpus,
+drives /process-request and each service endpoint at fixed concurrency
+levels, and reports p50/p95/p99 latency, requests/s and memory per service.
+Results are written as JSON so runs can be diffed across commits.
+
+Every level is a closed loop: `concurrency` client threads each send their
+next request as soon as the previous one returns, for `--duration` seconds
+after `--warmup` seconds whose requests are discarded. The client shares
+the machine with the services, so compare runs from the same host only.
+
+Usage:
+    python benchmarks/load_test.py run --docs 20000 --concurrency 1 8 32 --output results.json
+    python benchmarks/load_test.py run --server dev --targets process-request --env SEARCH_MODE=keyword
+    python benchmarks/load_test.py compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Service directory -> port offset from --base-port
+SERVICES = {
+    'orchestrator': 0,
+    'policy-service': 1,
+    'retriever-agent': 2,
+    'processor-agent': 3
+}
+
+# Target name -> (service, path)
+TARGETS = {
+    'process-request': ('orchestrator', '/process-request'),
+    'policy': ('policy-service', '/policy'),
+    'retrieve': ('retriever-agent', '/retrieve'),
+    'process': ('processor-agent', '/process')
+}
+
+# Service settings matching docker-compose.yml; --env overrides them
+DEFAULT_ENV = {'WIRE_FORMAT': 'msgpack', 'DOCUMENT_REFS': 'true'}
+
+CATEGORIES = ['AI', 'Cloud', 'Architecture', 'DevOps', 'API', 'Programming', 'Database', 'Security']
+WORDS = [f"term{i}" for i in range(5000)]
+
+
+def synthetic_documents(count, content_words, seed=42):
+    """Documents shaped like retriever-agent/documents.json, with ~20-word sentences"""
+    rng = random.Random(seed)
+    return [{
+        "id": f"doc-{i:07d}",
+        "title": " ".join(rng.choices(WORDS, k=4)).title(),
+        "content": ". ".join(" ".join(rng.choices(WORDS, k=20))
+                             for _ in range(max(1, content_words // 20))) + ".",
+        "category": rng.choice(CATEGORIES)
+    } for i in range(count)]
+
+
+def query_pool(documents, count=1000, seed=7):
+    """Two-word queries drawn from document titles, so most of them match"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(documents)['title'].lower().split()
+        queries.append(" ".join(rng.sample(words, min(2, len(words)))))
+    return queries
+
+
+class ServiceProcess:
+    """One service started from its directory in a new process group"""
+
+    def __init__(self, name, port, server, env, log_dir):
+        self.name = name
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        if server == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', '-c', 'python:common.gunicorn_conf', 'app:app']
+        else:
+            command = [sys.executable, 'app.py']
+        self.log_path = os.path.join(log_dir, f'{name}.log')
+        with open(self.log_path, 'w') as log:
+            self.process = subprocess.Popen(
+                command, cwd=os.path.join(ROOT, name), env=dict(env, PORT=str(port)),
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+            )
+
+    def wait_healthy(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.process.returncode}; see {self.log_path}")
+            try:
+                if requests.get(self.url + '/health', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError(f"{self.name} was not healthy after {timeout}s; see {self.log_path}")
+
+    def memory(self):
+        return process_tree_memory(self.process.pid)
+
+    def stop(self):
+        if self.process.poll() is not None:
+            return
+        os.killpg(self.process.pid, signal.SIGTERM)
+        try:
+            self.process.wait(15)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+
+def _children():
+    """{ppid: [pid, ...]} from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # Fields after the parenthesised command name; ppid is the second
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def process_tree_memory(pid):
+    """RSS, PSS and USS in MB summed over pid and its descendants (Linux only)
+
+    PSS splits shared pages between the processes mapping them, so its sum
+    is the real footprint of a pre-forked service; RSS counts shared pages
+    once per process. Returns None where /proc is not available.
+    """
+    if not os.path.exists(f'/proc/{pid}/smaps_rollup'):
+        return None
+    children = _children()
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        stack.extend(children.get(current, []))
+
+    totals = {'rss': 0, 'pss': 0, 'uss': 0}
+    for current in pids:
+        try:
+            with open(f'/proc/{current}/smaps_rollup') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line and not line[0].isdigit())
+        except OSError:
+            continue
+        kb = {key: int(value.split()[0]) for key, value in fields.items()}
+        totals['rss'] += kb.get('Rss', 0)
+        totals['pss'] += kb.get('Pss', 0)
+        totals['uss'] += kb.get('Private_Clean', 0) + kb.get('Private_Dirty', 0)
+    result = {f'{key}_mb': round(value / 1024, 1) for key, value in totals.items()}
+    result['processes'] = len(pids)
+    return result
+
+
+def payload_factory(target, queries, documents_for):
+    """Callable returning the next JSON body for target"""
+    rng = random.Random(11)
+
+    def next_payload():
+        query = rng.choice(queries)
+        # Fresh request ids keep the orchestrator's idempotency cache out of the measurement
+        payload = {"request_id": f"load-{uuid.uuid4().hex}", "query": query}
+        if target == 'process':
+            payload["documents"] = documents_for[query]
+        return payload
+
+    return next_payload
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def run_level(url, next_payload, concurrency, duration, warmup):
+    """Closed-loop load at one concurrency level; returns the result record"""
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    start = threading.Barrier(concurrency + 1)
+    timing = {}
+
+    def client():
+        session = requests.Session()
+        local_latencies, local_errors = [], {}
+        start.wait()
+        while True:
+            payload = next_payload()
+            sent = time.perf_counter()
+            if sent >= timing['end']:
+                break
+            try:
+                status = session.post(url, json=payload, timeout=30).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            done = time.perf_counter()
+            if sent < timing['measure']:
+                continue
+            if status == 200:
+                local_latencies.append(done - sent)
+            else:
+                local_errors[str(status)] = local_errors.get(str(status), 0) + 1
+        session.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for key, count in local_errors.items():
+                errors[key] = errors.get(key, 0) + count
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    now = time.perf_counter()
+    timing['measure'] = now + warmup
+    timing['end'] = now + warmup + duration
+    start.wait()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    completed = len(latencies)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)  # noqa: E731
+    return {
+        "concurrency": concurrency,
+        "requests": completed,
+        "errors": errors,
+        "rps": round(completed / duration, 1),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 0.50)),
+            "p95": ms(percentile(latencies, 0.95)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "mean": ms(sum(latencies) / completed if completed else None),
+            "max": ms(latencies[-1] if latencies else None)
+        }
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True,
+                                         stderr=subprocess.DEVNULL).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                             cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return {"commit": commit, "dirty": dirty}
+
+
+def parse_env(pairs):
+    env = dict(DEFAULT_ENV)
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise SystemExit(f"--env expects KEY=VALUE, got {pair!r}")
+        env[key] = value
+    return env
+
+
+def run(args):
+    if args.server == 'gunicorn':
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            sys.exit("gunicorn is not installed; use --server dev")
+
+    work_dir = tempfile.mkdtemp(prefix='load-test-')
+    if args.docs:
+        documents = synthetic_documents(args.docs, args.content_words)
+        documents_path = os.path.join(work_dir, 'documents.json')
+        with open(documents_path, 'w') as f:
+            json.dump(documents, f)
+    else:
+        documents_path = os.path.join(ROOT, 'retriever-agent', 'documents.json')
+        with open(documents_path) as f:
+            documents = json.load(f)
+    queries = query_pool(documents)
+    num_docs = len(documents)
+    del documents
+
+    overrides = parse_env(args.env)
+    ports = {name: args.base_port + offset for name, offset in SERVICES.items()}
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+        AUDIT_LOG_PATH=os.path.join(work_dir, 'audit.jsonl'),
+        IDEMPOTENCY_DB_PATH=os.path.join(work_dir, 'idempotency.db'),
+        DOCUMENTS_PATH=documents_path,
+        POLICY_RULES_PATH=os.path.join(ROOT, 'policy-service', 'policy_rules.json'),
+        POLICY_SERVICE_URL=f"http://127.0.0.1:{ports['policy-service']}",
+        RETRIEVER_SERVICE_URL=f"http://127.0.0.1:{ports['retriever-agent']}",
+        PROCESSOR_SERVICE_URL=f"http://127.0.0.1:{ports['processor-agent']}",
+        WORKERS=str(args.workers),
+        **overrides
+    )
+
+    services = {}
+    try:
+        for name in SERVICES:
+            services[name] = ServiceProcess(name, ports[name], args.server, env, work_dir)
+        for service in services.values():
+            service.wait_healthy(args.startup_timeout)
+        print(f"Services up ({args.server}); logs in {work_dir}", file=sys.stderr)
+
+        startup_memory = {name: service.memory() for name, service in services.items()}
+
+        # /process bodies are real /retrieve responses for the same queries
+        documents_for = {}
+        if 'process' in args.targets:
+            retriever = services['retriever-agent'].url + '/retrieve'
+            for query in set(queries):
+                response = requests.post(retriever, json={"query": query, "refs": overrides.get('DOCUMENT_REFS') == 'true'})
+                documents_for[query] = response.json().get('documents', [])
+
+        results = []
+        for target in args.targets:
+            service, path = TARGETS[target]
+            next_payload = payload_factory(target, queries, documents_for)
+            for concurrency in args.concurrency:
+                record = run_level(services[service].url + path, next_payload, concurrency,
+                                   args.duration, args.warmup)
+                record["target"] = target
+                record["memory"] = {name: s.memory() for name, s in services.items()}
+                results.append(record)
+                latency = record["latency_ms"]
+                print(f"{target:<16} c={concurrency:<4} {record['rps']:>9.1f} req/s  "
+                      f"p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms  "
+                      f"errors={sum(record['errors'].values())}", file=sys.stderr)
+    finally:
+        for service in services.values():
+            service.stop()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "server": args.server,
+            "workers": args.workers if args.server == 'gunicorn' else 1,
+            "docs": num_docs,
+            "content_words": args.content_words if args.docs else None,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "env": overrides
+        },
+        "startup_memory": startup_memory,
+        "results": results
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if not args.keep_logs:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return ''
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    old = {(r['target'], r['concurrency']): r for r in before['results']}
+
+    print(f"{'target':<16} {'c':>4} {'req/s':>18} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    for record in after['results']:
+        previous = old.get((record['target'], record['concurrency']))
+        if previous is None:
+            continue
+        cells = [f"{record['rps']:>9} {change(previous['rps'], record['rps']):>8}"]
+        for key in ('p50', 'p95', 'p99'):
+            value = record['latency_ms'][key]
+            cells.append(f"{value!s:>9} {change(previous['latency_ms'][key], value):>8}")
+        print(f"{record['target']:<16} {record['concurrency']:>4} " + " ".join(cells))
+
+    print(f"\n{'service':<16} {'startup PSS MB':>22}")
+    for name, memory in after.get('startup_memory', {}).items():
+        previous = before.get('startup_memory', {}).get(name)
+        if memory and previous:
+            print(f"{name:<16} {memory['pss_mb']:>13} {change(previous['pss_mb'], memory['pss_mb']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="start the services and measure them")
+    run_parser.add_argument('--docs', type=int, default=10000,
+                            help="synthetic corpus size; 0 uses retriever-agent/documents.json")
+    run_parser.add_argument('--content-words', type=int, default=200)
+    run_parser.add_argument('--targets', nargs='+', choices=list(TARGETS), default=list(TARGETS))
+    run_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    run_parser.add_argument('--duration', type=float, default=10.0, help="measured seconds per level")
+    run_parser.add_argument('--warmup', type=float, default=2.0, help="discarded seconds per level")
+    run_parser.add_argument('--server', choices=('gunicorn', 'dev'), default='gunicorn')
+    run_parser.add_argument('--workers', type=int, default=2, help="WORKERS per service (gunicorn)")
+    run_parser.add_argument('--base-port', type=int, default=5100)
+    run_parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                            help="extra service setting, e.g. PIPELINE_MODE=monolith")
+    run_parser.add_argument('--startup-timeout', type=float, default=300.0)
+    run_parser.add_argument('--output', help="JSON results file (default: stdout)")
+    run_parser.add_argument('--keep-logs', action='store_true')
+
+    compare_parser = commands.add_parser('compare', help="diff two results files")
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+OVERFLOW_POLICIES = ('block', 'drop')
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter:
+    """Buffered audit.jsonl writer with a background flush thread
+
+    `log` only timestamps the record and puts it on a bounded queue; a
+    daemon thread serialises queued records and appends them with one
+    write() per batch (group commit), flushing once `batch_size` records
+    are waiting or `flush_interval` seconds after the first one arrived.
+    Records must not be mutated after they are logged.
+
+    When the queue is full, the 'block' policy makes the caller wait up to
+    `block_timeout` seconds for space (back-pressure) and the 'drop' policy
+    discards the record at once; both count what they drop.
+
+    The file is shared by every service, so it is opened with O_APPEND and
+    rotated (audit.jsonl -> audit.jsonl.1 -> ...) under an flock once it
+    reaches `max_bytes`. Writers notice a rotation done by another process
+    through the inode and reopen the path. Pending records are flushed at
+    interpreter exit, including on SIGTERM.
+    """
+
+    def __init__(self, path, service, batch_size=256, flush_interval=0.2, max_queue=10000,
+                 overflow='block', block_timeout=1.0, max_bytes=100 * 1024 * 1024, backup_count=5):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown audit overflow policy: {overflow}")
+        self.path = path
+        self.service = service
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self._start()
+        atexit.register(self.close)
+        os.register_at_fork(after_in_child=self._start)
+        _exit_on_sigterm()
+
+    @classmethod
+    def from_env(cls, service):
+        return cls(
+            os.getenv('AUDIT_LOG_PATH', '/app/logs/audit.jsonl'),
+            service,
+            batch_size=int(os.getenv('AUDIT_BATCH_SIZE', '256')),
+            flush_interval=float(os.getenv('AUDIT_FLUSH_INTERVAL', '0.2')),
+            max_queue=int(os.getenv('AUDIT_QUEUE_SIZE', '10000')),
+            overflow=os.getenv('AUDIT_OVERFLOW', 'block'),
+            block_timeout=float(os.getenv('AUDIT_BLOCK_TIMEOUT', '1')),
+            max_bytes=int(os.getenv('AUDIT_MAX_BYTES', str(100 * 1024 * 1024))),
+            backup_count=int(os.getenv('AUDIT_BACKUP_COUNT', '5'))
+        )
+
+    def _start(self):
+        """(Re)create the queue, file handle and thread; also runs in forked children"""
+        self._queue = queue.Queue(self.max_queue)
+        self._fd = None
+        self._inode = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def log(self, trace_id, request_id, endpoint, status, details, service=None):
+        """Queue one audit record"""
+        self.write({
+            "timestamp": datetime.utcnow().isoformat(),
+            "service": service or self.service,
+            "trace_id": trace_id,
+            "request_id": request_id,
+            "endpoint": endpoint,
+            "status": status,
+            "details": details
+        })
+
+    def write(self, record):
+        if self._closed:
+            self._write_lines([json.dumps(record) + '\n'])
+            return
+        try:
+            if self.overflow == 'block':
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5.0):
+        """Wait until every record queued so far has been written"""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Flush pending records and stop the writer thread"""
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "rotations": self.rotations
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            lines, events, stop = [], [], False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    events.append(item)
+                else:
+                    lines.append(json.dumps(item) + '\n')
+                if stop or events or len(lines) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            if lines:
+                try:
+                    self._write_lines(lines)
+                except OSError as e:
+                    # Never let a full disk or a bad mount kill the writer thread
+                    self.dropped += len(lines)
+                    logger.error("Audit write to %s failed: %s", self.path, e)
+            for event in events:
+                event.set()
+            if stop:
+                return
+
+    def _write_lines(self, lines):
+        data = ''.join(lines).encode('utf-8')
+        fd = self._file()
+        if self.max_bytes and os.fstat(fd).st_size + len(data) > self.max_bytes:
+            fd = self._rotate()
+        # One write per batch: O_APPEND keeps batches from different
+        # processes whole and in order
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        self.written += len(lines)
+        self.batches += 1
+
+    def _file(self):
+        """Descriptor for path, reopened if the file was rotated or removed"""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if self._fd is None or inode != self._inode:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._inode = os.fstat(self._fd).st_ino
+        return self._fd
+
+    def _rotate(self):
+        """Shift path to path.1, path.1 to path.2, ... unless another writer just did"""
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # If path is no longer the file we found full, it has been rotated already
+                if os.path.exists(self.path) and os.stat(self.path).st_ino == self._inode:
+                    for number in range(self.backup_count - 1, 0, -1):
+                        source = f'{self.path}.{number}'
+                        if os.path.exists(source):
+                            os.replace(source, f'{self.path}.{number + 1}')
+                    if self.backup_count > 0:
+                        os.replace(self.path, f'{self.path}.1')
+                    else:
+                        os.remove(self.path)
+                    self.rotations += 1
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return self._file()
+
+
+def _exit_on_sigterm():
+    """Turn SIGTERM into a normal exit so atexit flushes the audit queue
+
+    Only installed from the main thread and when nobody else (e.g. a
+    gunicorn worker) has set a handler already.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
@@ -0,0 +1,354 @@
+"""Index audit.jsonl by trace_id/request_id and query it
+
+    python -m common.audit_index trace <trace_id>
+    python -m common.audit_index request <request_id>
+    python -m common.audit_index counts --since 2025-10-14T17:00 --until 2025-10-14T18:00
+    python -m common.audit_index watch
+
+Every command first brings the index up to date; `watch` keeps doing so
+in the foreground (sidecar mode).
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+SCHEMA = """
+-- How far each log file is indexed. A file is identified by its inode, which
+-- survives rotation, and a hash of its first line, since rotation frees inodes
+-- that a new audit.jsonl may reuse
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    head BLOB NOT NULL,
+    offset INTEGER NOT NULL,
+    UNIQUE (inode, head)
+);
+CREATE TABLE IF NOT EXISTS records (
+    file INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    trace_id TEXT,
+    request_id TEXT,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_trace ON records (trace_id);
+CREATE INDEX IF NOT EXISTS records_request ON records (request_id);
+CREATE INDEX IF NOT EXISTS records_file ON records (file);
+-- Record counts per time bucket, service and status of deleted rotated files
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket INTEGER NOT NULL,
+    service TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, service, status)
+);
+-- The same counts for files still on disk, so a file truncated in place can
+-- be counted again from the start; folded into buckets when it is deleted
+CREATE TABLE IF NOT EXISTS file_buckets (
+    file INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    service TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (file, bucket, service, status)
+);
+"""
+
+# Bytes read per indexing step
+READ_CHUNK = 4 * 1024 * 1024
+
+# Longest first line hashed to identify a file
+HEAD_LIMIT = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def file_identity(f):
+    """(inode, hash of the first line) of an open log file, or None before it has a whole line"""
+    inode = os.fstat(f.fileno()).st_ino
+    head = os.pread(f.fileno(), HEAD_LIMIT, 0)
+    end = head.find(b'\n')
+    if end < 0:
+        return None
+    return inode, hashlib.sha1(head[:end]).digest()
+
+
+def parse_timestamp(value):
+    """Epoch seconds of an audit timestamp (naive ISO 8601, UTC)"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class AuditIndex:
+    """On-disk index over audit.jsonl and its rotated files
+
+    Records are located by (file, offset, length), so lookups read only
+    the matching lines. Indexing is incremental: each file is read from
+    where the previous pass stopped, up to its last complete line. Entries
+    of rotated files that have since been deleted are dropped; the
+    per-bucket counts are kept. A file truncated in place is indexed and
+    counted again from the start.
+    """
+
+    def __init__(self, log_path, index_path, bucket_seconds=60):
+        self.log_path = log_path
+        self.index_path = index_path
+        self.bucket_seconds = bucket_seconds
+        self._rotated = re.compile(re.escape(os.path.basename(log_path)) + r'(\.\d+)?$')
+        self.conn = sqlite3.connect(index_path, timeout=10.0, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def log_files(self):
+        """{(inode, head): path} of the live log and its rotated copies"""
+        directory = os.path.dirname(self.log_path) or '.'
+        files = {}
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return files
+        for name in names:
+            if self._rotated.match(name):
+                path = os.path.join(directory, name)
+                try:
+                    with open(path, 'rb') as f:
+                        identity = file_identity(f)
+                except FileNotFoundError:
+                    continue
+                if identity is not None:
+                    files[identity] = path
+        return files
+
+    def _open(self, identity, path):
+        """path opened for reading, or None if it no longer is the file identified"""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        if file_identity(f) != identity:
+            # Rotated between listing and opening; the next pass finds it again
+            f.close()
+            return None
+        return f
+
+    def update(self):
+        """Index every record appended since the last update; returns the number indexed"""
+        with self._lock:
+            files = self.log_files()
+            known = {(inode, head): (file_id, offset) for file_id, inode, head, offset
+                     in self.conn.execute("SELECT id, inode, head, offset FROM files")}
+            indexed = 0
+            with self.conn:
+                for identity in set(known) - set(files):
+                    file_id = known[identity][0]
+                    self.conn.execute(
+                        "INSERT INTO buckets SELECT bucket, service, status, count FROM file_buckets WHERE file = ? "
+                        "ON CONFLICT (bucket, service, status) DO UPDATE SET count = count + excluded.count",
+                        (file_id,)
+                    )
+                    self.conn.execute("DELETE FROM file_buckets WHERE file = ?", (file_id,))
+                    self.conn.execute("DELETE FROM records WHERE file = ?", (file_id,))
+                    self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                for identity, path in files.items():
+                    if identity not in known:
+                        known[identity] = (self.conn.execute(
+                            "INSERT INTO files (inode, head, offset) VALUES (?, ?, 0)", identity
+                        ).lastrowid, 0)
+                    indexed += self._index_file(identity, path, *known[identity])
+            return indexed
+
+    def _index_file(self, identity, path, file_id, offset):
+        f = self._open(identity, path)
+        if f is None:
+            return 0
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < offset:
+                # Truncated in place: index and count it again from the start
+                self.conn.execute("DELETE FROM records WHERE file = ?", (file_id,))
+                self.conn.execute("DELETE FROM file_buckets WHERE file = ?", (file_id,))
+                offset = 0
+            f.seek(offset)
+            indexed = 0
+            position = offset
+            # Bytes read since offset, up to the last newline seen
+            parts = []
+            while position < size:
+                chunk = f.read(min(READ_CHUNK, size - position))
+                if not chunk:
+                    break
+                position += len(chunk)
+                end = chunk.rfind(b'\n') + 1
+                if not end:
+                    # Inside a line longer than READ_CHUNK: keep reading to its end
+                    parts.append(chunk)
+                    continue
+                parts.append(chunk[:end])
+                data = b''.join(parts)
+                indexed += self._index_lines(file_id, offset, data)
+                offset += len(data)
+                parts = [chunk[end:]]
+        self.conn.execute("UPDATE files SET offset = ? WHERE id = ?", (offset, file_id))
+        return indexed
+
+    def _index_lines(self, file_id, offset, data):
+        rows = []
+        counts = {}
+        position = 0
+        for line in data.split(b'\n'):
+            length = len(line) + 1
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                    ts = parse_timestamp(record['timestamp'])
+                except (ValueError, KeyError, TypeError):
+                    logger.warning("Skipping unreadable audit line at offset %d", offset + position)
+                else:
+                    rows.append((file_id, offset + position, len(line),
+                                 record.get('trace_id'), record.get('request_id'), ts))
+                    key = (int(ts // self.bucket_seconds) * self.bucket_seconds,
+                           str(record.get('service')), str(record.get('status')))
+                    counts[key] = counts.get(key, 0) + 1
+            position += length
+        self.conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.conn.executemany(
+            "INSERT INTO file_buckets VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (file, bucket, service, status) DO UPDATE SET count = count + excluded.count",
+            [(file_id, bucket, service, status, count) for (bucket, service, status), count in counts.items()]
+        )
+        return len(rows)
+
+    def _read(self, column, value):
+        rows = self.conn.execute(
+            "SELECT f.inode, f.head, r.offset, r.length FROM records r JOIN files f ON f.id = r.file "
+            f"WHERE r.{column} = ? ORDER BY r.ts, r.file, r.offset",
+            (value,)
+        ).fetchall()
+        if not rows:
+            return []
+        paths = {identity: path for identity, path in self.log_files().items()}
+        records = []
+        handles = {}
+        try:
+            for inode, head, offset, length in rows:
+                identity = (inode, head)
+                if identity not in handles:
+                    path = paths.get(identity)
+                    handles[identity] = path and self._open(identity, path)
+                f = handles[identity]
+                if f is not None:
+                    records.append(json.loads(os.pread(f.fileno(), length, offset)))
+        finally:
+            for f in handles.values():
+                if f is not None:
+                    f.close()
+        return records
+
+    def trace(self, trace_id):
+        """Every record of trace_id across services, in time order"""
+        return self._read('trace_id', trace_id)
+
+    def request(self, request_id):
+        """Every record of request_id (all its traces), in time order"""
+        return self._read('request_id', request_id)
+
+    def counts(self, since=None, until=None, service=None, status=None, by_bucket=False):
+        """Record counts per service and status (and bucket) between two epoch times
+
+        Bucket granularity applies: a bucket is counted when it starts in [since, until).
+        """
+        where, params = [], []
+        for clause, value in (("bucket >= ?", since), ("bucket < ?", until),
+                              ("service = ?", service), ("status = ?", status)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        columns = "bucket, service, status" if by_bucket else "service, status"
+        query = (f"SELECT {columns}, SUM(count) FROM (SELECT bucket, service, status, count FROM buckets "
+                 "UNION ALL SELECT bucket, service, status, count FROM file_buckets)")
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += f" GROUP BY {columns} ORDER BY {columns}"
+        return [dict(zip(columns.split(', ') + ['count'], row)) for row in self.conn.execute(query, params)]
+
+    def watch(self, interval=1.0):
+        """Keep the index up to date until interrupted"""
+        while True:
+            try:
+                indexed = self.update()
+                if indexed:
+                    logger.info("Indexed %d audit record(s)", indexed)
+            except (OSError, sqlite3.Error) as e:
+                logger.error("Audit indexing failed: %s", e)
+            time.sleep(interval)
+
+
+def _time_arg(value):
+    """Epoch seconds from an ISO 8601 time (UTC if no offset) or a number"""
+    try:
+        return float(value)
+    except ValueError:
+        return parse_timestamp(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the audit log through its index")
+    parser.add_argument('--log', default=os.getenv('AUDIT_LOG_PATH', '/app/logs/audit.jsonl'),
+                        help="audit log path (default: $AUDIT_LOG_PATH)")
+    parser.add_argument('--index', default=os.getenv('AUDIT_INDEX_PATH'),
+                        help="index database (default: audit-index.db next to the log)")
+    parser.add_argument('--bucket-seconds', type=int, default=int(os.getenv('AUDIT_INDEX_BUCKET', '60')))
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('update', help="index new records and exit")
+    trace = commands.add_parser('trace', help="all records of a trace_id")
+    trace.add_argument('trace_id')
+    request = commands.add_parser('request', help="all records of a request_id")
+    request.add_argument('request_id')
+    counts = commands.add_parser('counts', help="record counts per service and status")
+    counts.add_argument('--since', type=_time_arg)
+    counts.add_argument('--until', type=_time_arg)
+    counts.add_argument('--service')
+    counts.add_argument('--status')
+    counts.add_argument('--by-bucket', action='store_true')
+    watch = commands.add_parser('watch', help="keep the index up to date (sidecar)")
+    watch.add_argument('--interval', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    index_path = args.index or os.path.join(os.path.dirname(args.log) or '.', 'audit-index.db')
+    index = AuditIndex(args.log, index_path, bucket_seconds=args.bucket_seconds)
+
+    if args.command == 'watch':
+        index.watch(args.interval)
+        return 0
+
+    started = time.perf_counter()
+    indexed = index.update()
+    if args.command == 'update':
+        result = {"indexed": indexed}
+    elif args.command == 'trace':
+        result = index.trace(args.trace_id)
+    elif args.command == 'request':
+        result = index.request(args.request_id)
+    else:
+        result = index.counts(args.since, args.until, args.service, args.status, args.by_bucket)
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    logger.info("Done in %.1f ms (%d new record(s) indexed)", (time.perf_counter() - started) * 1000, indexed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+def first_sentence(content):
+    """Raw text before the first period (same as content.split('.')[0])"""
+    return content.partition('.')[0] if content else ''
+
+
+def to_reference(hit):
+    """Compact form of a retrieved document for reference passing
+
+    Keeps the id and exactly the fields the processor's summary and label
+    read, with the content reduced to its first sentence, so the payload
+    no longer grows with document length. The retriever builds the same
+    form straight from its index (InvertedIndex.hit), which records each
+    sentence's length once per document version.
+    """
+    reference = {
+        "id": hit['id'],
+        "title": hit['title'],
+        "category": hit['category'],
+        "first_sentence": first_sentence(hit['content'])
+    }
+    if 'score' in hit:
+        reference['score'] = hit['score']
+    return reference
@@ -0,0 +1,85 @@
+"""Production pre-fork server configuration shared by every service
+
+    gunicorn -c python:common.gunicorn_conf app:app
+
+The app is imported once in the master (preload_app) and the workers are
+forked from it, so the corpus, search indexes and policy automaton are
+shared copy-on-write instead of being loaded per worker. SIGHUP runs the
+apps' refork hooks in the master and replaces the workers gracefully.
+"""
+
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from common import serving
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Worker processes, and request threads in each (gthread keeps connections alive)
+workers = int(os.getenv('WORKERS', str(multiprocessing.cpu_count())))
+worker_class = 'gthread'
+threads = int(os.getenv('THREADS', '4'))
+keepalive = int(os.getenv('KEEPALIVE', '30'))
+
+# Load the app before forking so its memory is shared
+preload_app = True
+
+# Recycle each worker after this many requests (0 disables); the jitter
+# keeps workers from restarting all at once
+max_requests = int(os.getenv('MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', '1000'))
+
+# A worker silent for `timeout` seconds is killed; one being replaced gets
+# `graceful_timeout` seconds to finish its requests
+timeout = int(os.getenv('WORKER_TIMEOUT', '60'))
+graceful_timeout = serving.GRACEFUL_TIMEOUT
+
+accesslog = os.getenv('ACCESS_LOG') or None
+
+# Lets the app find the master to register refork hooks and request reforks
+os.environ[serving.MASTER_PID_ENV] = str(os.getpid())
+os.environ['WORKERS'] = str(workers)
+
+# prometheus_client multiprocess mode: every process writes its metrics to
+# files here and /metrics merges them; one directory per service. Set before
+# the app (and prometheus_client) is imported
+MULTIPROC_DIR_OWNED = not os.getenv('PROMETHEUS_MULTIPROC_DIR')
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.getenv('PROMETHEUS_MULTIPROC_DIR') or tempfile.mkdtemp(prefix='metrics-')
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def when_ready(server):
+    # Drop garbage left by loading, then keep the cyclic collector out of
+    # the preloaded objects so workers do not copy pages by scanning them
+    gc.collect()
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    # Also covers objects created by refork hooks since when_ready
+    gc.freeze()
+
+
+def on_reload(server):
+    serving.run_refork_hooks()
+
+
+def on_starting(server):
+    # Drop the files of a previous run sharing the directory
+    for name in os.listdir(os.environ['PROMETHEUS_MULTIPROC_DIR']):
+        if name.endswith('.db'):
+            os.remove(os.path.join(os.environ['PROMETHEUS_MULTIPROC_DIR'], name))
+
+
+def child_exit(server, worker):
+    # Drop a dead worker's live gauges; its counters and histograms stay in the totals
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if MULTIPROC_DIR_OWNED:
+        shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
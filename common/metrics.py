@@ -0,0 +1,173 @@
+"""Prometheus metrics shared by every service (prometheus_client)
+
+Under gunicorn (common/gunicorn_conf.py) PROMETHEUS_MULTIPROC_DIR is set
+before the app is imported, so every process records into its own files
+there and /metrics on any worker merges them (MultiProcessCollector).
+Counters and histograms of exited workers stay in the totals; gauges are
+declared with a live* multiprocess mode so only running processes count.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest,
+                               multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Request latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Collectors read at scrape time, which the multiprocess registry does not see on its own
+_CALLBACKS = []
+
+
+class CallbackMetric:
+    """Counter or gauge read from callback() -> {label tuple: value} at collection time
+
+    For statistics a component already keeps, such as a corpus version.
+    Values are those of the process answering the scrape, so the callback
+    must report state every worker shares (inherited from the pre-fork
+    master), not per-worker counts.
+    """
+
+    def __init__(self, name, documentation, labelnames, callback, kind='counter'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.kind = kind
+        _CALLBACKS.append(self)
+        if not multiprocess_dir():
+            REGISTRY.register(self)
+
+    def collect(self):
+        family = CounterMetricFamily if self.kind == 'counter' else GaugeMetricFamily
+        metric = family(self.name, self.documentation, labels=self.labelnames)
+        for labels, value in self.callback().items():
+            metric.add_metric([str(label) for label in labels], value)
+        yield metric
+
+
+def multiprocess_dir():
+    return os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+
+def render():
+    """Prometheus text exposition of every metric, merged over all processes in multiprocess mode"""
+    if not multiprocess_dir():
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for callback in _CALLBACKS:
+        registry.register(callback)
+    return generate_latest(registry)
+
+
+class StageTimer:
+    """Times the stages of one request into a histogram and a {stage: ms} dict for the audit record"""
+
+    def __init__(self, histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = self._last = time.perf_counter()
+        self.durations = {}
+
+    def _record(self, name, seconds):
+        self.durations[name] = round(seconds * 1000, 3)
+        self.histogram.labels(*self.labels, name).observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._last = time.perf_counter()
+            self._record(name, self._last - started)
+
+    def mark(self, name):
+        """Record the time since the previous stage ended as stage name
+
+        For overlapping stages: each one is charged only the wait it added.
+        """
+        now = time.perf_counter()
+        self._record(name, now - self._last)
+        self._last = now
+
+    def as_dict(self):
+        return dict(self.durations, total=round((time.perf_counter() - self.started) * 1000, 3))
+
+
+# HTTP metrics shared by every service
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "Time to produce a response",
+                            ('endpoint', 'method', 'status'), buckets=DEFAULT_BUCKETS)
+IN_FLIGHT = Gauge('http_requests_in_flight', "Requests being handled", multiprocess_mode='livesum')
+
+
+def instrument_flask(app):
+    """Time every request of a Flask app and serve GET /metrics
+
+    Timing wraps the WSGI app, so it costs one before_request hook (to
+    label the request with its URL rule) and a few microseconds more.
+    Streaming responses are timed until the response object is returned,
+    not until the last event is sent.
+    """
+    from flask import Response, request
+
+    wsgi_app = app.wsgi_app
+
+    @app.before_request
+    def label_endpoint():
+        rule = request.url_rule
+        request.environ['metrics.endpoint'] = rule.rule if rule is not None else '<unmatched>'
+
+    def timed_wsgi_app(environ, start_response):
+        started = time.perf_counter()
+        status = ['500']
+
+        def capture_status(code, headers, exc_info=None):
+            status[0] = code.split(' ', 1)[0]
+            return start_response(code, headers, exc_info)
+
+        IN_FLIGHT.inc()
+        try:
+            return wsgi_app(environ, capture_status)
+        finally:
+            IN_FLIGHT.dec()
+            REQUEST_SECONDS.labels(environ.get('metrics.endpoint', '<unmatched>'), environ.get('REQUEST_METHOD', ''),
+                                   status[0]).observe(time.perf_counter() - started)
+
+    app.wsgi_app = timed_wsgi_app
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE_LATEST)
+
+
+def instrument_aiohttp(app):
+    """aiohttp version of instrument_flask; streams are timed until the handler returns"""
+    from aiohttp import web
+
+    @web.middleware
+    async def timer(request, handler):
+        route = request.match_info.route.resource
+        endpoint = route.canonical if route is not None else '<unmatched>'
+        started = time.perf_counter()
+        status = 500
+        IN_FLIGHT.inc()
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            REQUEST_SECONDS.labels(endpoint, request.method, status).observe(time.perf_counter() - started)
+            IN_FLIGHT.dec()
+
+    async def metrics(request):
+        return web.Response(body=render(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+    app.middlewares.append(timer)
+    app.router.add_get('/metrics', metrics)
@@ -0,0 +1,56 @@
+import logging
+import os
+import signal
+
+logger = logging.getLogger(__name__)
+
+# Set by common.gunicorn_conf in the master before the app is imported
+MASTER_PID_ENV = 'PREFORK_MASTER_PID'
+
+# Seconds a worker gets to finish in-flight requests when it is replaced
+GRACEFUL_TIMEOUT = int(os.getenv('GRACEFUL_TIMEOUT', '30'))
+
+# Callbacks the master runs before it forks a fresh set of workers
+_refork_hooks = []
+
+
+def prefork_master():
+    """PID of the pre-fork master serving this app, or None under the development server"""
+    pid = os.getenv(MASTER_PID_ENV)
+    return int(pid) if pid else None
+
+
+def on_refork(callback):
+    """Run callback() in the master before workers are re-forked
+
+    State loaded before fork is shared copy-on-write and cannot be updated
+    in a worker without the others diverging, so it is reloaded here and
+    handed to the new workers by the fork itself.
+    """
+    _refork_hooks.append(callback)
+
+
+def run_refork_hooks():
+    for callback in _refork_hooks:
+        try:
+            callback()
+        except Exception:
+            # Keep forking from the state that was loaded last
+            logger.exception("Refork hook %r failed", callback)
+
+
+def request_refork():
+    """Ask the master to run the refork hooks and gracefully replace every worker
+
+    Returns False when there is no pre-fork master to ask.
+    """
+    master = prefork_master()
+    if master is None:
+        return False
+    os.kill(master, signal.SIGHUP)
+    return True
+
+
+def refork_on_change():
+    """File watcher callback in the master: reload through a refork"""
+    request_refork()
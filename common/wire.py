@@ -0,0 +1,70 @@
+import json
+
+from flask import Response, abort, jsonify, request
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+# Content types read as MessagePack
+MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+
+# WIRE_FORMAT values and the content type each one sends
+WIRE_FORMATS = {'json': JSON, 'msgpack': MSGPACK}
+
+
+def content_type_for(wire_format):
+    """Content type of a WIRE_FORMAT value; fails early if it cannot be used"""
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"Unknown wire format: {wire_format}")
+    if wire_format == 'msgpack' and msgpack is None:
+        raise RuntimeError("WIRE_FORMAT=msgpack needs the msgpack package")
+    return WIRE_FORMATS[wire_format]
+
+
+def is_msgpack(content_type):
+    return (content_type or '').split(';')[0].strip().lower() in MSGPACK_TYPES
+
+
+def encode(payload, content_type):
+    """payload as bytes in content_type (MessagePack or JSON)"""
+    if is_msgpack(content_type):
+        return msgpack.packb(payload)
+    return json.dumps(payload).encode('utf-8')
+
+
+def decode(body, content_type):
+    """Decode a body according to its Content-Type; anything but MessagePack is read as JSON"""
+    if is_msgpack(content_type):
+        return msgpack.unpackb(body)
+    return json.loads(body)
+
+
+def request_payload():
+    """Body of the current Flask request, MessagePack or JSON by its Content-Type
+
+    Behaves like request.get_json() for JSON bodies; a malformed
+    MessagePack body is a 400 as well.
+    """
+    if msgpack is not None and is_msgpack(request.content_type):
+        try:
+            return msgpack.unpackb(request.get_data())
+        except (ValueError, msgpack.UnpackException):
+            abort(400, description="Malformed MessagePack body")
+    return request.get_json()
+
+
+def respond(payload, status=200):
+    """(response, status) in MessagePack if the client prefers it, else JSON
+
+    JSON stays the default: a client only gets MessagePack by ranking it
+    above application/json in its Accept header.
+    """
+    if msgpack is not None:
+        best = request.accept_mimetypes.best_match((JSON,) + MSGPACK_TYPES)
+        if best in MSGPACK_TYPES:
+            return Response(msgpack.packb(payload), mimetype=MSGPACK), status
+    return jsonify(payload), status
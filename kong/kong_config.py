@@ -0,0 +1,456 @@
+"""
+Desired Kong gateway state as a declarative config
+
+The service, routes, consumer, key-auth, rate-limiting and file-log setup
+is described once here. It is rendered to kong.yml for DB-less Kong,
+checked offline, diffed against a running gateway's Admin API and applied
+in bulk: one POST /config on DB-less Kong, otherwise only the entities
+that differ are created, replaced or deleted.
+"""
+
+import os
+from urllib.parse import urlsplit
+
+import requests
+import yaml
+
+FORMAT_VERSIONS = ('1.1', '2.1', '3.0')
+
+# Entities created by this tool; only these are ever deleted from a database-backed gateway
+TAG = 'aipeople'
+
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'}
+
+# rate-limiting windows, shortest first; a longer window may not have a lower limit
+RATE_LIMIT_WINDOWS = ('second', 'minute', 'hour', 'day', 'month', 'year')
+
+# Kong matches route paths by prefix and prefers the longest, so these do not overlap.
+# Streamed events must reach the client as they are written, not when the response ends.
+ROUTES = (
+    # (name, path, response_buffering)
+    ('process-request-route', '/process-request', True),
+    ('process-requests-route', '/process-requests', True),
+    ('process-request-stream-route', '/process-request/stream', False),
+)
+
+# Order in which entities are created; deletions run the other way
+COLLECTIONS = ('services', 'routes', 'consumers', 'keyauth_credentials', 'plugins')
+
+HEADER = "# Generated by kong/setup-kong.py render; edit kong/kong_config.py instead\n"
+
+# Proxy URL published on the host for each gateway in docker-compose.yml, by the
+# Admin API address inside the compose network and on the host
+PUBLISHED_PROXY_URLS = {
+    'kong:8001': 'http://localhost:8000',
+    'localhost:8001': 'http://localhost:8000',
+    'kong-postgres:8001': 'http://localhost:8010',
+    'localhost:8011': 'http://localhost:8010',
+}
+
+
+def desired_config(orchestrator_url='http://orchestrator:5000', api_key='my-secret-api-key-12345',
+                   rate_limit_minute=5, log_path='/logs/kong-requests.log'):
+    """The gateway configuration in Kong's declarative format"""
+    return {
+        "_format_version": "3.0",
+        "services": [{
+            "name": "orchestrator-service",
+            # No path: every route's path reaches the orchestrator unchanged
+            "url": orchestrator_url,
+            "tags": [TAG],
+            "routes": [{
+                "name": name,
+                "paths": [path],
+                "methods": ["POST"],
+                "strip_path": False,
+                "response_buffering": buffering,
+                "tags": [TAG]
+            } for name, path, buffering in ROUTES],
+            "plugins": [{
+                "name": "key-auth",
+                "config": {"key_names": ["X-API-KEY", "apikey"]},
+                "tags": [TAG]
+            }, {
+                "name": "rate-limiting",
+                "config": {"minute": rate_limit_minute, "policy": "local"},
+                "tags": [TAG]
+            }]
+        }],
+        "consumers": [{
+            "username": "api-client",
+            "tags": [TAG],
+            "keyauth_credentials": [{"key": api_key, "tags": [TAG]}]
+        }],
+        "plugins": [{
+            "name": "file-log",
+            "config": {"path": log_path},
+            "tags": [TAG]
+        }]
+    }
+
+
+def config_from_env():
+    """desired_config() from ORCHESTRATOR_URL, KONG_API_KEY, KONG_RATE_LIMIT_MINUTE and KONG_LOG_PATH"""
+    return desired_config(
+        orchestrator_url=os.getenv('ORCHESTRATOR_URL', 'http://orchestrator:5000'),
+        api_key=os.getenv('KONG_API_KEY', 'my-secret-api-key-12345'),
+        rate_limit_minute=int(os.getenv('KONG_RATE_LIMIT_MINUTE', '5')),
+        log_path=os.getenv('KONG_LOG_PATH', '/logs/kong-requests.log')
+    )
+
+
+def gateway_url(admin_url):
+    """Proxy URL clients use for the gateway behind admin_url
+
+    The compose gateways publish their proxy on the host ports in
+    PUBLISHED_PROXY_URLS; any other gateway is assumed to proxy on port
+    8000 of the Admin API's host.
+    """
+    parts = urlsplit(admin_url)
+    return PUBLISHED_PROXY_URLS.get(f"{parts.hostname}:{parts.port or 80}") or f"http://{parts.hostname}:8000"
+
+
+def render(config):
+    return HEADER + yaml.safe_dump(config, sort_keys=False, default_flow_style=False)
+
+
+def load(path):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+# Offline validation
+
+def _check_plugin(plugin, where, errors):
+    name = plugin.get('name')
+    config = plugin.get('config') or {}
+    if name == 'key-auth':
+        key_names = config.get('key_names')
+        if not key_names or not all(isinstance(key, str) and key for key in key_names):
+            errors.append(f"{where}: key-auth needs a non-empty list of key_names")
+    elif name == 'rate-limiting':
+        limits = [(window, config[window]) for window in RATE_LIMIT_WINDOWS if config.get(window) is not None]
+        if not limits:
+            errors.append(f"{where}: rate-limiting needs at least one of {', '.join(RATE_LIMIT_WINDOWS)}")
+        for window, limit in limits:
+            if not isinstance(limit, (int, float)) or isinstance(limit, bool) or limit <= 0:
+                errors.append(f"{where}: rate-limiting {window} must be a positive number")
+        for (shorter, low), (longer, high) in zip(limits, limits[1:]):
+            if isinstance(low, (int, float)) and isinstance(high, (int, float)) and high < low:
+                errors.append(f"{where}: rate-limiting {longer} ({high}) is lower than {shorter} ({low})")
+        if config.get('policy', 'local') not in ('local', 'redis'):
+            # 'cluster' keeps counters in the database, which DB-less Kong does not have
+            errors.append(f"{where}: rate-limiting policy must be 'local' or 'redis' without a database")
+    elif name == 'file-log':
+        if not str(config.get('path', '')).startswith('/'):
+            errors.append(f"{where}: file-log needs an absolute path")
+    else:
+        errors.append(f"{where}: unknown plugin {name!r}")
+
+
+def validate(config):
+    """Problems with a declarative config, as messages; empty when it is usable
+
+    Checks the parts of Kong's schema this gateway relies on, without a
+    running Kong: names, references, route overlaps and plugin settings.
+    """
+    if not isinstance(config, dict):
+        return ["config must be a mapping"]
+    errors = []
+    if str(config.get('_format_version')) not in FORMAT_VERSIONS:
+        errors.append(f"_format_version must be one of {', '.join(FORMAT_VERSIONS)}")
+    unsupported = set(config) - {'_format_version', '_transform', 'services', 'consumers', 'plugins'}
+    if unsupported:
+        errors.append(f"unsupported top-level keys: {', '.join(sorted(unsupported))}")
+
+    services, routes, consumers, keys = set(), set(), set(), set()
+    route_methods = {}
+    scoped_plugins = []
+    for service in config.get('services') or []:
+        name = service.get('name')
+        where = f"service {name!r}"
+        if not name or name in services:
+            errors.append(f"{where}: services need a unique name")
+        services.add(name)
+        url = urlsplit(service.get('url') or '')
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            errors.append(f"{where}: url must be an http(s) URL")
+        for route in service.get('routes') or []:
+            route_name = route.get('name')
+            route_where = f"route {route_name!r}"
+            if not route_name or route_name in routes:
+                errors.append(f"{route_where}: routes need a unique name")
+            routes.add(route_name)
+            paths = route.get('paths') or []
+            if not paths:
+                errors.append(f"{route_where}: needs at least one path")
+            methods = set(route.get('methods') or HTTP_METHODS)
+            if methods - HTTP_METHODS:
+                errors.append(f"{route_where}: unknown methods {', '.join(sorted(methods - HTTP_METHODS))}")
+            for path in paths:
+                if not isinstance(path, str) or not path.startswith(('/', '~')):
+                    errors.append(f"{route_where}: path {path!r} must start with '/' (or '~' for a regex)")
+                for other, other_methods in route_methods.get(path, []):
+                    if methods & other_methods:
+                        errors.append(f"{route_where}: path {path} is also routed by {other!r}")
+                route_methods.setdefault(path, []).append((route_name, methods))
+            for flag in ('strip_path', 'preserve_host', 'request_buffering', 'response_buffering'):
+                if flag in route and not isinstance(route[flag], bool):
+                    errors.append(f"{route_where}: {flag} must be true or false")
+            scoped_plugins += [(plugin, f"plugin {plugin.get('name')!r} on {route_where}")
+                               for plugin in route.get('plugins') or []]
+        scoped_plugins += [(plugin, f"plugin {plugin.get('name')!r} on {where}")
+                           for plugin in service.get('plugins') or []]
+
+    for consumer in config.get('consumers') or []:
+        username = consumer.get('username')
+        where = f"consumer {username!r}"
+        if not username or username in consumers:
+            errors.append(f"{where}: consumers need a unique username")
+        consumers.add(username)
+        for credential in consumer.get('keyauth_credentials') or []:
+            key = credential.get('key')
+            if not isinstance(key, str) or not key:
+                errors.append(f"{where}: key-auth credentials need a key")
+            elif key in keys:
+                errors.append(f"{where}: key-auth key is used twice")
+            keys.add(key)
+
+    for plugin in config.get('plugins') or []:
+        where = f"plugin {plugin.get('name')!r}"
+        for field, known in (('service', services), ('route', routes), ('consumer', consumers)):
+            if plugin.get(field) is not None and plugin[field] not in known:
+                errors.append(f"{where}: unknown {field} {plugin[field]!r}")
+        scoped_plugins.append((plugin, where))
+
+    scopes = set()
+    for plugin, where in scoped_plugins:
+        _check_plugin(plugin, where, errors)
+        scope = (where.partition(' on ')[2], plugin.get('service'), plugin.get('route'),
+                 plugin.get('consumer'), plugin.get('name'))
+        if scope in scopes:
+            errors.append(f"{where}: configured twice in the same scope")
+        scopes.add(scope)
+    if 'key-auth' in {plugin.get('name') for plugin, _ in scoped_plugins} and not keys:
+        errors.append("key-auth is enabled but no consumer has a key")
+    return errors
+
+
+# Comparison with a running gateway
+
+def normalize_url(url):
+    """scheme://host:port/path with the default port filled in"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    return f"{parts.scheme}://{parts.hostname}:{port}{parts.path if parts.path not in ('', '/') else ''}"
+
+
+def _plugin_key(plugin, scope):
+    return (plugin['name'], scope.get('service'), scope.get('route'), scope.get('consumer'))
+
+
+def flatten(config):
+    """{collection: {natural key: fields}} from a declarative config
+
+    Entities are keyed the way they are identified across gateways:
+    services and routes by name, consumers by username, credentials by
+    key and plugins by (name, service, route, consumer). References are
+    names, so the result can be compared with flatten_admin().
+    """
+    flat = {collection: {} for collection in COLLECTIONS}
+
+    def add_plugins(plugins, scope):
+        for plugin in plugins or []:
+            own_scope = {field: plugin.get(field) for field in ('service', 'route', 'consumer')}
+            own_scope.update({field: name for field, name in scope.items() if name is not None})
+            fields = {key: value for key, value in plugin.items() if key not in ('service', 'route', 'consumer')}
+            flat['plugins'][_plugin_key(plugin, own_scope)] = dict(fields, **own_scope)
+
+    for service in config.get('services') or []:
+        flat['services'][service['name']] = {
+            key: normalize_url(value) if key == 'url' else value
+            for key, value in service.items() if key not in ('routes', 'plugins')
+        }
+        add_plugins(service.get('plugins'), {'service': service['name']})
+        for route in service.get('routes') or []:
+            flat['routes'][route['name']] = dict(
+                {key: value for key, value in route.items() if key != 'plugins'}, service=service['name'])
+            add_plugins(route.get('plugins'), {'route': route['name']})
+    for consumer in config.get('consumers') or []:
+        flat['consumers'][consumer['username']] = {
+            key: value for key, value in consumer.items() if key != 'keyauth_credentials'}
+        for credential in consumer.get('keyauth_credentials') or []:
+            flat['keyauth_credentials'][credential['key']] = dict(credential, consumer=consumer['username'])
+    add_plugins(config.get('plugins'), {})
+    return flat
+
+
+class AdminAPI:
+    """Minimal Kong Admin API client"""
+
+    ENDPOINTS = {'services': 'services', 'routes': 'routes', 'consumers': 'consumers',
+                 'keyauth_credentials': 'key-auths', 'plugins': 'plugins'}
+
+    def __init__(self, url, timeout=10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(method, f"{self.url}{path}", timeout=self.timeout, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} failed with {response.status_code}: {response.text}")
+        return response.json() if response.content else None
+
+    def database(self):
+        """'off' for DB-less Kong, else the database it uses"""
+        return self.request('GET', '/')['configuration']['database']
+
+    def list(self, collection):
+        path = f"/{self.ENDPOINTS[collection]}"
+        entities = []
+        while path:
+            page = self.request('GET', path)
+            entities += page['data']
+            path = page.get('next')
+        return entities
+
+
+def flatten_admin(api):
+    """(flatten()-shaped entities, {collection: {natural key: id}}) read from a running gateway"""
+    raw = {collection: api.list(collection) for collection in COLLECTIONS}
+    names = {
+        'service': {entity['id']: entity['name'] for entity in raw['services']},
+        'route': {entity['id']: entity['name'] for entity in raw['routes']},
+        'consumer': {entity['id']: entity['username'] for entity in raw['consumers']}
+    }
+
+    def ref(entity, field):
+        value = entity.get(field)
+        return names[field].get(value['id']) if value else None
+
+    flat = {collection: {} for collection in COLLECTIONS}
+    ids = {collection: {} for collection in COLLECTIONS}
+    for service in raw['services']:
+        url = f"{service['protocol']}://{service['host']}:{service['port']}{service.get('path') or ''}"
+        flat['services'][service['name']] = dict(service, url=normalize_url(url))
+        ids['services'][service['name']] = service['id']
+    for route in raw['routes']:
+        flat['routes'][route['name']] = dict(route, service=ref(route, 'service'))
+        ids['routes'][route['name']] = route['id']
+    for consumer in raw['consumers']:
+        flat['consumers'][consumer['username']] = consumer
+        ids['consumers'][consumer['username']] = consumer['id']
+    for credential in raw['keyauth_credentials']:
+        flat['keyauth_credentials'][credential['key']] = dict(credential, consumer=ref(credential, 'consumer'))
+        ids['keyauth_credentials'][credential['key']] = credential['id']
+    for plugin in raw['plugins']:
+        scope = {field: ref(plugin, field) for field in ('service', 'route', 'consumer')}
+        key = _plugin_key(plugin, scope)
+        flat['plugins'][key] = dict(plugin, **scope)
+        ids['plugins'][key] = plugin['id']
+    return flat, ids
+
+
+def _differences(desired, current, prefix=''):
+    """Fields of desired that current does not match; Kong's defaults for other fields are ignored"""
+    changes = []
+    for field, value in desired.items():
+        name = f"{prefix}{field}"
+        actual = current.get(field) if isinstance(current, dict) else None
+        if isinstance(value, dict) and isinstance(actual, dict):
+            changes += _differences(value, actual, prefix=f"{name}.")
+        elif field == 'tags' or (isinstance(value, list) and isinstance(actual, list) and field == 'methods'):
+            if sorted(value or []) != sorted(actual or []):
+                changes.append((name, actual, value))
+        elif value != actual:
+            changes.append((name, actual, value))
+    return changes
+
+
+def diff(desired, current):
+    """[(action, collection, key, field changes)] turning current into desired
+
+    action is 'create', 'update' or 'delete'. An entity not in desired is
+    only deleted if it carries TAG, except on DB-less Kong, where the
+    whole configuration is replaced.
+    """
+    changes = []
+    for collection in COLLECTIONS:
+        for key, fields in desired[collection].items():
+            if key not in current[collection]:
+                changes.append(('create', collection, key, []))
+                continue
+            differences = _differences(fields, current[collection][key])
+            if differences:
+                changes.append(('update', collection, key, differences))
+    for collection in reversed(COLLECTIONS):
+        for key, fields in current[collection].items():
+            if key not in desired[collection]:
+                changes.append(('delete', collection, key, [] if TAG in (fields.get('tags') or []) else None))
+    return changes
+
+
+def describe(change):
+    action, collection, key, fields = change
+    label = ' / '.join(str(part) for part in key if part) if isinstance(key, tuple) else key
+    kind = collection.rstrip('s').replace('keyauth_credential', 'key-auth credential')
+    if collection == 'keyauth_credentials':
+        label = f"{label[:4]}…"
+    symbol = {'create': '+', 'update': '~', 'delete': '-'}[action]
+    line = f"{symbol} {kind} {label}"
+    if fields is None:
+        line += " (not managed here: kept on a database-backed gateway)"
+    for name, old, new in fields or []:
+        line += f"\n    {name}: {old!r} -> {new!r}"
+    return line
+
+
+def _body(collection, fields, ids):
+    """Admin API body for an entity from its flatten() fields"""
+    body = dict(fields)
+    for field, target in (('service', 'services'), ('route', 'routes'), ('consumer', 'consumers')):
+        if field in body:
+            body[field] = {"id": ids[target][body[field]]} if body[field] is not None else None
+    if collection == 'keyauth_credentials':
+        body.pop('consumer')
+    return body
+
+
+def apply(api, desired_config_, log=print):
+    """Bring a running gateway to desired_config_; returns the changes made"""
+    desired = flatten(desired_config_)
+    current, ids = flatten_admin(api)
+    changes = diff(desired, current)
+    if api.database() == 'off':
+        if changes:
+            # One request replaces the whole configuration; unchanged configs are skipped by hash
+            api.request('POST', '/config', params={'check_hash': 1},
+                        json={"config": yaml.safe_dump(desired_config_, sort_keys=False)})
+        for change in changes:
+            log(describe(change))
+        return changes
+
+    applied = []
+    for action, collection, key, fields in changes:
+        endpoint = AdminAPI.ENDPOINTS[collection]
+        if action == 'delete':
+            if fields is None:
+                continue
+            api.request('DELETE', f"/{endpoint}/{ids[collection][key]}")
+        else:
+            body = _body(collection, desired[collection][key], ids)
+            if collection == 'keyauth_credentials':
+                consumer = ids['consumers'][desired[collection][key]['consumer']]
+                path = f"/consumers/{consumer}/key-auth"
+            else:
+                path = f"/{endpoint}"
+            if action == 'update':
+                # PUT replaces the entity, so fields dropped from the desired state go back to defaults
+                entity = api.request('PUT', f"{path}/{ids[collection][key]}", json=body)
+            else:
+                entity = api.request('POST', path, json=body)
+            ids[collection][key] = entity['id']
+        applied.append((action, collection, key, fields))
+        log(describe(applied[-1]))
+    return applied
@@ -1,23 +1,37 @@
 #!/usr/bin/env python3
 """
 Kong Gateway Configuration Script
-This script configures Kong with services, routes, and plugins
+Renders, checks, diffs and applies the gateway configuration in kong_config.py
+
+Usage:
+    python setup-kong.py render -o kong.yml     # declarative config for DB-less Kong
+    python setup-kong.py render --check -o kong.yml
+    python setup-kong.py validate kong.yml      # offline, no Kong needed
+    python setup-kong.py diff                   # what apply would change
+    python setup-kong.py apply                  # default: converge a running Kong
 """
 
-import requests
-import time
-import json
+import argparse
+import os
 import sys
+import time
+
+import requests
+
+import kong_config
+
+KONG_ADMIN_URL = os.getenv('KONG_ADMIN_URL', 'http://kong:8001')
 
-KONG_ADMIN_URL = "http://kong:8001"
-ORCHESTRATOR_URL = "http://orchestrator:5000"
+# Proxy URL shown to clients; by default the one published for the Admin API's gateway
+KONG_GATEWAY_URL = os.getenv('KONG_GATEWAY_URL')
 
-def wait_for_kong(max_retries=30):
+
+def wait_for_kong(admin_url, max_retries=30):
     """Wait for Kong to be ready"""
     print("Waiting for Kong to be ready...")
     for i in range(max_retries):
         try:
-            response = requests.get(f"{KONG_ADMIN_URL}/status", timeout=5)
+            response = requests.get(f"{admin_url}/status", timeout=5)
             if response.status_code == 200:
                 print("Kong is ready!")
                 return True
@@ -27,218 +41,106 @@ def wait_for_kong(max_retries=30):
         time.sleep(2)
     return False
 
-def create_service():
-    """Create Kong service for orchestrator"""
-    print("\nCreating Kong service...")
-    
-    # Check if service already exists
-    try:
-        response = requests.get(f"{KONG_ADMIN_URL}/services/orchestrator-service")
-        if response.status_code == 200:
-            print("Service already exists, updating...")
-            response = requests.patch(
-                f"{KONG_ADMIN_URL}/services/orchestrator-service",
-                json={
-                    "url": f"{ORCHESTRATOR_URL}/process-request"
-                }
-            )
-        else:
-            response = requests.post(
-                f"{KONG_ADMIN_URL}/services",
-                json={
-                    "name": "orchestrator-service",
-                    "url": f"{ORCHESTRATOR_URL}/process-request"
-                }
-            )
-    except:
-        response = requests.post(
-            f"{KONG_ADMIN_URL}/services",
-            json={
-                "name": "orchestrator-service",
-                "url": f"{ORCHESTRATOR_URL}/process-request"
-            }
-        )
-    
-    if response.status_code in [200, 201]:
-        print(f"Service created/updated successfully: {response.json()['id']}")
-        return response.json()
-    else:
-        print(f"Failed to create service: {response.text}")
-        return None
-
-def create_route(service_id):
-    """Create route for the service"""
-    print("\nCreating Kong route...")
-    
-    response = requests.post(
-        f"{KONG_ADMIN_URL}/services/{service_id}/routes",
-        json={
-            "name": "process-request-route",
-            "paths": ["/process-request"],
-            "methods": ["POST"],
-            "strip_path": False
-        }
-    )
-    
-    if response.status_code in [200, 201, 409]:
-        route = response.json()
-        print(f"Route created successfully: {route.get('id', 'existing')}")
-        return route
-    else:
-        print(f"Failed to create route: {response.text}")
-        return None
-
-def create_consumer():
-    """Create a consumer for API key authentication"""
-    print("\nCreating Kong consumer...")
-    
-    response = requests.post(
-        f"{KONG_ADMIN_URL}/consumers",
-        json={
-            "username": "api-client"
-        }
-    )
-    
-    if response.status_code in [200, 201, 409]:
-        consumer = response.json()
-        print(f"Consumer created: {consumer.get('id', 'existing')}")
-        return consumer
-    else:
-        print(f"Failed to create consumer: {response.text}")
-        return None
-
-def create_api_key(consumer_username):
-    """Create API key for consumer"""
-    print("\nCreating API key...")
-    
-    response = requests.post(
-        f"{KONG_ADMIN_URL}/consumers/{consumer_username}/key-auth",
-        json={
-            "key": "my-secret-api-key-12345"
-        }
-    )
-    
-    if response.status_code in [200, 201, 409]:
-        api_key = response.json()
-        print(f"API Key created: {api_key.get('key', 'existing')}")
-        return api_key
-    else:
-        print(f"Failed to create API key: {response.text}")
-        return None
-
-def enable_key_auth_plugin(service_name):
-    """Enable key authentication plugin"""
-    print("\nEnabling Key Auth plugin...")
-    
-    response = requests.post(
-        f"{KONG_ADMIN_URL}/services/{service_name}/plugins",
-        json={
-            "name": "key-auth",
-            "config": {
-                "key_names": ["X-API-KEY", "apikey"]
-            }
-        }
-    )
-    
-    if response.status_code in [200, 201, 409]:
-        print("Key Auth plugin enabled")
-        return response.json()
-    else:
-        print(f"Failed to enable Key Auth plugin: {response.text}")
-        return None
-
-def enable_rate_limiting_plugin(service_name):
-    """Enable rate limiting plugin - 5 requests per minute"""
-    print("\nEnabling Rate Limiting plugin...")
-    
-    response = requests.post(
-        f"{KONG_ADMIN_URL}/services/{service_name}/plugins",
-        json={
-            "name": "rate-limiting",
-            "config": {
-                "minute": 5,
-                "policy": "local"
-            }
-        }
-    )
-    
-    if response.status_code in [200, 201, 409]:
-        print("Rate Limiting plugin enabled (5 req/min)")
-        return response.json()
-    else:
-        print(f"Failed to enable Rate Limiting plugin: {response.text}")
-        return None
-
-def enable_request_logging():
-    """Enable request logging"""
-    print("\nEnabling Request Logging...")
-    
-    response = requests.post(
-        f"{KONG_ADMIN_URL}/plugins",
-        json={
-            "name": "file-log",
-            "config": {
-                "path": "/logs/kong-requests.log"
-            }
-        }
-    )
-    
-    if response.status_code in [200, 201, 409]:
-        print("Request logging enabled")
-        return response.json()
+
+def desired(args):
+    """The config to work with: --file if given, else rendered from the environment"""
+    config = kong_config.load(args.file) if getattr(args, 'file', None) else kong_config.config_from_env()
+    errors = kong_config.validate(config)
+    if errors:
+        print("Invalid configuration:", file=sys.stderr)
+        for error in errors:
+            print(f"  {error}", file=sys.stderr)
+        sys.exit(1)
+    return config
+
+
+def render(args):
+    text = kong_config.render(desired(args))
+    if args.check:
+        existing = open(args.output).read() if os.path.exists(args.output) else None
+        if existing != text:
+            print(f"{args.output} is out of date; run: python kong/setup-kong.py render -o {args.output}",
+                  file=sys.stderr)
+            sys.exit(1)
+        print(f"{args.output} is up to date")
+    elif args.output == '-':
+        sys.stdout.write(text)
     else:
-        print(f"Failed to enable logging: {response.text}")
-        return None
+        with open(args.output, 'w') as f:
+            f.write(text)
+        print(f"Wrote {args.output}")
 
-def main():
-    """Main configuration flow"""
+
+def validate(args):
+    desired(args)
+    print(f"{args.file or 'rendered configuration'} is valid")
+
+
+def diff(args):
+    api = kong_config.AdminAPI(args.admin_url)
+    current, _ = kong_config.flatten_admin(api)
+    changes = kong_config.diff(kong_config.flatten(desired(args)), current)
+    for change in changes:
+        print(kong_config.describe(change))
+    print(f"{len(changes)} change(s)" if changes else "Kong matches the desired configuration")
+    # Like diff(1): 1 when there are differences
+    sys.exit(1 if changes and args.exit_code else 0)
+
+
+def apply(args):
+    config = desired(args)
     print("=" * 60)
     print("Kong Gateway Configuration Script")
     print("=" * 60)
-    
-    # Wait for Kong to be ready
-    if not wait_for_kong():
+
+    if not wait_for_kong(args.admin_url):
         print("ERROR: Kong did not become ready in time!")
         sys.exit(1)
-    
-    # Create service
-    service = create_service()
-    if not service:
-        sys.exit(1)
-    
-    # Create route
-    route = create_route("orchestrator-service")
-    if not route:
-        sys.exit(1)
-    
-    # Create consumer
-    consumer = create_consumer()
-    if not consumer:
-        sys.exit(1)
-    
-    # Create API key
-    api_key = create_api_key("api-client")
-    
-    # Enable plugins
-    enable_key_auth_plugin("orchestrator-service")
-    enable_rate_limiting_plugin("orchestrator-service")
-    enable_request_logging()
-    
+
+    changes = kong_config.apply(kong_config.AdminAPI(args.admin_url), config)
+    consumer = config['consumers'][0]
+    limit = next(plugin['config']['minute'] for plugin in config['services'][0]['plugins']
+                 if plugin['name'] == 'rate-limiting')
+
     print("\n" + "=" * 60)
-    print("Kong Configuration Complete!")
+    print(f"Kong Configuration Complete! ({len(changes)} change(s))")
     print("=" * 60)
     print("\nConfiguration Summary:")
-    print(f"  Gateway URL: http://localhost:8000")
-    print(f"  Admin API URL: http://localhost:8001")
-    print(f"  API Key: my-secret-api-key-12345")
-    print(f"  Rate Limit: 5 requests/minute")
-    print("\nTest with:")
-    print('  curl -X POST http://localhost:8000/process-request \\')
-    print('    -H "X-API-KEY: my-secret-api-key-12345" \\')
-    print('    -H "Content-Type: application/json" \\')
-    print('    -d \'{"request_id": "req-001", "query": "machine learning"}\'')
+    print(f"  Gateway URL: {KONG_GATEWAY_URL or kong_config.gateway_url(args.admin_url)}")
+    print(f"  Admin API URL: {args.admin_url}")
+    print(f"  API Key: {consumer['keyauth_credentials'][0]['key']}")
+    print(f"  Rate Limit: {limit} requests/minute")
     print("=" * 60)
 
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+
+    render_parser = commands.add_parser('render', help="write the declarative config")
+    render_parser.add_argument('-o', '--output', default='-', help="file to write ('-' for stdout)")
+    render_parser.add_argument('--check', action='store_true', help="fail if --output is stale instead")
+    render_parser.set_defaults(handler=render)
+
+    validate_parser = commands.add_parser('validate', help="check a declarative config offline")
+    validate_parser.add_argument('file', nargs='?', help="kong.yml (default: the rendered config)")
+    validate_parser.set_defaults(handler=validate)
+
+    for name, handler, help_text in (('diff', diff, "show what apply would change"),
+                                     ('apply', apply, "bring a running Kong to the desired config")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--admin-url', default=KONG_ADMIN_URL)
+        command.add_argument('--file', help="kong.yml to use instead of rendering from the environment")
+        command.set_defaults(handler=handler)
+    commands.choices['diff'].add_argument('--exit-code', action='store_true',
+                                          help="exit 1 when there are differences")
+
+    args = parser.parse_args()
+    if args.command is None:
+        # The kong-setup container runs the script without arguments
+        args = parser.parse_args(['apply'])
+    args.handler(args)
+
+
 if __name__ == "__main__":
     main()
-
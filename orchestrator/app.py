@@ -1,43 +1,144 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import requests
 import logging
-import json
+import math
 import os
-from datetime import datetime
 import uuid
 
+from prometheus_client import Counter, Histogram
+
+from common.audit import AuditWriter
+from common.metrics import DEFAULT_BUCKETS, StageTimer, instrument_flask
+from downstream import ServiceClient
+from idempotency import CACHED, OWNER, IdempotencyStore
+from pipeline import PIPELINE_MODES, DistributedPipeline, MonolithPipeline, StepError
+from query_cache import QueryCache, ServiceVersions
+from resilience import CircuitOpenError
+from streaming import STREAM_FORMATS, STREAM_HEADERS, encode_event, stream_format
+
 app = Flask(__name__)
 
 # Setup logging
-os.makedirs('/app/logs', exist_ok=True)
 logging.basicConfig(level=logging.INFO)
 
-# In-memory cache for idempotency
-request_cache = {}
+# Audit records are written in batches by a background thread
+AUDIT = AuditWriter.from_env('orchestrator')
 
 # Service URLs
 POLICY_SERVICE_URL = os.getenv('POLICY_SERVICE_URL', 'http://policy-service:5001')
 RETRIEVER_SERVICE_URL = os.getenv('RETRIEVER_SERVICE_URL', 'http://retriever-agent:5002')
 PROCESSOR_SERVICE_URL = os.getenv('PROCESSOR_SERVICE_URL', 'http://processor-agent:5003')
 
-def log_audit(trace_id, request_id, endpoint, status, details):
-    """Log request to audit.jsonl"""
-    log_entry = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "service": "orchestrator",
-        "trace_id": trace_id,
-        "request_id": request_id,
-        "endpoint": endpoint,
-        "status": status,
-        "details": details
-    }
-    
-    with open('/app/logs/audit.jsonl', 'a') as f:
-        f.write(json.dumps(log_entry) + '\n')
+# 'distributed' calls the services over HTTP; 'monolith' runs their logic in-process
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'distributed')
+if PIPELINE_MODE not in PIPELINE_MODES:
+    raise ValueError(f"Unknown PIPELINE_MODE: {PIPELINE_MODE}")
+
+# Have the retriever return document references instead of full documents
+DOCUMENT_REFS = os.getenv('DOCUMENT_REFS', 'false').lower() == 'true'
+
+# Largest number of items accepted by /process-requests
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+
+# Results of allowed queries cached per worker by normalized query (0 disables),
+# for at most QUERY_CACHE_TTL seconds; in distributed mode the corpus and policy
+# versions they depend on are checked every QUERY_CACHE_VERSION_INTERVAL seconds
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '60'))
+QUERY_CACHE_VERSION_INTERVAL = float(os.getenv('QUERY_CACHE_VERSION_INTERVAL', '2'))
+
+def log_audit(trace_id, request_id, endpoint, status, details, service='orchestrator'):
+    """Queue a record for audit.jsonl"""
+    AUDIT.log(trace_id, request_id, endpoint, status, details, service=service)
+
+if PIPELINE_MODE == 'monolith':
+    # Same cache metric as the processor service
+    CACHE_LOOKUPS = Counter('processor_cache_lookups_total', "Processing cache lookups by cache and result",
+                            ('cache', 'result'))
+    PIPELINE = MonolithPipeline(
+        log_audit,
+        policy_rules_path=os.getenv('POLICY_RULES_PATH', '/app/policy_rules.json'),
+        documents_path=os.getenv('DOCUMENTS_PATH', '/app/documents.json'),
+        search_mode=os.getenv('SEARCH_MODE', 'bm25'),
+        store_path=os.getenv('DOCUMENT_STORE_PATH'),
+        hot_reload=os.getenv('HOT_RELOAD', 'false').lower() == 'true',
+        hot_reload_interval=float(os.getenv('HOT_RELOAD_INTERVAL', '2')),
+        result_cache_size=int(os.getenv('RESULT_CACHE_SIZE', '1024')),
+        on_cache_lookup=lambda cache, hit: CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+    )
+else:
+    # One pooled keep-alive client per service, tuned through
+    # {POLICY,RETRIEVER,PROCESSOR}_{POOL_SIZE,KEEP_ALIVE,CONNECT_TIMEOUT,TIMEOUT};
+    # each adapts its timeouts, hedges slow calls and has a circuit breaker
+    PIPELINE = DistributedPipeline(
+        ServiceClient.from_env('policy-service', 'POLICY', POLICY_SERVICE_URL, read_timeout=5),
+        ServiceClient.from_env('retriever-agent', 'RETRIEVER', RETRIEVER_SERVICE_URL, read_timeout=10),
+        ServiceClient.from_env('processor-agent', 'PROCESSOR', PROCESSOR_SERVICE_URL, read_timeout=10),
+        search_mode=os.getenv('SEARCH_MODE', 'bm25'),
+        refs=DOCUMENT_REFS,
+        service_versions=ServiceVersions(RETRIEVER_SERVICE_URL, POLICY_SERVICE_URL,
+                                         interval=QUERY_CACHE_VERSION_INTERVAL) if QUERY_CACHE_SIZE > 0 else None
+    )
+
+# Idempotency store shared by every worker process on this host. An unfinished
+# claim is taken over after IDEMPOTENCY_LEASE seconds, by default the longest a
+# run can take: every step's connect plus read timeout, doubled when hedged
+# (30 in monolith mode, where no timeouts apply)
+IDEMPOTENCY = IdempotencyStore(
+    os.getenv('IDEMPOTENCY_DB_PATH', '/tmp/orchestrator-idempotency.db'),
+    ttl=float(os.getenv('IDEMPOTENCY_TTL', '3600')),
+    max_entries=int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000')),
+    max_bytes=int(os.getenv('IDEMPOTENCY_MAX_BYTES', str(64 * 1024 * 1024))),
+    lease=float(os.getenv('IDEMPOTENCY_LEASE', str(PIPELINE.max_seconds() or 30)))
+)
+
+QUERY_CACHE = QueryCache(PIPELINE.versions, QUERY_CACHE_SIZE, QUERY_CACHE_TTL) if QUERY_CACHE_SIZE > 0 else None
+
+# Request latency and in-flight metrics, served on /metrics
+instrument_flask(app)
+STAGE_SECONDS = Histogram('orchestrator_stage_duration_seconds', "Time spent in each pipeline stage",
+                          ('endpoint', 'stage'), buckets=DEFAULT_BUCKETS)
+IDEMPOTENCY_LOOKUPS = Counter('idempotency_lookups_total', "Idempotency store lookups by result",
+                              ('endpoint', 'result'))
+QUERY_CACHE_LOOKUPS = Counter('query_cache_lookups_total', "Query cache lookups by result",
+                              ('endpoint', 'result'))
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "service": "orchestrator"}), 200
+    return jsonify({"status": "healthy", "service": "orchestrator", "pipeline_mode": PIPELINE_MODE}), 200
+
+@app.route('/downstream/stats', methods=['GET'])
+def downstream_stats():
+    """Connection pool statistics per downstream service"""
+    return jsonify({"pipeline_mode": PIPELINE_MODE, "services": PIPELINE.pool_stats()}), 200
+
+@app.route('/idempotency/stats', methods=['GET'])
+def idempotency_stats():
+    """Size and bounds of the shared idempotency store"""
+    return jsonify(IDEMPOTENCY.stats()), 200
+
+@app.route('/query-cache/stats', methods=['GET'])
+def query_cache_stats():
+    """Size, bounds and versions of this worker's query cache"""
+    if QUERY_CACHE is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(QUERY_CACHE.stats(), enabled=True)), 200
+
+def query_cache_lookup(endpoint, query):
+    """(versions, cached): cached is (result, allowed) from the query cache, or None"""
+    if QUERY_CACHE is None:
+        return None, None
+    versions = QUERY_CACHE.current_versions()
+    if versions is None:
+        # Versions unknown: cannot tell whether cached results are current
+        QUERY_CACHE_LOOKUPS.labels(endpoint, 'bypass').inc()
+        return None, None
+    cached = QUERY_CACHE.lookup(query, versions)
+    if cached is None:
+        QUERY_CACHE_LOOKUPS.labels(endpoint, 'miss').inc()
+    else:
+        QUERY_CACHE_LOOKUPS.labels(endpoint, 'hit' if cached[1] else 'revalidate').inc()
+    return versions, cached
 
 @app.route('/process-request', methods=['POST'])
 def process_request():
@@ -55,111 +156,398 @@ def process_request():
     if not query:
         return jsonify({"error": "query is required"}), 400
     
-    # Check for idempotency - return cached response if exists
-    if request_id in request_cache:
-        cached_response = request_cache[request_id]
+    # Check for idempotency - return the stored response, waiting first for
+    # an in-flight request with the same request_id to finish
+    cached_response, claim = IDEMPOTENCY.claim(request_id)
+    if cached_response is not None:
+        IDEMPOTENCY_LOOKUPS.labels('/process-request', 'hit').inc()
         log_audit(trace_id, request_id, '/process-request', 'cached', {
             "query": query,
             "message": "Returned cached response"
         })
         return jsonify(cached_response), 200
+    IDEMPOTENCY_LOOKUPS.labels('/process-request', 'miss').inc()
     
     log_audit(trace_id, request_id, '/process-request', 'started', {"query": query})
     
-    headers = {
-        'X-Trace-ID': trace_id,
-        'Content-Type': 'application/json'
-    }
+    # Per-stage durations for /metrics and the final audit record
+    timer = StageTimer(STAGE_SECONDS, '/process-request')
     
     try:
-        # Step 1: Check Policy Service
-        policy_response = requests.post(
-            f'{POLICY_SERVICE_URL}/policy',
-            json={"request_id": request_id, "query": query},
-            headers=headers,
-            timeout=5
-        )
-        
-        if policy_response.status_code != 200:
-            log_audit(trace_id, request_id, '/process-request', 'error', 
-                     {"step": "policy", "error": "Policy service error"})
-            return jsonify({"error": "Policy service error"}), 500
-        
-        policy_data = policy_response.json()
-        
-        if not policy_data.get('allowed', False):
-            log_audit(trace_id, request_id, '/process-request', 'denied', 
-                     {"reason": policy_data.get('reason', 'Policy denied')})
-            return jsonify({
-                "request_id": request_id,
-                "trace_id": trace_id,
-                "status": "denied",
-                "reason": policy_data.get('reason', 'Policy denied')
-            }), 403
-        
-        # Step 2: Call Retriever Agent
-        retriever_response = requests.post(
-            f'{RETRIEVER_SERVICE_URL}/retrieve',
-            json={"request_id": request_id, "query": query},
-            headers=headers,
-            timeout=10
-        )
-        
-        if retriever_response.status_code != 200:
-            log_audit(trace_id, request_id, '/process-request', 'error', 
-                     {"step": "retriever", "error": "Retriever service error"})
-            return jsonify({"error": "Retriever service error"}), 500
-        
-        retriever_data = retriever_response.json()
-        documents = retriever_data.get('documents', [])
-        
-        # Step 3: Call Processor Agent
-        processor_response = requests.post(
-            f'{PROCESSOR_SERVICE_URL}/process',
-            json={
-                "request_id": request_id,
-                "query": query,
-                "documents": documents
-            },
-            headers=headers,
-            timeout=10
-        )
+        # Final results of allowed queries, by normalized query
+        versions, cached = query_cache_lookup('/process-request', query)
         
-        if processor_response.status_code != 200:
-            log_audit(trace_id, request_id, '/process-request', 'error', 
-                     {"step": "processor", "error": "Processor service error"})
-            return jsonify({"error": "Processor service error"}), 500
+        # Step 1: Check Policy Service, unless it already allowed this exact query
+        if cached is None or not cached[1]:
+            with timer.stage('policy'):
+                policy_data = PIPELINE.check_policy(trace_id, request_id, query)
+            
+            if not policy_data.get('allowed', False):
+                log_audit(trace_id, request_id, '/process-request', 'denied', 
+                         {"reason": policy_data.get('reason', 'Policy denied'), "durations_ms": timer.as_dict()})
+                return jsonify({
+                    "request_id": request_id,
+                    "trace_id": trace_id,
+                    "status": "denied",
+                    "reason": policy_data.get('reason', 'Policy denied')
+                }), 403
         
-        processor_data = processor_response.json()
+        if cached is not None:
+            result = cached[0]
+            if not cached[1]:
+                QUERY_CACHE.allow(query)
+        else:
+            # Step 2: Call Retriever Agent
+            with timer.stage('retrieve'):
+                documents = PIPELINE.retrieve(trace_id, request_id, query)
+            
+            # Step 3: Call Processor Agent
+            with timer.stage('process'):
+                processor_data = PIPELINE.process(trace_id, request_id, query, documents)
+            result = {
+                "summary": processor_data.get('summary', ''),
+                "label": processor_data.get('label', ''),
+                "document_count": processor_data.get('document_count', 0)
+            }
+            if versions is not None:
+                QUERY_CACHE.store(query, result, versions)
         
         # Build final response
-        response = {
-            "request_id": request_id,
-            "trace_id": trace_id,
-            "summary": processor_data.get('summary', ''),
-            "label": processor_data.get('label', ''),
-            "document_count": processor_data.get('document_count', 0)
-        }
+        response = {"request_id": request_id, "trace_id": trace_id, **result}
         
-        # Cache the response for idempotency
-        request_cache[request_id] = response
+        # Store the response for idempotency
+        IDEMPOTENCY.complete(request_id, claim, response)
         
         log_audit(trace_id, request_id, '/process-request', 'success', {
             "label": response['label'],
-            "document_count": response['document_count']
+            "document_count": response['document_count'],
+            "query_cache": cached is not None,
+            "durations_ms": timer.as_dict()
         })
         
         return jsonify(response), 200
         
+    except StepError as e:
+        log_audit(trace_id, request_id, '/process-request', 'error', 
+                 {"step": e.step, "error": str(e), "durations_ms": timer.as_dict()})
+        return jsonify({"error": str(e)}), 500
+    except CircuitOpenError as e:
+        # Fail fast while a dependency is unhealthy
+        log_audit(trace_id, request_id, '/process-request', 'error', 
+                 {"error": str(e), "circuit_open": e.service, "durations_ms": timer.as_dict()})
+        return jsonify({"error": str(e)}), 503, {'Retry-After': str(math.ceil(e.retry_after))}
     except requests.exceptions.RequestException as e:
         log_audit(trace_id, request_id, '/process-request', 'error', 
-                 {"error": str(e)})
+                 {"error": str(e), "durations_ms": timer.as_dict()})
         return jsonify({"error": f"Service communication error: {str(e)}"}), 500
     except Exception as e:
         log_audit(trace_id, request_id, '/process-request', 'error', 
-                 {"error": str(e)})
+                 {"error": str(e), "durations_ms": timer.as_dict()})
         return jsonify({"error": f"Internal error: {str(e)}"}), 500
+    finally:
+        # No-op once the response is stored; otherwise lets a waiting duplicate run
+        IDEMPOTENCY.release(request_id, claim)
+
+@app.route('/process-request/stream', methods=['POST'])
+def process_request_stream():
+    """Streaming variant of /process-request: one event per completed stage
+    
+    Events: started, policy, documents, then result (or denied/error).
+    NDJSON by default, Server-Sent Events for Accept: text/event-stream.
+    """
+    data = request.get_json()
+    
+    trace_id = str(uuid.uuid4())
+    request_id = data.get('request_id')
+    query = data.get('query', '')
+    fmt = stream_format(request.headers.get('Accept'))
+    
+    if not request_id:
+        return jsonify({"error": "request_id is required"}), 400
+    
+    if not query:
+        return jsonify({"error": "query is required"}), 400
+    
+    cached_response, claim = IDEMPOTENCY.claim(request_id)
+    
+    def events():
+        yield encode_event(fmt, 'started', {"request_id": request_id, "trace_id": trace_id})
+        
+        if cached_response is not None:
+            IDEMPOTENCY_LOOKUPS.labels('/process-request/stream', 'hit').inc()
+            log_audit(trace_id, request_id, '/process-request/stream', 'cached', {
+                "query": query,
+                "message": "Returned cached response"
+            })
+            yield encode_event(fmt, 'result', cached_response)
+            return
+        IDEMPOTENCY_LOOKUPS.labels('/process-request/stream', 'miss').inc()
+        
+        log_audit(trace_id, request_id, '/process-request/stream', 'started', {"query": query})
+        timer = StageTimer(STAGE_SECONDS, '/process-request/stream')
+        
+        try:
+            with timer.stage('policy'):
+                policy_data = PIPELINE.check_policy(trace_id, request_id, query)
+            yield encode_event(fmt, 'policy', {
+                "allowed": policy_data.get('allowed', False),
+                "reason": policy_data.get('reason'),
+                "matched_rules": policy_data.get('matched_rules', [])
+            })
+            
+            if not policy_data.get('allowed', False):
+                log_audit(trace_id, request_id, '/process-request/stream', 'denied',
+                         {"reason": policy_data.get('reason', 'Policy denied'), "durations_ms": timer.as_dict()})
+                yield encode_event(fmt, 'denied', {
+                    "request_id": request_id,
+                    "trace_id": trace_id,
+                    "status": "denied",
+                    "reason": policy_data.get('reason', 'Policy denied')
+                })
+                return
+            
+            with timer.stage('retrieve'):
+                documents = PIPELINE.retrieve(trace_id, request_id, query)
+            yield encode_event(fmt, 'documents', {"documents": documents, "count": len(documents)})
+            
+            with timer.stage('process'):
+                processor_data = PIPELINE.process(trace_id, request_id, query, documents)
+            response = {
+                "request_id": request_id,
+                "trace_id": trace_id,
+                "summary": processor_data.get('summary', ''),
+                "label": processor_data.get('label', ''),
+                "document_count": processor_data.get('document_count', 0)
+            }
+            IDEMPOTENCY.complete(request_id, claim, response)
+            
+            log_audit(trace_id, request_id, '/process-request/stream', 'success', {
+                "label": response['label'],
+                "document_count": response['document_count'],
+                "durations_ms": timer.as_dict()
+            })
+            yield encode_event(fmt, 'result', response)
+        
+        except Exception as e:
+            message, details = step_error(e)
+            log_audit(trace_id, request_id, '/process-request/stream', 'error',
+                      dict(details, durations_ms=timer.as_dict()))
+            yield encode_event(fmt, 'error', {"request_id": request_id, "trace_id": trace_id, "error": message})
+    
+    response = Response(stream_with_context(events()), mimetype=STREAM_FORMATS[fmt], headers=STREAM_HEADERS)
+    # Runs even if the client goes away before the stream starts
+    if claim is not None:
+        response.call_on_close(lambda: IDEMPOTENCY.release(request_id, claim))
+    return response
+
+def step_error(e):
+    """(client message, audit details) for an exception raised by a pipeline step"""
+    if isinstance(e, StepError):
+        return str(e), {"step": e.step, "error": str(e)}
+    if isinstance(e, CircuitOpenError):
+        return str(e), {"error": str(e), "circuit_open": e.service}
+    if isinstance(e, requests.exceptions.RequestException):
+        return f"Service communication error: {str(e)}", {"error": str(e)}
+    return f"Internal error: {str(e)}", {"error": str(e)}
+
+def run_batch(trace_id, entries, results, claims):
+    """Run claimed (index, request_id, query) entries through one call per step
+    
+    Fills results[index] for every entry; a failed step only fails the
+    entries that reached it. Audit records carry the durations of the
+    batch calls the entry went through.
+    """
+    timer = StageTimer(STAGE_SECONDS, '/process-requests')
+    
+    def fail(entry, message, details):
+        index, request_id, _ = entry
+        log_audit(trace_id, request_id, '/process-requests', 'error', dict(details, durations_ms=timer.as_dict()))
+        results[index] = {"request_id": request_id, "trace_id": trace_id, "status": "error", "error": message}
+    
+    def fail_all(entries, e):
+        message, details = step_error(e)
+        for entry in entries:
+            fail(entry, message, details)
+    
+    for _, request_id, query in entries:
+        log_audit(trace_id, request_id, '/process-requests', 'started', {"query": query})
+    
+    # Step 1: Check Policy Service for every item
+    try:
+        with timer.stage('policy'):
+            decisions = PIPELINE.check_policy_batch(trace_id, [
+                {"request_id": request_id, "query": query} for _, request_id, query in entries
+            ])
+    except Exception as e:
+        fail_all(entries, e)
+        return
+    
+    allowed = []
+    for entry, decision in zip(entries, decisions):
+        if decision.get('allowed', False):
+            allowed.append(entry)
+            continue
+        index, request_id, _ = entry
+        reason = decision.get('reason', 'Policy denied')
+        log_audit(trace_id, request_id, '/process-requests', 'denied',
+                  {"reason": reason, "durations_ms": timer.as_dict()})
+        results[index] = {"request_id": request_id, "trace_id": trace_id, "status": "denied", "reason": reason}
+    if not allowed:
+        return
+    
+    # Step 2: Call Retriever Agent for the allowed items
+    try:
+        with timer.stage('retrieve'):
+            retrievals = PIPELINE.retrieve_batch(trace_id, [
+                {"request_id": request_id, "query": query} for _, request_id, query in allowed
+            ])
+    except Exception as e:
+        fail_all(allowed, e)
+        return
+    
+    retrieved = []
+    for entry, retrieval in zip(allowed, retrievals):
+        if 'error' in retrieval:
+            fail(entry, "Retriever service error", {"step": "retriever", "error": retrieval['error']})
+        else:
+            retrieved.append((entry, retrieval.get('documents', [])))
+    if not retrieved:
+        return
+    
+    # Step 3: Call Processor Agent for the retrieved items
+    try:
+        with timer.stage('process'):
+            processed = PIPELINE.process_batch(trace_id, [
+                {"request_id": request_id, "query": query, "documents": documents}
+                for (_, request_id, query), documents in retrieved
+            ])
+    except Exception as e:
+        fail_all([entry for entry, _ in retrieved], e)
+        return
+    
+    for (entry, _), processor_data in zip(retrieved, processed):
+        if 'error' in processor_data:
+            fail(entry, "Processor service error", {"step": "processor", "error": processor_data['error']})
+            continue
+        index, request_id, _ = entry
+        response = {
+            "request_id": request_id,
+            "trace_id": trace_id,
+            "summary": processor_data.get('summary', ''),
+            "label": processor_data.get('label', ''),
+            "document_count": processor_data.get('document_count', 0)
+        }
+        
+        # Store the response for idempotency
+        IDEMPOTENCY.complete(request_id, claims[request_id], response)
+        
+        log_audit(trace_id, request_id, '/process-requests', 'success', {
+            "label": response['label'],
+            "document_count": response['document_count'],
+            "durations_ms": timer.as_dict()
+        })
+        results[index] = dict(response, status='success')
+
+@app.route('/process-requests', methods=['POST'])
+def process_requests():
+    """Batch orchestration endpoint: many {request_id, query} items, one call per step"""
+    data = request.get_json()
+    items = data.get('requests') if isinstance(data, dict) else None
+    
+    if not isinstance(items, list):
+        return jsonify({"error": "requests must be a list"}), 400
+    
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} requests per batch"}), 400
+    
+    # One trace_id covers the batch and its downstream batch calls
+    trace_id = str(uuid.uuid4())
+    results = [None] * len(items)
+    first = {}       # request_id -> index of its first item
+    duplicates = []  # (index, index of the first item with the same request_id)
+    owned = []       # entries claimed by this batch
+    pending = []     # entries claimed by a request in flight elsewhere
+    claimed = {}     # request_id -> claim, for entries this batch owns
+    
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        request_id = item.get('request_id')
+        query = item.get('query', '')
+        
+        if not request_id or not query:
+            error = "request_id is required" if not request_id else "query is required"
+            results[index] = {"request_id": request_id, "status": "error", "error": error}
+            continue
+        
+        if request_id in first:
+            duplicates.append((index, first[request_id]))
+            continue
+        first[request_id] = index
+        
+        # Check for idempotency without waiting; in-flight duplicates are awaited below
+        state, value = IDEMPOTENCY.try_claim(request_id)
+        if state == CACHED:
+            IDEMPOTENCY_LOOKUPS.labels('/process-requests', 'hit').inc()
+            log_audit(trace_id, request_id, '/process-requests', 'cached', {
+                "query": query,
+                "message": "Returned cached response"
+            })
+            results[index] = dict(value, status='cached')
+        elif state == OWNER:
+            IDEMPOTENCY_LOOKUPS.labels('/process-requests', 'miss').inc()
+            owned.append((index, request_id, query))
+            claimed[request_id] = value
+        else:
+            pending.append((index, request_id, query))
+    
+    try:
+        while owned or pending:
+            if owned:
+                run_batch(trace_id, owned, results, claimed)
+            
+            # Items another request was running: replay its response, or run
+            # them in another round if it gave up its claim
+            owned = []
+            for index, request_id, query in pending:
+                cached_response, claim = IDEMPOTENCY.claim(request_id)
+                IDEMPOTENCY_LOOKUPS.labels('/process-requests', 'miss' if cached_response is None else 'hit').inc()
+                if cached_response is None:
+                    owned.append((index, request_id, query))
+                    claimed[request_id] = claim
+                    continue
+                log_audit(trace_id, request_id, '/process-requests', 'cached', {
+                    "query": query,
+                    "message": "Returned cached response"
+                })
+                results[index] = dict(cached_response, status='cached')
+            pending = []
+    finally:
+        # No-op for stored responses; otherwise lets a waiting duplicate run
+        for request_id, claim in claimed.items():
+            IDEMPOTENCY.release(request_id, claim)
+    
+    # Repeated request_ids in the batch share the result of their first item
+    for index, first_index in duplicates:
+        result = results[first_index]
+        if result['status'] in ('success', 'cached'):
+            log_audit(trace_id, result['request_id'], '/process-requests', 'cached', {
+                "query": items[index]['query'],
+                "message": "Returned cached response"
+            })
+            result = dict(result, status='cached')
+        results[index] = result
+    
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+    
+    return jsonify({
+        "trace_id": trace_id,
+        "count": len(results),
+        "statuses": statuses,
+        "results": results
+    }), 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')), debug=False)
 
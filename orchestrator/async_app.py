@@ -0,0 +1,343 @@
+from aiohttp import web
+import aiohttp
+import asyncio
+import logging
+import math
+import os
+import uuid
+
+from prometheus_client import Counter, Histogram
+
+from async_pipeline import STAGE_NAMES, AsyncDistributedPipeline, AsyncServiceClient
+from common.audit import AuditWriter
+from common.metrics import DEFAULT_BUCKETS, StageTimer, instrument_aiohttp
+from idempotency import IdempotencyStore
+from pipeline import StepError
+from query_cache import QueryCache, ServiceVersions
+from resilience import CircuitOpenError
+from streaming import STREAM_FORMATS, STREAM_HEADERS, encode_event, stream_format
+
+# Asyncio entry point for the orchestrator: one event loop serves many
+# concurrent requests per process, and retrieval starts speculatively while
+# the policy check is in flight. Same routes, responses and audit records
+# as app.py, except the batch /process-requests endpoint, which only app.py
+# serves. Store calls run on the default executor so SQLite never blocks the
+# loop. Run with: python async_app.py
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+
+# Audit records are written in batches by a background thread
+AUDIT = AuditWriter.from_env('orchestrator')
+
+# Service URLs
+POLICY_SERVICE_URL = os.getenv('POLICY_SERVICE_URL', 'http://policy-service:5001')
+RETRIEVER_SERVICE_URL = os.getenv('RETRIEVER_SERVICE_URL', 'http://retriever-agent:5002')
+PROCESSOR_SERVICE_URL = os.getenv('PROCESSOR_SERVICE_URL', 'http://processor-agent:5003')
+
+# Have the retriever return document references instead of full documents
+DOCUMENT_REFS = os.getenv('DOCUMENT_REFS', 'false').lower() == 'true'
+
+# Same query cache settings as app.py
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '60'))
+QUERY_CACHE_VERSION_INTERVAL = float(os.getenv('QUERY_CACHE_VERSION_INTERVAL', '2'))
+
+if os.getenv('PIPELINE_MODE', 'distributed') != 'distributed':
+    raise ValueError("async_app.py only supports PIPELINE_MODE=distributed")
+
+PIPELINE = AsyncDistributedPipeline(
+    AsyncServiceClient.from_env('policy-service', 'POLICY', POLICY_SERVICE_URL, read_timeout=5),
+    AsyncServiceClient.from_env('retriever-agent', 'RETRIEVER', RETRIEVER_SERVICE_URL, read_timeout=10),
+    AsyncServiceClient.from_env('processor-agent', 'PROCESSOR', PROCESSOR_SERVICE_URL, read_timeout=10),
+    refs=DOCUMENT_REFS,
+    service_versions=ServiceVersions(RETRIEVER_SERVICE_URL, POLICY_SERVICE_URL,
+                                     interval=QUERY_CACHE_VERSION_INTERVAL) if QUERY_CACHE_SIZE > 0 else None
+)
+
+# Idempotency store shared by every worker process on this host. An unfinished
+# claim is taken over after IDEMPOTENCY_LEASE seconds, by default the longest a
+# run can take: every step's connect plus read timeout, doubled when hedged
+# (30 in monolith mode, where no timeouts apply)
+IDEMPOTENCY = IdempotencyStore(
+    os.getenv('IDEMPOTENCY_DB_PATH', '/tmp/orchestrator-idempotency.db'),
+    ttl=float(os.getenv('IDEMPOTENCY_TTL', '3600')),
+    max_entries=int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000')),
+    max_bytes=int(os.getenv('IDEMPOTENCY_MAX_BYTES', str(64 * 1024 * 1024))),
+    lease=float(os.getenv('IDEMPOTENCY_LEASE', str(PIPELINE.max_seconds() or 30)))
+)
+
+QUERY_CACHE = QueryCache(PIPELINE.versions, QUERY_CACHE_SIZE, QUERY_CACHE_TTL) if QUERY_CACHE_SIZE > 0 else None
+
+# Same metrics as app.py; the speculative retrieval overlaps the policy
+# check, so its stage is only the wait it adds after the policy answer
+STAGE_SECONDS = Histogram('orchestrator_stage_duration_seconds', "Time spent in each pipeline stage",
+                          ('endpoint', 'stage'), buckets=DEFAULT_BUCKETS)
+IDEMPOTENCY_LOOKUPS = Counter('idempotency_lookups_total', "Idempotency store lookups by result",
+                              ('endpoint', 'result'))
+QUERY_CACHE_LOOKUPS = Counter('query_cache_lookups_total', "Query cache lookups by result",
+                              ('endpoint', 'result'))
+
+def log_audit(trace_id, request_id, endpoint, status, details):
+    """Queue a record for audit.jsonl"""
+    AUDIT.log(trace_id, request_id, endpoint, status, details)
+
+async def health(request):
+    return web.json_response({"status": "healthy", "service": "orchestrator", "pipeline_mode": "distributed"})
+
+async def downstream_stats(request):
+    """Connection pool statistics per downstream service"""
+    return web.json_response({"pipeline_mode": "distributed", "services": PIPELINE.pool_stats()})
+
+async def idempotency_stats(request):
+    """Size and bounds of the shared idempotency store"""
+    return web.json_response(await asyncio.get_running_loop().run_in_executor(None, IDEMPOTENCY.stats))
+
+async def query_cache_stats(request):
+    """Size, bounds and versions of this process's query cache"""
+    if QUERY_CACHE is None:
+        return web.json_response({"enabled": False})
+    return web.json_response(dict(QUERY_CACHE.stats(), enabled=True))
+
+def query_cache_lookup(endpoint, query):
+    """(versions, cached): cached is (result, allowed) from the query cache, or None"""
+    if QUERY_CACHE is None:
+        return None, None
+    versions = QUERY_CACHE.current_versions()
+    if versions is None:
+        # Versions unknown: cannot tell whether cached results are current
+        QUERY_CACHE_LOOKUPS.labels(endpoint, 'bypass').inc()
+        return None, None
+    cached = QUERY_CACHE.lookup(query, versions)
+    if cached is None:
+        QUERY_CACHE_LOOKUPS.labels(endpoint, 'miss').inc()
+    else:
+        QUERY_CACHE_LOOKUPS.labels(endpoint, 'hit' if cached[1] else 'revalidate').inc()
+    return versions, cached
+
+async def process_request(request):
+    """Main orchestration endpoint"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.json_response({"error": "Request body must be JSON"}, status=400)
+
+    # Generate trace_id for request tracking
+    trace_id = str(uuid.uuid4())
+    request_id = data.get('request_id')
+    query = data.get('query', '')
+
+    if not request_id:
+        return web.json_response({"error": "request_id is required"}, status=400)
+
+    if not query:
+        return web.json_response({"error": "query is required"}, status=400)
+
+    # Check for idempotency - return the stored response, waiting first for
+    # an in-flight request with the same request_id to finish
+    cached_response, claim = await IDEMPOTENCY.claim_async(request_id)
+    if cached_response is not None:
+        IDEMPOTENCY_LOOKUPS.labels('/process-request', 'hit').inc()
+        log_audit(trace_id, request_id, '/process-request', 'cached', {
+            "query": query,
+            "message": "Returned cached response"
+        })
+        return web.json_response(cached_response)
+    IDEMPOTENCY_LOOKUPS.labels('/process-request', 'miss').inc()
+
+    log_audit(trace_id, request_id, '/process-request', 'started', {"query": query})
+    timer = StageTimer(STAGE_SECONDS, '/process-request')
+
+    try:
+        # Final results of allowed queries, by normalized query
+        versions, cached = query_cache_lookup('/process-request', query)
+
+        if cached is None:
+            # Policy check and (speculative) retrieval run concurrently
+            policy_data, processor_data = await PIPELINE.run(trace_id, request_id, query, timer=timer)
+        elif not cached[1]:
+            # Cached result; only the policy decision for this exact query is missing
+            with timer.stage('policy'):
+                policy_data = await PIPELINE.check_policy(trace_id, request_id, query)
+        else:
+            # The policy already allowed this exact query under the current rules
+            policy_data = {"allowed": True}
+
+        if not policy_data.get('allowed', False):
+            log_audit(trace_id, request_id, '/process-request', 'denied',
+                     {"reason": policy_data.get('reason', 'Policy denied'), "durations_ms": timer.as_dict()})
+            return web.json_response({
+                "request_id": request_id,
+                "trace_id": trace_id,
+                "status": "denied",
+                "reason": policy_data.get('reason', 'Policy denied')
+            }, status=403)
+
+        if cached is not None:
+            result = cached[0]
+            if not cached[1]:
+                QUERY_CACHE.allow(query)
+        else:
+            result = {
+                "summary": processor_data.get('summary', ''),
+                "label": processor_data.get('label', ''),
+                "document_count": processor_data.get('document_count', 0)
+            }
+            if versions is not None:
+                QUERY_CACHE.store(query, result, versions)
+
+        # Build final response
+        response = {"request_id": request_id, "trace_id": trace_id, **result}
+
+        # Store the response for idempotency
+        await IDEMPOTENCY.complete_async(request_id, claim, response)
+
+        log_audit(trace_id, request_id, '/process-request', 'success', {
+            "label": response['label'],
+            "document_count": response['document_count'],
+            "query_cache": cached is not None,
+            "durations_ms": timer.as_dict()
+        })
+
+        return web.json_response(response)
+
+    except StepError as e:
+        log_audit(trace_id, request_id, '/process-request', 'error',
+                 {"step": e.step, "error": str(e), "durations_ms": timer.as_dict()})
+        return web.json_response({"error": str(e)}, status=500)
+    except CircuitOpenError as e:
+        # Fail fast while a dependency is unhealthy
+        log_audit(trace_id, request_id, '/process-request', 'error',
+                 {"error": str(e), "circuit_open": e.service, "durations_ms": timer.as_dict()})
+        return web.json_response({"error": str(e)}, status=503,
+                                 headers={'Retry-After': str(math.ceil(e.retry_after))})
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log_audit(trace_id, request_id, '/process-request', 'error',
+                 {"error": str(e), "durations_ms": timer.as_dict()})
+        return web.json_response({"error": f"Service communication error: {str(e)}"}, status=500)
+    except Exception as e:
+        log_audit(trace_id, request_id, '/process-request', 'error',
+                 {"error": str(e), "durations_ms": timer.as_dict()})
+        return web.json_response({"error": f"Internal error: {str(e)}"}, status=500)
+    finally:
+        # No-op once the response is stored; otherwise lets a waiting duplicate run
+        await IDEMPOTENCY.release_async(request_id, claim)
+
+async def process_request_stream(request):
+    """Streaming variant of /process-request: one event per completed stage"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.json_response({"error": "Request body must be JSON"}, status=400)
+
+    trace_id = str(uuid.uuid4())
+    request_id = data.get('request_id')
+    query = data.get('query', '')
+    fmt = stream_format(request.headers.get('Accept'))
+
+    if not request_id:
+        return web.json_response({"error": "request_id is required"}, status=400)
+
+    if not query:
+        return web.json_response({"error": "query is required"}, status=400)
+
+    cached_response, claim = await IDEMPOTENCY.claim_async(request_id)
+    try:
+        stream = web.StreamResponse(headers=dict(STREAM_HEADERS, **{'Content-Type': STREAM_FORMATS[fmt]}))
+        await stream.prepare(request)
+        await stream.write(encode_event(fmt, 'started', {"request_id": request_id, "trace_id": trace_id}))
+
+        if cached_response is not None:
+            IDEMPOTENCY_LOOKUPS.labels('/process-request/stream', 'hit').inc()
+            log_audit(trace_id, request_id, '/process-request/stream', 'cached', {
+                "query": query,
+                "message": "Returned cached response"
+            })
+            await stream.write(encode_event(fmt, 'result', cached_response))
+            await stream.write_eof()
+            return stream
+        IDEMPOTENCY_LOOKUPS.labels('/process-request/stream', 'miss').inc()
+
+        log_audit(trace_id, request_id, '/process-request/stream', 'started', {"query": query})
+        timer = StageTimer(STAGE_SECONDS, '/process-request/stream')
+
+        try:
+            # Policy check and (speculative) retrieval run concurrently
+            async for stage, stage_data in PIPELINE.stages(trace_id, request_id, query):
+                timer.mark(STAGE_NAMES[stage])
+                if stage == 'policy':
+                    await stream.write(encode_event(fmt, 'policy', {
+                        "allowed": stage_data.get('allowed', False),
+                        "reason": stage_data.get('reason'),
+                        "matched_rules": stage_data.get('matched_rules', [])
+                    }))
+                    if not stage_data.get('allowed', False):
+                        log_audit(trace_id, request_id, '/process-request/stream', 'denied',
+                                 {"reason": stage_data.get('reason', 'Policy denied'), "durations_ms": timer.as_dict()})
+                        await stream.write(encode_event(fmt, 'denied', {
+                            "request_id": request_id,
+                            "trace_id": trace_id,
+                            "status": "denied",
+                            "reason": stage_data.get('reason', 'Policy denied')
+                        }))
+                elif stage == 'documents':
+                    await stream.write(encode_event(fmt, 'documents', {"documents": stage_data, "count": len(stage_data)}))
+                else:
+                    response = {
+                        "request_id": request_id,
+                        "trace_id": trace_id,
+                        "summary": stage_data.get('summary', ''),
+                        "label": stage_data.get('label', ''),
+                        "document_count": stage_data.get('document_count', 0)
+                    }
+                    await IDEMPOTENCY.complete_async(request_id, claim, response)
+                    log_audit(trace_id, request_id, '/process-request/stream', 'success', {
+                        "label": response['label'],
+                        "document_count": response['document_count'],
+                        "durations_ms": timer.as_dict()
+                    })
+                    await stream.write(encode_event(fmt, 'result', response))
+        except StepError as e:
+            error, details = str(e), {"step": e.step, "error": str(e)}
+        except CircuitOpenError as e:
+            error, details = str(e), {"error": str(e), "circuit_open": e.service}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error, details = f"Service communication error: {str(e)}", {"error": str(e)}
+        except ConnectionResetError:
+            # Client went away; nothing left to send
+            raise
+        except Exception as e:
+            error, details = f"Internal error: {str(e)}", {"error": str(e)}
+        else:
+            error = None
+        if error is not None:
+            log_audit(trace_id, request_id, '/process-request/stream', 'error',
+                      dict(details, durations_ms=timer.as_dict()))
+            await stream.write(encode_event(fmt, 'error', {"request_id": request_id, "trace_id": trace_id, "error": error}))
+
+        await stream.write_eof()
+        return stream
+    finally:
+        # No-op once the response is stored; otherwise lets a waiting duplicate run
+        await IDEMPOTENCY.release_async(request_id, claim)
+
+async def pipeline_context(app):
+    # aiohttp sessions must be created inside the running event loop
+    await PIPELINE.open()
+    yield
+    await PIPELINE.close()
+
+def create_app():
+    app = web.Application()
+    app.cleanup_ctx.append(pipeline_context)
+    app.router.add_get('/health', health)
+    app.router.add_get('/downstream/stats', downstream_stats)
+    app.router.add_get('/idempotency/stats', idempotency_stats)
+    app.router.add_get('/query-cache/stats', query_cache_stats)
+    app.router.add_post('/process-request', process_request)
+    app.router.add_post('/process-request/stream', process_request_stream)
+    instrument_aiohttp(app)
+    return app
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=int(os.getenv('PORT', '5000')))
@@ -0,0 +1,223 @@
+import asyncio
+import os
+import time
+
+import aiohttp
+
+from common import wire
+from downstream import DOWNSTREAM_SECONDS, resilience_from_env
+from pipeline import StepError
+
+
+class AsyncServiceClient:
+    """aiohttp session with a keep-alive connection pool for one service
+
+    Configured from the same {prefix}_POOL_SIZE, _KEEP_ALIVE,
+    _CONNECT_TIMEOUT, _TIMEOUT and WIRE_FORMAT variables as the synchronous
+    ServiceClient, and wrapped in the same Resilience; a losing hedged
+    attempt is cancelled.
+    The session must be opened inside the running event loop.
+    """
+
+    def __init__(self, name, base_url, pool_size=10, keep_alive=30.0,
+                 connect_timeout=2.0, read_timeout=10.0, wire_format='json', resilience=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.wire_format = wire_format
+        self.content_type = wire.content_type_for(wire_format)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.resilience = resilience
+        self.session = None
+
+    @classmethod
+    def from_env(cls, name, prefix, base_url, read_timeout):
+        read_timeout = float(os.getenv(f'{prefix}_TIMEOUT', str(read_timeout)))
+        return cls(
+            name,
+            base_url,
+            pool_size=int(os.getenv(f'{prefix}_POOL_SIZE', '10')),
+            keep_alive=float(os.getenv(f'{prefix}_KEEP_ALIVE', '30')),
+            connect_timeout=float(os.getenv(f'{prefix}_CONNECT_TIMEOUT', '2')),
+            read_timeout=read_timeout,
+            wire_format=os.getenv('WIRE_FORMAT', 'json'),
+            resilience=resilience_from_env(name, read_timeout)
+        )
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            force_close=self.keep_alive <= 0,
+            keepalive_timeout=self.keep_alive if self.keep_alive > 0 else None
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def post(self, path, payload, headers=None, idempotent=False):
+        """POST payload and return (status, decoded body or None)
+
+        Raises CircuitOpenError without calling the service while its breaker is open.
+        """
+        headers = dict(headers or {}, **{'Content-Type': self.content_type, 'Accept': self.content_type})
+        body = wire.encode(payload, self.content_type)
+        if self.resilience is None:
+            return await self._send(path, body, headers, self.timeout)
+        return await self.resilience.call_async(
+            path,
+            lambda read_timeout: self._send(path, body, headers, aiohttp.ClientTimeout(
+                sock_connect=self.timeout.sock_connect, sock_read=read_timeout)),
+            hedge=idempotent
+        )
+
+    async def _send(self, path, body, headers, timeout):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.session.post(f'{self.base_url}{path}', data=body, headers=headers,
+                                         timeout=timeout) as response:
+                status = response.status
+                if response.status != 200:
+                    return response.status, None
+                return response.status, wire.decode(await response.read(), response.headers.get('Content-Type'))
+        except asyncio.CancelledError:
+            # A speculative retrieval dropped after a denial, or a losing hedge
+            status = 'cancelled'
+            raise
+        finally:
+            DOWNSTREAM_SECONDS.labels(self.name, path, status).observe(time.perf_counter() - started)
+
+    def max_call_seconds(self):
+        """Longest one post() can take: connect plus read timeout, twice over when hedged"""
+        attempts = 2 if self.resilience is not None and self.resilience.hedge_budget > 0 else 1
+        return attempts * (self.timeout.sock_connect + self.timeout.sock_read)
+
+    def pool_stats(self):
+        return {
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "keep_alive": self.keep_alive,
+            "timeout": [self.timeout.sock_connect, self.timeout.sock_read],
+            "wire_format": self.wire_format,
+            "resilience": self.resilience.as_dict() if self.resilience is not None else None
+        }
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+# stages() event -> stage name used in metrics and audit records
+STAGE_NAMES = {'policy': 'policy', 'documents': 'retrieve', 'processed': 'process'}
+
+
+class AsyncDistributedPipeline:
+    """Asyncio version of DistributedPipeline with speculative retrieval
+
+    The retriever call is started at the same time as the policy check, so
+    a permitted request pays max(policy, retrieval) instead of their sum.
+    If the policy check denies the query or fails, the retrieval is
+    cancelled and its result (or error) discarded. A cancelled call may
+    still have reached the retriever, which then writes its own audit record.
+    """
+
+    mode = 'distributed'
+
+    def __init__(self, policy, retriever, processor, refs=False, service_versions=None):
+        self.clients = {"policy": policy, "retriever": retriever, "processor": processor}
+        self.refs = refs
+        self.service_versions = service_versions
+
+    async def open(self):
+        for client in self.clients.values():
+            await client.open()
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
+
+    def pool_stats(self):
+        return {client.name: client.pool_stats() for client in self.clients.values()}
+
+    def max_seconds(self):
+        """Upper bound on one run: every step taking its longest call"""
+        return sum(client.max_call_seconds() for client in self.clients.values())
+
+    def versions(self):
+        """Corpus and policy versions results currently depend on, or None when unknown"""
+        return self.service_versions.current() if self.service_versions is not None else None
+
+    async def _post(self, step, path, payload, trace_id):
+        status, data = await self.clients[step].post(
+            path,
+            payload,
+            headers={'X-Trace-ID': trace_id},
+            idempotent=True
+        )
+        if status != 200:
+            raise StepError(step, f"{step.capitalize()} service error")
+        return data
+
+    async def check_policy(self, trace_id, request_id, query):
+        data = await self._post('policy', '/policy', {"request_id": request_id, "query": query}, trace_id)
+        if self.service_versions is not None:
+            self.service_versions.observe_policy(data.get('policy_version'))
+        return data
+
+    async def retrieve(self, trace_id, request_id, query):
+        data = await self._post('retriever', '/retrieve', {
+            "request_id": request_id,
+            "query": query,
+            "refs": self.refs
+        }, trace_id)
+        return data.get('documents', [])
+
+    async def process(self, trace_id, request_id, query, documents):
+        return await self._post('processor', '/process', {
+            "request_id": request_id,
+            "query": query,
+            "documents": documents
+        }, trace_id)
+
+    async def stages(self, trace_id, request_id, query):
+        """Yield ('policy', policy_data), then ('documents', documents) and
+        ('processed', processor_data) unless the query is denied
+
+        Closing the generator early cancels the speculative retrieval.
+        """
+        retrieval = asyncio.ensure_future(self.retrieve(trace_id, request_id, query))
+        try:
+            policy_data = await self.check_policy(trace_id, request_id, query)
+            yield 'policy', policy_data
+        except BaseException:
+            await _discard(retrieval)
+            raise
+
+        if not policy_data.get('allowed', False):
+            await _discard(retrieval)
+            return
+
+        documents = await retrieval
+        yield 'documents', documents
+        yield 'processed', await self.process(trace_id, request_id, query, documents)
+
+    async def run(self, trace_id, request_id, query, timer=None):
+        """Return (policy_data, processor_data); processor_data is None when denied
+
+        A StageTimer is charged the wait each stage added on the critical path.
+        """
+        results = {}
+        async for stage, data in self.stages(trace_id, request_id, query):
+            results[stage] = data
+            if timer is not None:
+                timer.mark(STAGE_NAMES[stage])
+        return results['policy'], results.get('processed')
+
+
+async def _discard(task):
+    """Cancel task and swallow whatever it finished with"""
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        # Cancellation, or the retriever error we no longer care about
+        pass
@@ -0,0 +1,219 @@
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from prometheus_client import Histogram
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from common import wire
+from common.metrics import DEFAULT_BUCKETS
+from resilience import Resilience
+
+# Every downstream call, by service, path and HTTP status ('error' if none came back)
+DOWNSTREAM_SECONDS = Histogram('downstream_request_duration_seconds', "Time spent in calls to other services",
+                               ('service', 'path', 'status'), buckets=DEFAULT_BUCKETS)
+
+
+class PoolStats:
+    """Connection counters shared by every pool of one service client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.in_use = 0
+        self.discarded = 0
+        self.expired = 0
+
+    def checkout(self, reused):
+        with self._lock:
+            self.in_use += 1
+            if reused:
+                self.reused += 1
+            else:
+                self.created += 1
+
+    def checkin(self, kept):
+        with self._lock:
+            self.in_use -= 1
+            if not kept:
+                self.discarded += 1
+
+    def expire(self):
+        with self._lock:
+            self.expired += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "in_use": self.in_use,
+                "discarded": self.discarded,
+                "expired": self.expired
+            }
+
+
+class _CountingPoolMixin:
+    """Connection pool that reports checkouts and expires idle connections
+
+    A checked-out connection whose socket is still open is a reuse; one
+    without a socket connects on first use and counts as created.
+    Connections idle for longer than keep_alive seconds are closed before
+    reuse, so we never write to a socket the server has already dropped;
+    keep_alive <= 0 closes every connection after its response.
+    """
+
+    def __init__(self, *args, stats, keep_alive, **kwargs):
+        self.stats = stats
+        self.keep_alive = keep_alive
+        super().__init__(*args, **kwargs)
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=timeout)
+        idle_since = getattr(conn, 'idle_since', None)
+        if conn.sock is not None and idle_since is not None \
+                and time.monotonic() - idle_since > self.keep_alive:
+            conn.close()
+            self.stats.expire()
+        self.stats.checkout(reused=conn.sock is not None)
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is None:
+            return super()._put_conn(conn)
+        if self.keep_alive <= 0:
+            conn.close()
+        conn.idle_since = time.monotonic()
+        # urllib3 closes the connection instead of pooling it when the pool is full
+        kept = self.pool is not None and not self.pool.full()
+        self.stats.checkin(kept=kept)
+        return super()._put_conn(conn)
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools report into a PoolStats"""
+
+    def __init__(self, stats, keep_alive, pool_size):
+        self.stats = stats
+        self.keep_alive = keep_alive
+        super().__init__(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': functools.partial(CountingHTTPConnectionPool,
+                                      stats=self.stats, keep_alive=self.keep_alive),
+            'https': functools.partial(CountingHTTPSConnectionPool,
+                                       stats=self.stats, keep_alive=self.keep_alive)
+        }
+
+
+class ServiceClient:
+    """Persistent, pooled HTTP client for one downstream service
+
+    Requests are sent, and responses asked for, in `wire_format`
+    ('json' or 'msgpack'). With a Resilience the read timeout adapts to
+    observed latency, an open circuit fails calls fast, and idempotent
+    calls are hedged on a thread pool.
+    """
+
+    def __init__(self, name, base_url, pool_size=10, keep_alive=30.0,
+                 connect_timeout=2.0, read_timeout=10.0, wire_format='json', resilience=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.wire_format = wire_format
+        self.content_type = wire.content_type_for(wire_format)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = (connect_timeout, read_timeout)
+        self.resilience = resilience
+        # Threads are only started once a call is hedged, so never in the pre-fork master
+        self.executor = ThreadPoolExecutor(max_workers=pool_size * 2, thread_name_prefix=f'{name}-hedge')
+        self.stats = PoolStats()
+        self.session = requests.Session()
+        adapter = PooledAdapter(self.stats, keep_alive, pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_env(cls, name, prefix, base_url, read_timeout):
+        """Client configured from {prefix}_POOL_SIZE, _KEEP_ALIVE, _CONNECT_TIMEOUT, _TIMEOUT and WIRE_FORMAT
+
+        {prefix}_TIMEOUT is the longest read timeout; RESILIENCE=false keeps it fixed.
+        """
+        read_timeout = float(os.getenv(f'{prefix}_TIMEOUT', str(read_timeout)))
+        return cls(
+            name,
+            base_url,
+            pool_size=int(os.getenv(f'{prefix}_POOL_SIZE', '10')),
+            keep_alive=float(os.getenv(f'{prefix}_KEEP_ALIVE', '30')),
+            connect_timeout=float(os.getenv(f'{prefix}_CONNECT_TIMEOUT', '2')),
+            read_timeout=read_timeout,
+            wire_format=os.getenv('WIRE_FORMAT', 'json'),
+            resilience=resilience_from_env(name, read_timeout)
+        )
+
+    def post(self, path, payload, headers=None, idempotent=False):
+        """POST payload and return (status, decoded body or None)
+
+        Raises CircuitOpenError without calling the service while its breaker is open.
+        """
+        headers = dict(headers or {}, **{'Content-Type': self.content_type, 'Accept': self.content_type})
+        body = wire.encode(payload, self.content_type)
+        if self.resilience is None:
+            return self._send(path, body, headers, self.timeout[1])
+        return self.resilience.call(path, functools.partial(self._send, path, body, headers),
+                                    executor=self.executor if idempotent else None)
+
+    def _send(self, path, body, headers, read_timeout):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.post(f'{self.base_url}{path}', data=body, headers=headers,
+                                         timeout=(self.timeout[0], read_timeout))
+            status = response.status_code
+            if response.status_code != 200:
+                return response.status_code, None
+            return response.status_code, wire.decode(response.content, response.headers.get('Content-Type'))
+        finally:
+            DOWNSTREAM_SECONDS.labels(self.name, path, status).observe(time.perf_counter() - started)
+
+    def max_call_seconds(self):
+        """Longest one post() can take: connect plus read timeout, twice over when hedged"""
+        attempts = 2 if self.resilience is not None and self.resilience.hedge_budget > 0 else 1
+        return attempts * sum(self.timeout)
+
+    def pool_stats(self):
+        return {
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "keep_alive": self.keep_alive,
+            "timeout": list(self.timeout),
+            "wire_format": self.wire_format,
+            "resilience": self.resilience.as_dict() if self.resilience is not None else None,
+            **self.stats.as_dict()
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+def resilience_from_env(name, read_timeout):
+    """Resilience for a client, or None when RESILIENCE=false"""
+    if os.getenv('RESILIENCE', 'true').lower() != 'true':
+        return None
+    return Resilience.from_env(name, read_timeout)
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# try_claim outcomes
+CACHED = 'cached'
+OWNER = 'owner'
+PENDING = 'pending'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    request_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    response TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (status, accessed);
+
+-- Running totals of completed rows, so the bounds are checked in O(1)
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+    UPDATE totals SET entries = entries + (NEW.status = 'done'), bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+    UPDATE totals SET entries = entries - (OLD.status = 'done'), bytes = bytes - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF status, size ON responses BEGIN
+    UPDATE totals SET entries = entries + (NEW.status = 'done') - (OLD.status = 'done'),
+                      bytes = bytes + NEW.size - OLD.size;
+END;
+"""
+
+# Rows removed per statement while over a bound
+EVICT_BATCH = 64
+
+
+class IdempotencyStore:
+    """Bounded request_id -> response store shared by every worker process
+
+    Rows live in a SQLite file (WAL mode), so all workers on a host see the
+    same responses. A request first claims its id: the first claimant
+    inserts a 'pending' row and runs the pipeline, later duplicates wait
+    for that row to turn 'done' and reuse the response (single-flight). A
+    claim abandoned by a crashed worker is taken over once it is older than
+    `lease` seconds, so the lease must exceed the longest a pipeline run can
+    take. Each claim is identified by its row's `created` stamp: complete()
+    and release() only touch the row while that claim still holds it, so an
+    owner whose claim was taken over cannot overwrite or drop the new one.
+
+    Completed responses expire after `ttl` seconds, and the least recently
+    used ones are evicted whenever there are more than `max_entries` of
+    them or they hold more than `max_bytes` of JSON.
+    """
+
+    def __init__(self, path, ttl=3600.0, max_entries=10000, max_bytes=64 * 1024 * 1024, lease=30.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lease = lease
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        """Per-thread connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def try_claim(self, request_id):
+        """Return (CACHED, response), (OWNER, claim) or (PENDING, None) without waiting"""
+        conn = self._connection()
+        now = time.time()
+        if conn.execute(
+            "INSERT OR IGNORE INTO responses (request_id, status, created, accessed) VALUES (?, 'pending', ?, ?)",
+            (request_id, now, now)
+        ).rowcount:
+            return OWNER, now
+
+        row = conn.execute(
+            "SELECT status, response, created FROM responses WHERE request_id = ?", (request_id,)
+        ).fetchone()
+        if row is None:
+            # Evicted or released between the two statements
+            return self.try_claim(request_id)
+        status, response, created = row
+
+        if status == 'done':
+            if now - created <= self.ttl:
+                conn.execute("UPDATE responses SET accessed = ? WHERE request_id = ?", (now, request_id))
+                return CACHED, json.loads(response)
+            # Expired: take the row over and run the request again
+            taken = conn.execute(
+                "UPDATE responses SET status = 'pending', response = NULL, size = 0, created = ?, accessed = ? "
+                "WHERE request_id = ? AND status = 'done' AND created = ?",
+                (now, now, request_id, created)
+            ).rowcount
+            return (OWNER, now) if taken else (PENDING, None)
+
+        # Someone else is running it; take over claims that outlived their lease
+        taken = conn.execute(
+            "UPDATE responses SET created = ?, accessed = ? WHERE request_id = ? AND status = 'pending' AND created = ? AND created < ?",
+            (now, now, request_id, created, now - self.lease)
+        ).rowcount
+        return (OWNER, now) if taken else (PENDING, None)
+
+    def claim(self, request_id):
+        """Return (stored response, None), or (None, claim) once the caller owns request_id
+
+        Blocks while a duplicate of the request is in flight.
+        """
+        delay = 0.005
+        while True:
+            state, value = self.try_claim(request_id)
+            if state == CACHED:
+                return value, None
+            if state == OWNER:
+                return None, value
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    async def claim_async(self, request_id):
+        """claim() for the event loop: queries on the default executor, waits with asyncio.sleep"""
+        loop = asyncio.get_running_loop()
+        delay = 0.005
+        while True:
+            state, value = await loop.run_in_executor(None, self.try_claim, request_id)
+            if state == CACHED:
+                return value, None
+            if state == OWNER:
+                return None, value
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def complete(self, request_id, claim, response):
+        """Store the response of a request the caller still claims and enforce the bounds"""
+        data = json.dumps(response)
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "UPDATE responses SET status = 'done', response = ?, size = ?, created = ?, accessed = ? "
+            "WHERE request_id = ? AND status = 'pending' AND created = ?",
+            (data, len(data), now, now, request_id, claim)
+        )
+        self._evict(conn, now)
+
+    def release(self, request_id, claim):
+        """Drop a claim without storing a response; a waiting duplicate takes over"""
+        self._connection().execute(
+            "DELETE FROM responses WHERE request_id = ? AND status = 'pending' AND created = ?",
+            (request_id, claim)
+        )
+
+    async def complete_async(self, request_id, claim, response):
+        """complete() on the default executor"""
+        await asyncio.get_running_loop().run_in_executor(None, self.complete, request_id, claim, response)
+
+    async def release_async(self, request_id, claim):
+        """release() on the default executor"""
+        await asyncio.get_running_loop().run_in_executor(None, self.release, request_id, claim)
+
+    def _evict(self, conn, now):
+        # Rows unused for longer than the TTL are certainly expired
+        conn.execute("DELETE FROM responses WHERE status = 'done' AND accessed < ?", (now - self.ttl,))
+        while True:
+            entries, size = conn.execute("SELECT entries, bytes FROM totals").fetchone()
+            excess = entries - self.max_entries
+            if excess <= 0 and size <= self.max_bytes:
+                return
+            # Least recently used first
+            conn.execute(
+                "DELETE FROM responses WHERE request_id IN ("
+                "SELECT request_id FROM responses WHERE status = 'done' ORDER BY accessed LIMIT ?)",
+                (max(excess, 1) if size <= self.max_bytes else max(excess, EVICT_BATCH),)
+            )
+
+    def stats(self):
+        conn = self._connection()
+        entries, size = conn.execute("SELECT entries, bytes FROM totals").fetchone()
+        (pending,) = conn.execute("SELECT COUNT(*) FROM responses WHERE status = 'pending'").fetchone()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "pending": pending,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl
+        }
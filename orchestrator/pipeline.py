@@ -0,0 +1,218 @@
+import os
+import sys
+
+from common.serving import on_refork, prefork_master, refork_on_change
+
+PIPELINE_MODES = ('distributed', 'monolith')
+
+# Service directories the monolith imports from when run from a source checkout;
+# the monolith image copies the same modules next to app.py instead
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_DIRS = ('policy-service', 'retriever-agent', 'processor-agent')
+
+
+class StepError(Exception):
+    """A pipeline step failed; str() is the error returned to the client"""
+
+    def __init__(self, step, message):
+        super().__init__(message)
+        self.step = step
+
+
+class DistributedPipeline:
+    """Runs each step as an HTTP call to its service
+
+    Calls go through one pooled keep-alive ServiceClient per service.
+    Batch retrieval asks for `search_mode`, which should match the
+    retriever's SEARCH_MODE so batches rank like single requests. With
+    `refs` the retriever returns document references (id, title, category
+    and first sentence) instead of full documents, which the processor
+    summarizes the same way. Every call only reads, so all of them may be
+    hedged; a hedged call can leave two audit records in the called service.
+    `service_versions` (a query_cache.ServiceVersions) tracks the corpus
+    and policy versions for the query cache.
+    """
+
+    mode = 'distributed'
+
+    def __init__(self, policy, retriever, processor, search_mode='bm25', refs=False, service_versions=None):
+        self.clients = {"policy": policy, "retriever": retriever, "processor": processor}
+        self.search_mode = search_mode
+        self.refs = refs
+        self.service_versions = service_versions
+
+    def _post(self, step, path, payload, trace_id):
+        status, data = self.clients[step].post(path, payload, headers={'X-Trace-ID': trace_id}, idempotent=True)
+        if status != 200:
+            raise StepError(step, f"{step.capitalize()} service error")
+        return data
+
+    def check_policy(self, trace_id, request_id, query):
+        """Return the /policy response body"""
+        data = self._post('policy', '/policy', {"request_id": request_id, "query": query}, trace_id)
+        if self.service_versions is not None:
+            self.service_versions.observe_policy(data.get('policy_version'))
+        return data
+
+    def retrieve(self, trace_id, request_id, query):
+        """Return the documents found for query"""
+        data = self._post('retriever', '/retrieve', {
+            "request_id": request_id,
+            "query": query,
+            "refs": self.refs
+        }, trace_id)
+        return data.get('documents', [])
+
+    def process(self, trace_id, request_id, query, documents):
+        """Return the /process response body"""
+        return self._post('processor', '/process', {
+            "request_id": request_id,
+            "query": query,
+            "documents": documents
+        }, trace_id)
+
+    def _post_batch(self, step, path, payload, count, trace_id):
+        results = self._post(step, path, payload, trace_id).get('results')
+        if not isinstance(results, list) or len(results) != count:
+            raise StepError(step, f"{step.capitalize()} service returned an incomplete batch")
+        return results
+
+    def check_policy_batch(self, trace_id, items):
+        """Return one /policy/batch result per {request_id, query} item"""
+        return self._post_batch('policy', '/policy/batch', {"queries": items}, len(items), trace_id)
+
+    def retrieve_batch(self, trace_id, items):
+        """Return one /retrieve/batch result (documents or error) per {request_id, query} item"""
+        return self._post_batch('retriever', '/retrieve/batch', {
+            "queries": items,
+            "mode": self.search_mode,
+            "refs": self.refs
+        }, len(items), trace_id)
+
+    def process_batch(self, trace_id, items):
+        """Return one /process/batch result per {request_id, query, documents} item"""
+        return self._post_batch('processor', '/process/batch', {"items": items}, len(items), trace_id)
+
+    def pool_stats(self):
+        return {client.name: client.pool_stats() for client in self.clients.values()}
+
+    def max_seconds(self):
+        """Upper bound on one run: every step taking its longest call"""
+        return sum(client.max_call_seconds() for client in self.clients.values())
+
+    def versions(self):
+        """Corpus and policy versions results currently depend on, or None when unknown"""
+        return self.service_versions.current() if self.service_versions is not None else None
+
+
+class MonolithPipeline:
+    """Runs the policy, retrieval and processing logic in this process
+
+    The service modules are imported and called directly, so a request
+    costs no network round-trips or JSON encoding between steps. Every step
+    writes the audit record its service would have written, under that
+    service's name, so the audit trail is the same in both modes.
+    """
+
+    mode = 'monolith'
+
+    def __init__(self, audit, policy_rules_path, documents_path, search_mode='bm25',
+                 store_path=None, hot_reload=False, hot_reload_interval=2.0,
+                 result_cache_size=1024, on_cache_lookup=None):
+        for name in SERVICE_DIRS:
+            path = os.path.join(REPO_ROOT, name)
+            if os.path.isdir(path) and path not in sys.path:
+                sys.path.append(path)
+
+        # Imported here so the distributed mode does not need NumPy/SciPy
+        from corpus import LiveCorpus
+        from policy_engine import PolicyEngine
+        from processing import DocumentProcessor
+
+        self.audit = audit
+        self.policy = PolicyEngine.from_file(policy_rules_path)
+        self.corpus = LiveCorpus.from_file(documents_path, store_path=store_path)
+        if prefork_master() is not None:
+            # The pre-fork master reloads, then re-forks workers onto the new snapshot
+            on_refork(self.corpus.reload)
+            if hot_reload:
+                self.corpus.watch(hot_reload_interval, reload=refork_on_change)
+        elif hot_reload:
+            self.corpus.watch(hot_reload_interval)
+        self.search_mode = search_mode
+        self.processor = DocumentProcessor(result_cache_size, on_cache_lookup)
+
+    def check_policy(self, trace_id, request_id, query, endpoint='/policy'):
+        decision = self.policy.check(query)
+        self.audit(trace_id, request_id, endpoint, "allowed" if decision.allowed else "denied", {
+            "query": query,
+            "reason": decision.reason,
+            "matched_rules": decision.matched_rules
+        }, service='policy-service')
+        return {
+            "allowed": decision.allowed,
+            "reason": decision.reason,
+            "matched_rules": decision.matched_rules,
+            "policy_version": self.policy.version,
+            "request_id": request_id,
+            "trace_id": trace_id
+        }
+
+    def retrieve(self, trace_id, request_id, query, endpoint='/retrieve', snapshot=None):
+        snapshot = snapshot or self.corpus.snapshot
+        documents = snapshot.search(query, top_k=3, mode=self.search_mode)
+        self.audit(trace_id, request_id, endpoint, 'success', {
+            "query": query,
+            "mode": self.search_mode,
+            "documents_found": len(documents)
+        }, service='retriever-agent')
+        return documents
+
+    def process(self, trace_id, request_id, query, documents, endpoint='/process'):
+        summary, label, cached = self.processor.process(documents)
+        self.audit(trace_id, request_id, endpoint, 'cached' if cached else 'success', {
+            "query": query,
+            "documents_processed": len(documents),
+            "label": label
+        }, service='processor-agent')
+        return {
+            "request_id": request_id,
+            "trace_id": trace_id,
+            "summary": summary,
+            "label": label,
+            "document_count": len(documents)
+        }
+
+    def check_policy_batch(self, trace_id, items):
+        return [self.check_policy(trace_id, item['request_id'], item['query'], endpoint='/policy/batch')
+                for item in items]
+
+    def retrieve_batch(self, trace_id, items):
+        # Every item searches the same corpus snapshot, as in /retrieve/batch
+        snapshot = self.corpus.snapshot
+        results = []
+        for item in items:
+            documents = self.retrieve(trace_id, item['request_id'], item['query'],
+                                      endpoint='/retrieve/batch', snapshot=snapshot)
+            results.append({
+                "request_id": item['request_id'],
+                "query": item['query'],
+                "documents": documents,
+                "count": len(documents)
+            })
+        return results
+
+    def process_batch(self, trace_id, items):
+        return [self.process(trace_id, item['request_id'], item['query'], item['documents'], endpoint='/process/batch')
+                for item in items]
+
+    def pool_stats(self):
+        # No downstream connections in-process
+        return {}
+
+    def max_seconds(self):
+        # No timeouts bound an in-process run
+        return None
+
+    def versions(self):
+        return {"corpus": self.corpus.version, "policy": self.policy.version}
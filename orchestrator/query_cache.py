@@ -0,0 +1,189 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    """Cache key for query: lowercased, whitespace runs collapsed to one space
+
+    Retrieval lowercases queries and splits them on whitespace (phrases
+    included), and processing only sees the retrieved documents, so every
+    query with the same key gets the same summary. Policy rules may still
+    tell such queries apart.
+    """
+    return ' '.join(query.lower().split())
+
+
+class _Entry:
+    __slots__ = ('result', 'expires', 'allowed')
+
+    def __init__(self, result, expires, query):
+        self.result = result
+        self.expires = expires
+        # Exact query texts the policy allowed under the cache's versions
+        self.allowed = {query}
+
+
+class QueryCache:
+    """LRU of final results ({summary, label, document_count}) per normalized query
+
+    Bounded by `max_entries` and by `ttl` seconds per entry. Every entry
+    belongs to the corpus and policy versions current_versions() (from
+    `versions()`) returned before it was computed; when they change the
+    whole cache is dropped, and while they are unknown (None) the cache is
+    bypassed. Only allowed queries are stored. A lookup reports whether the
+    policy already allowed that exact text, so a repeat skips every hop
+    while another spelling of a cached query still gets a policy decision
+    and denials are never served from the cache. Kept per worker process,
+    separate from the idempotency store, which replays responses per
+    request_id.
+    """
+
+    def __init__(self, versions, max_entries=1024, ttl=60.0, max_variants=8):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_variants = max_variants
+        self._entries = OrderedDict()
+        self._versions = None
+        self._lock = threading.Lock()
+        self.invalidations = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def current_versions(self):
+        """Versions results computed now belong to, or None when unknown; drops stale entries"""
+        versions = self.versions()
+        with self._lock:
+            if versions != self._versions:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._versions = versions
+        return versions
+
+    def lookup(self, query, versions):
+        """Return (result, allowed) for a query cached under `versions`, else None
+
+        `allowed` is True when the policy already allowed this exact text;
+        otherwise the caller must check the policy and call allow() before
+        serving the result.
+        """
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key) if versions == self._versions else None
+            if entry is not None and entry.expires <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.result, query in entry.allowed
+
+    def allow(self, query):
+        """Record that the policy allowed this exact text of a cached query"""
+        with self._lock:
+            entry = self._entries.get(normalize_query(query))
+            if entry is not None and len(entry.allowed) < self.max_variants:
+                entry.allowed.add(query)
+
+    def store(self, query, result, versions):
+        """Cache the result of an allowed query, computed under `versions`"""
+        if versions is None:
+            return
+        key = normalize_query(query)
+        with self._lock:
+            # Computed under versions that have since been replaced
+            if versions != self._versions:
+                return
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.result = result
+                entry.expires = time.monotonic() + self.ttl
+                if len(entry.allowed) < self.max_variants:
+                    entry.allowed.add(query)
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = _Entry(result, time.monotonic() + self.ttl, query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "versions": self._versions,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class ServiceVersions:
+    """Corpus and policy versions of the downstream services
+
+    Polls the retriever's and policy service's /health every `interval`
+    seconds. current() is None until both have answered and after any
+    failed poll, so cached results are only served against versions a
+    service has just confirmed. Policy versions seen in /policy responses
+    are taken straight away, ahead of the next poll.
+    """
+
+    def __init__(self, retriever_url, policy_url, interval=2.0, timeout=2.0):
+        self.retriever_url = retriever_url
+        self.policy_url = policy_url
+        self.interval = interval
+        self.timeout = timeout
+        self._versions = None
+        self._start()
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        """(Re)start the poller; also runs in forked children"""
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='service-versions', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+    def _get(self, url):
+        response = requests.get(f"{url}/health", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def poll(self):
+        try:
+            retriever = self._get(self.retriever_url)
+            policy = self._get(self.policy_url)
+            versions = {
+                "corpus": [retriever['corpus_id'], retriever['corpus_version']],
+                "policy": policy['policy_version']
+            }
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            if self._versions is not None:
+                logger.warning("Query cache disabled until the next version check succeeds: %s", e)
+            versions = None
+        with self._lock:
+            self._versions = versions
+
+    def observe_policy(self, version):
+        """Take the policy_version of a /policy response"""
+        with self._lock:
+            if version and self._versions is not None and self._versions['policy'] != version:
+                self._versions = dict(self._versions, policy=version)
+
+    def current(self):
+        return self._versions
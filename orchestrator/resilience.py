@@ -0,0 +1,340 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from prometheus_client import Counter, Gauge
+
+# Breaker state per service, as a number so the worst worker shows on /metrics
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = Gauge('circuit_breaker_state', "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+                      ('service',), multiprocess_mode='livemax')
+BREAKER_REJECTIONS = Counter('circuit_breaker_rejections_total', "Calls failed fast by an open circuit breaker",
+                             ('service',))
+HEDGES = Counter('downstream_hedges_total', "Hedged duplicate calls by the attempt that answered first",
+                 ('service', 'path', 'winner'))
+TIMEOUTS = Gauge('downstream_timeout_seconds', "Current adaptive read timeout",
+                 ('service', 'path'), multiprocess_mode='livemax')
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit breaker is open"""
+
+    def __init__(self, service, retry_after):
+        super().__init__(f"{service} is unavailable (circuit open)")
+        self.service = service
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fails calls fast while a service keeps failing
+
+    Opens after `consecutive_failures` failures in a row, or when at least
+    `min_calls` of the last `window` calls finished and `failure_rate` of
+    them failed. After `reset_timeout` seconds one probe call is let
+    through (half-open): success closes the breaker, failure opens it again.
+    Only the probe's outcome moves it out of half-open; calls let through
+    before it opened still count in the window, but change no state.
+    """
+
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5, consecutive_failures=5,
+                 reset_timeout=10.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.consecutive_failures = consecutive_failures
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        self._streak = 0
+        self._opened_at = None
+        self._probe = None
+        self.state = CLOSED
+        BREAKER_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    def _set_state(self, state):
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(STATE_VALUES[state])
+
+    def acquire(self):
+        """Return a token for record() or cancel(); raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return None
+            waited = time.monotonic() - self._opened_at
+            if self.state == OPEN and waited >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and self._probe is None:
+                self._probe = object()
+                return self._probe
+        BREAKER_REJECTIONS.labels(self.name).inc()
+        raise CircuitOpenError(self.name, max(0.0, self.reset_timeout - waited))
+
+    def record(self, token, success):
+        """Count the outcome of the call acquire() returned token for"""
+        with self._lock:
+            if token is not None and token is self._probe:
+                self._probe = None
+                if success:
+                    self._outcomes.clear()
+                    self._failures = self._streak = 0
+                    self._set_state(CLOSED)
+                else:
+                    self._opened_at = time.monotonic()
+                    self._set_state(OPEN)
+                return
+            if len(self._outcomes) == self._outcomes.maxlen:
+                self._failures -= not self._outcomes[0]
+            self._outcomes.append(success)
+            self._failures += not success
+            self._streak = 0 if success else self._streak + 1
+            if self.state == CLOSED and (self._streak >= self.consecutive_failures or (
+                    len(self._outcomes) >= self.min_calls
+                    and self._failures >= self.failure_rate * len(self._outcomes))):
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def cancel(self, token):
+        """The call acquire() returned token for was abandoned without an outcome"""
+        with self._lock:
+            if token is not None and token is self._probe:
+                self._probe = None
+
+    def as_dict(self):
+        with self._lock:
+            return {"state": self.state, "recent_calls": len(self._outcomes), "recent_failures": self._failures}
+
+
+class LatencyWindow:
+    """Percentiles of the last `size` latencies of one endpoint
+
+    The sorted copy the percentiles are read from is rebuilt every
+    `refresh` observations, so a call costs an append, not a sort.
+    """
+
+    def __init__(self, size=512, min_samples=20, refresh=16):
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+        self._sorted = []
+        self._pending = 0
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._pending += 1
+            if self._pending >= self.refresh or len(self._sorted) < self.min_samples:
+                self._sorted = sorted(self._samples)
+                self._pending = 0
+
+    def percentile(self, q):
+        """q-th percentile in seconds, or None before min_samples calls"""
+        ordered = self._sorted
+        if len(ordered) < self.min_samples:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class Resilience:
+    """Adaptive timeouts, hedging and a circuit breaker for one downstream service
+
+    - The read timeout of each path is `timeout_multiplier` × its p99,
+      kept between `min_timeout` and the configured `max_timeout`
+      (which applies until the path has `min_samples` calls). A call that
+      runs out its timeout counts as a sample of that length, so a service
+      that gets slower raises its own timeout rather than tripping the breaker
+    - An idempotent call still unanswered after its path's p95
+      (`hedge_percentile`) is sent again and the first good answer wins;
+      at most `hedge_budget` of the calls are hedged
+    - 5xx responses, timeouts and connection errors count as failures
+      for the circuit breaker
+
+    Latencies and breaker state are kept per worker process.
+    """
+
+    def __init__(self, name, max_timeout, min_timeout=0.25, timeout_multiplier=4.0,
+                 hedge_percentile=95, hedge_budget=0.1, breaker=None, window=512, min_samples=100):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.timeout_multiplier = timeout_multiplier
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.breaker = breaker or CircuitBreaker(name)
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._call_count = 0
+        self._hedge_count = 0
+
+    @classmethod
+    def from_env(cls, name, max_timeout):
+        """Configured from ADAPTIVE_TIMEOUT_MIN, _MULTIPLIER, HEDGE_PERCENTILE, HEDGE_BUDGET and BREAKER_*"""
+        return cls(
+            name,
+            max_timeout,
+            min_timeout=float(os.getenv('ADAPTIVE_TIMEOUT_MIN', '0.25')),
+            timeout_multiplier=float(os.getenv('ADAPTIVE_TIMEOUT_MULTIPLIER', '4')),
+            hedge_percentile=float(os.getenv('HEDGE_PERCENTILE', '95')),
+            hedge_budget=float(os.getenv('HEDGE_BUDGET', '0.1')),
+            breaker=CircuitBreaker(
+                name,
+                window=int(os.getenv('BREAKER_WINDOW', '20')),
+                min_calls=int(os.getenv('BREAKER_MIN_CALLS', '5')),
+                failure_rate=float(os.getenv('BREAKER_FAILURE_RATE', '0.5')),
+                consecutive_failures=int(os.getenv('BREAKER_CONSECUTIVE_FAILURES', '5')),
+                reset_timeout=float(os.getenv('BREAKER_RESET_TIMEOUT', '10'))
+            )
+        )
+
+    def _window(self, path):
+        latencies = self._latencies.get(path)
+        if latencies is None:
+            with self._lock:
+                latencies = self._latencies.setdefault(path, LatencyWindow(self.window, self.min_samples))
+        return latencies
+
+    def timeout(self, path):
+        p99 = self._window(path).percentile(99)
+        if p99 is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_multiplier))
+
+    def hedge_delay(self, path):
+        """Seconds to wait before hedging a call to path, or None to not hedge it"""
+        return self._window(path).percentile(self.hedge_percentile)
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self._hedge_count >= self.hedge_budget * self._call_count:
+                return False
+            self._hedge_count += 1
+            return True
+
+    def _start(self, path):
+        """Return (breaker token, timeout) for a call on path"""
+        token = self.breaker.acquire()
+        with self._lock:
+            self._call_count += 1
+        timeout = self.timeout(path)
+        TIMEOUTS.labels(self.name, path).set(timeout)
+        return token, timeout
+
+    def _observe(self, path, started, timeout, result=None):
+        elapsed = time.perf_counter() - started
+        if (result is not None and result[0] < 500) or elapsed >= timeout:
+            self._window(path).observe(elapsed)
+
+    def _attempt(self, path, attempt, timeout):
+        """attempt(timeout) -> (status, body), recording the latency of good and timed-out answers"""
+        started = time.perf_counter()
+        try:
+            result = attempt(timeout)
+        except Exception:
+            self._observe(path, started, timeout)
+            raise
+        self._observe(path, started, timeout, result)
+        return result
+
+    def call(self, path, attempt, executor=None):
+        """Run attempt(timeout) -> (status, body), hedged on executor when one is given"""
+        token, timeout = self._start(path)
+        try:
+            delay = self.hedge_delay(path) if executor is not None else None
+            if delay is None:
+                result = self._attempt(path, attempt, timeout)
+            else:
+                result = self._hedged(path, attempt, timeout, delay, executor)
+        except Exception:
+            self.breaker.record(token, False)
+            raise
+        except BaseException:
+            self.breaker.cancel(token)
+            raise
+        self.breaker.record(token, result[0] < 500)
+        return result
+
+    def _hedged(self, path, attempt, timeout, delay, executor):
+        first = executor.submit(self._attempt, path, attempt, timeout)
+        done, _ = wait([first], timeout=delay)
+        if done or not self._allow_hedge():
+            return first.result()
+        second = executor.submit(self._attempt, path, attempt, timeout)
+        # The slower attempt finishes in the background and is dropped
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result()[0] < 500:
+                    HEDGES.labels(self.name, path, 'primary' if future is first else 'hedge').inc()
+                    return future.result()
+        return future.result()
+
+    async def call_async(self, path, attempt, hedge=False):
+        """Coroutine version of call(); the losing attempt is cancelled"""
+        token, timeout = self._start(path)
+        try:
+            delay = self.hedge_delay(path) if hedge else None
+            result = await self._hedged_async(path, attempt, timeout, delay)
+        except asyncio.CancelledError:
+            self.breaker.cancel(token)
+            raise
+        except Exception:
+            self.breaker.record(token, False)
+            raise
+        self.breaker.record(token, result[0] < 500)
+        return result
+
+    async def _attempt_async(self, path, attempt, timeout):
+        started = time.perf_counter()
+        try:
+            result = await attempt(timeout)
+        except Exception:
+            self._observe(path, started, timeout)
+            raise
+        self._observe(path, started, timeout, result)
+        return result
+
+    async def _hedged_async(self, path, attempt, timeout, delay):
+        if delay is None:
+            return await self._attempt_async(path, attempt, timeout)
+        first = asyncio.ensure_future(self._attempt_async(path, attempt, timeout))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._allow_hedge():
+                return await first
+            tasks.add(asyncio.ensure_future(self._attempt_async(path, attempt, timeout)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result()[0] < 500:
+                        HEDGES.labels(self.name, path, 'primary' if task is first else 'hedge').inc()
+                        return task.result()
+            return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def as_dict(self):
+        return {
+            "breaker": self.breaker.as_dict(),
+            "calls": self._call_count,
+            "hedged": self._hedge_count,
+            "paths": {
+                path: {
+                    "timeout": round(self.timeout(path), 4),
+                    "hedge_delay": self.hedge_delay(path),
+                    "p95": latencies.percentile(95),
+                    "p99": latencies.percentile(99)
+                } for path, latencies in list(self._latencies.items())
+            }
+        }
@@ -0,0 +1,25 @@
+import json
+
+# Stream formats of /process-request/stream and their content types
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream'
+}
+
+# Sent with every stream so proxies pass events through as they are written
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+
+def stream_format(accept):
+    """'sse' when the client accepts text/event-stream, otherwise 'ndjson'"""
+    return 'sse' if 'text/event-stream' in (accept or '') else 'ndjson'
+
+
+def encode_event(fmt, event, data):
+    """One stage event as an NDJSON line or a Server-Sent Event"""
+    if fmt == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+    return (json.dumps({"event": event, "data": data}) + '\n').encode('utf-8')
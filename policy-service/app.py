@@ -1,71 +1,117 @@
 from flask import Flask, request, jsonify
 import logging
-import json
 import os
-from datetime import datetime
 import uuid
 
+from prometheus_client import Counter
+
+from common.audit import AuditWriter
+from common.metrics import instrument_flask
+from common.wire import request_payload, respond
+from policy_engine import PolicyEngine
+
 app = Flask(__name__)
 
 # Setup logging
-os.makedirs('/app/logs', exist_ok=True)
 logging.basicConfig(level=logging.INFO)
 
+# Audit records are written in batches by a background thread
+AUDIT = AuditWriter.from_env('policy-service')
+
+# Request latency and in-flight metrics, served on /metrics
+instrument_flask(app)
+DECISIONS = Counter('policy_decisions_total', "Policy checks by outcome", ('endpoint', 'decision'))
+
+# Compile the rule set once at startup
+POLICY_RULES_PATH = os.getenv('POLICY_RULES_PATH', '/app/policy_rules.json')
+POLICY = PolicyEngine.from_file(POLICY_RULES_PATH)
+
 def log_audit(trace_id, request_id, endpoint, status, details):
-    """Log request to audit.jsonl"""
-    log_entry = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "service": "policy-service",
-        "trace_id": trace_id,
-        "request_id": request_id,
-        "endpoint": endpoint,
-        "status": status,
-        "details": details
-    }
-    
-    with open('/app/logs/audit.jsonl', 'a') as f:
-        f.write(json.dumps(log_entry) + '\n')
+    """Queue a record for audit.jsonl"""
+    AUDIT.log(trace_id, request_id, endpoint, status, details)
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "service": "policy-service"}), 200
+    return jsonify({"status": "healthy", "service": "policy-service", "policy_version": POLICY.version}), 200
 
 @app.route('/policy', methods=['POST'])
 def check_policy():
     """Check if the request violates any policy"""
-    data = request.get_json()
+    data = request_payload()
     
     trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
     request_id = data.get('request_id', 'unknown')
     query = data.get('query', '')
     
-    # Check for forbidden words
-    forbidden_words = ['forbidden', 'banned', 'illegal']
-    is_allowed = True
-    reason = "Policy check passed"
-    
-    for word in forbidden_words:
-        if word.lower() in query.lower():
-            is_allowed = False
-            reason = f"Query contains forbidden word: '{word}'"
-            break
+    # Check every rule in one pass over the query
+    decision = POLICY.check(query)
+    is_allowed = decision.allowed
+    reason = decision.reason
     
     status = "allowed" if is_allowed else "denied"
+    DECISIONS.labels('/policy', status).inc()
     
     log_audit(trace_id, request_id, '/policy', status, {
         "query": query,
-        "reason": reason
+        "reason": reason,
+        "matched_rules": decision.matched_rules
     })
     
     response = {
         "allowed": is_allowed,
         "reason": reason,
+        "matched_rules": decision.matched_rules,
+        "policy_version": POLICY.version,
         "request_id": request_id,
         "trace_id": trace_id
     }
     
-    return jsonify(response), 200
+    return respond(response)
+
+@app.route('/policy/batch', methods=['POST'])
+def check_policy_batch():
+    """Check many queries against the policy rules"""
+    data = request_payload()
+    
+    trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
+    items = data.get('queries') if isinstance(data, dict) else None
+    
+    if not isinstance(items, list):
+        log_audit(trace_id, 'batch', '/policy/batch', 'error', {"error": "queries must be a list"})
+        return respond({"error": "queries must be a list"}, 400)
+    
+    results = []
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        request_id = item.get('request_id', 'unknown')
+        query = item.get('query', '')
+        
+        decision = POLICY.check(query)
+        status = "allowed" if decision.allowed else "denied"
+        DECISIONS.labels('/policy/batch', status).inc()
+        
+        log_audit(trace_id, request_id, '/policy/batch', status, {
+            "query": query,
+            "reason": decision.reason,
+            "matched_rules": decision.matched_rules
+        })
+        
+        results.append({
+            "allowed": decision.allowed,
+            "reason": decision.reason,
+            "matched_rules": decision.matched_rules,
+            "request_id": request_id
+        })
+    
+    response = {
+        "trace_id": trace_id,
+        "results": results,
+        "count": len(results),
+        "policy_version": POLICY.version
+    }
+    
+    return respond(response)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=False)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5001')), debug=False)
 
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import re
+from collections import deque
+
+try:
+    from re import _parser
+except ImportError:  # Python < 3.11
+    import sre_parse as _parser
+
+RULE_TYPES = ('term', 'regex')
+
+_LITERAL = _parser.LITERAL
+# ASCII letters that IGNORECASE also matches against characters whose
+# lower() is something else (the dotted/dotless I and the long s), so a
+# lowercased query could miss them
+_CASE_FOLDED = frozenset('is')
+
+
+class PolicyRule:
+    """A single compliance rule"""
+
+    __slots__ = ('id', 'type', 'pattern', 'whole_word', 'reason')
+
+    def __init__(self, id, type, pattern, whole_word=False, reason=None):
+        self.id = id
+        self.type = type
+        self.pattern = pattern
+        self.whole_word = whole_word
+        if reason is None:
+            if type == 'term':
+                reason = f"Query contains forbidden word: '{pattern}'"
+            else:
+                reason = f"Query matches forbidden pattern: '{id}'"
+        self.reason = reason
+
+
+def load_rules(path):
+    """Read and validate a JSON list of rules"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError("Policy rules file must contain a list")
+
+    rules = []
+    seen = set()
+    for position, item in enumerate(data):
+        if not isinstance(item, dict) or not item.get('pattern'):
+            raise ValueError(f"Rule {position} must be an object with a pattern")
+        rule_type = item.get('type', 'term')
+        if rule_type not in RULE_TYPES:
+            raise ValueError(f"Rule {position} has unknown type: {rule_type}")
+        if rule_type == 'regex':
+            try:
+                re.compile(item['pattern'])
+            except re.error as e:
+                raise ValueError(f"Rule {position} has an invalid regex: {e}")
+        rule_id = item.get('id', item['pattern'])
+        if rule_id in seen:
+            raise ValueError(f"Duplicate rule id: {rule_id}")
+        seen.add(rule_id)
+        rules.append(PolicyRule(
+            rule_id, rule_type, item['pattern'],
+            whole_word=bool(item.get('whole_word', False)),
+            reason=item.get('reason')
+        ))
+    return rules
+
+
+class AhoCorasick:
+    """Automaton reporting every occurrence of a set of literal patterns"""
+
+    def __init__(self, patterns):
+        # Trie: per state, character -> next state
+        self.goto = [{}]
+        self.fail = [0]
+        # Per state, (pattern number, pattern length) ending here
+        self.outputs = [[]]
+
+        for number, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append((number, len(pattern)))
+
+        # Breadth-first pass wiring failure links and merging outputs
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        """Yield (pattern number, start, end) for every match in text"""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for number, length in outputs[state]:
+                yield number, position + 1 - length, position + 1
+
+
+class PolicyDecision:
+    """Outcome of checking one query"""
+
+    __slots__ = ('allowed', 'reason', 'matched_rules')
+
+    def __init__(self, allowed, reason, matched_rules):
+        self.allowed = allowed
+        self.reason = reason
+        self.matched_rules = matched_rules
+
+
+def rules_version(rules):
+    """Short digest of everything a decision depends on; equal rule sets share it"""
+    fields = [[rule.id, rule.type, rule.pattern, rule.whole_word, rule.reason] for rule in rules]
+    return hashlib.sha256(json.dumps(fields).encode('utf-8')).hexdigest()[:16]
+
+
+class PolicyEngine:
+    """Compiled rule set evaluated in a single pass per query
+
+    Term rules (case-insensitive substrings, optionally whole-word) and the
+    required literal of every regex rule are compiled into one Aho-Corasick
+    automaton, so a single scan of the query reports every matched term and
+    the few regex rules that can possibly match. Only those candidates (plus
+    regexes without a usable literal) are then run. The reported reason is
+    that of the first matched rule in file order, matching the original
+    first-forbidden-word behaviour.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.version = rules_version(self.rules)
+        self._order = {rule.id: position for position, rule in enumerate(self.rules)}
+        self._regexes = {}
+        # Automaton pattern number -> rule (term rules and regex literals)
+        self._patterns = []
+        # Regex rules that must always be run
+        self._unfiltered = []
+
+        literals = []
+        for rule in self.rules:
+            if rule.type == 'term':
+                self._patterns.append(rule)
+                literals.append(rule.pattern.lower())
+                continue
+            self._regexes[rule.id] = re.compile(rule.pattern, re.IGNORECASE)
+            literal = required_literal(rule.pattern)
+            if literal:
+                self._patterns.append(rule)
+                literals.append(literal)
+            else:
+                self._unfiltered.append(rule)
+        self._automaton = AhoCorasick(literals)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_rules(path))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def matched_rules(self, query):
+        """Rules matched by query, in rule file order"""
+        matched = {}
+        candidates = {rule.id: rule for rule in self._unfiltered}
+        text = query.lower()
+        for number, start, end in self._automaton.iter_matches(text):
+            rule = self._patterns[number]
+            if rule.id in matched or rule.id in candidates:
+                continue
+            if rule.type == 'regex':
+                candidates[rule.id] = rule
+            elif not rule.whole_word or _is_whole_word(text, start, end):
+                matched[rule.id] = rule
+
+        for rule in candidates.values():
+            if self._regexes[rule.id].search(query):
+                matched[rule.id] = rule
+
+        return sorted(matched.values(), key=lambda rule: self._order[rule.id])
+
+    def check(self, query):
+        """Evaluate query against every rule"""
+        matched = self.matched_rules(query)
+        if not matched:
+            return PolicyDecision(True, "Policy check passed", [])
+        return PolicyDecision(False, matched[0].reason, [rule.id for rule in matched])
+
+
+def required_literal(pattern):
+    """Longest lowercase ASCII string every match of pattern must contain
+
+    Taken from the parsed pattern, so escapes (\\x41, \\101, \\N{...}) and
+    repeats are read the way re reads them: only consecutive literal
+    characters at the top level count, and anything else (a group, class,
+    repeat or alternation) ends the run. Returns '' when nothing usable is
+    found, in which case the rule is always run.
+    """
+    best = ''
+    run = ''
+    for op, argument in _parser.parse(pattern):
+        char = chr(argument) if op is _LITERAL else ''
+        if char and char.isascii() and char.lower() not in _CASE_FOLDED:
+            run += char.lower()
+        else:
+            best = max(best, run, key=len)
+            run = ''
+    return max(best, run, key=len)
+
+
+def _is_whole_word(text, start, end):
+    before = text[start - 1] if start > 0 else ' '
+    after = text[end] if end < len(text) else ' '
+    return not (before.isalnum() or before == '_') and not (after.isalnum() or after == '_')
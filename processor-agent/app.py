@@ -1,108 +1,68 @@
 from flask import Flask, request, jsonify
 import logging
-import json
 import os
-from datetime import datetime
 import uuid
 
+from prometheus_client import Counter
+
+from common.audit import AuditWriter
+from common.metrics import instrument_flask
+from common.wire import request_payload, respond
+from processing import DocumentProcessor
+
 app = Flask(__name__)
 
 # Setup logging
-os.makedirs('/app/logs', exist_ok=True)
 logging.basicConfig(level=logging.INFO)
 
-# In-memory cache for idempotency
-request_cache = {}
+# Audit records are written in batches by a background thread
+AUDIT = AuditWriter.from_env('processor-agent')
 
-def log_audit(trace_id, request_id, endpoint, status, details):
-    """Log request to audit.jsonl"""
-    log_entry = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "service": "processor-agent",
-        "trace_id": trace_id,
-        "request_id": request_id,
-        "endpoint": endpoint,
-        "status": status,
-        "details": details
-    }
-    
-    with open('/app/logs/audit.jsonl', 'a') as f:
-        f.write(json.dumps(log_entry) + '\n')
+# Request latency and in-flight metrics, served on /metrics
+instrument_flask(app)
+CACHE_LOOKUPS = Counter('processor_cache_lookups_total', "Processing cache lookups by cache and result",
+                        ('cache', 'result'))
 
-def summarize_documents(documents):
-    """Create a summary from documents"""
-    if not documents:
-        return "No documents found to summarize."
-    
-    # Extract key information
-    titles = [doc.get('title', 'Untitled') for doc in documents]
-    categories = list(set([doc.get('category', 'Unknown') for doc in documents]))
-    
-    # Simple extractive summary - take first sentence from each document
-    summaries = []
-    for doc in documents:
-        content = doc.get('content', '')
-        first_sentence = content.split('.')[0] if content else ''
-        if first_sentence:
-            summaries.append(first_sentence.strip())
-    
-    summary = f"Found {len(documents)} relevant document(s) in categories: {', '.join(categories)}. "
-    summary += "Key topics: " + "; ".join(titles[:3]) + ". "
-    
-    if summaries:
-        summary += "Summary: " + " | ".join(summaries[:2])
-    
-    return summary
+# Bounded cache of results, keyed on document content
+PROCESSOR = DocumentProcessor(
+    max_results=int(os.getenv('RESULT_CACHE_SIZE', '1024')),
+    on_lookup=lambda cache, hit: CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+)
 
-def generate_label(documents):
-    """Generate a label based on document categories"""
-    if not documents:
-        return "NO_RESULTS"
-    
-    categories = [doc.get('category', 'Unknown') for doc in documents]
-    most_common = max(set(categories), key=categories.count)
-    
-    label_map = {
-        "AI": "ARTIFICIAL_INTELLIGENCE",
-        "Cloud": "CLOUD_COMPUTING",
-        "Architecture": "SOFTWARE_ARCHITECTURE",
-        "DevOps": "DEVOPS",
-        "API": "API_DESIGN",
-        "Programming": "PROGRAMMING",
-        "Database": "DATABASE",
-        "Security": "SECURITY"
-    }
-    
-    return label_map.get(most_common, "GENERAL")
+def log_audit(trace_id, request_id, endpoint, status, details):
+    """Queue a record for audit.jsonl"""
+    AUDIT.log(trace_id, request_id, endpoint, status, details)
+
+def valid_documents(documents):
+    return isinstance(documents, list) and all(isinstance(doc, dict) for doc in documents)
 
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({"status": "healthy", "service": "processor-agent"}), 200
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss/eviction counters of the result cache"""
+    return jsonify(PROCESSOR.stats()), 200
+
 @app.route('/process', methods=['POST'])
 def process():
     """Process and summarize documents"""
-    data = request.get_json()
+    data = request_payload()
     
     trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
     request_id = data.get('request_id', 'unknown')
     documents = data.get('documents', [])
     query = data.get('query', '')
     
-    # Check for idempotency - return cached response if exists
-    if request_id in request_cache:
-        cached_response = request_cache[request_id]
-        log_audit(trace_id, request_id, '/process', 'cached', {
-            "query": query,
-            "message": "Returned cached response"
-        })
-        return jsonify(cached_response), 200
+    if not valid_documents(documents):
+        log_audit(trace_id, request_id, '/process', 'error', {"error": "documents must be a list of objects"})
+        return respond({"error": "documents must be a list of objects"}, 400)
     
-    # Process documents
-    summary = summarize_documents(documents)
-    label = generate_label(documents)
+    # Process documents; identical document lists are served from the cache
+    summary, label, cached = PROCESSOR.process(documents)
     
-    log_audit(trace_id, request_id, '/process', 'success', {
+    log_audit(trace_id, request_id, '/process', 'cached' if cached else 'success', {
         "query": query,
         "documents_processed": len(documents),
         "label": label
@@ -116,11 +76,56 @@ def process():
         "document_count": len(documents)
     }
     
-    # Cache the response for idempotency
-    request_cache[request_id] = response
+    return respond(response)
+
+@app.route('/process/batch', methods=['POST'])
+def process_batch():
+    """Process and summarize the documents of many requests at once"""
+    data = request_payload()
+    
+    trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
+    items = data.get('items') if isinstance(data, dict) else None
+    
+    if not isinstance(items, list):
+        log_audit(trace_id, 'batch', '/process/batch', 'error', {"error": "items must be a list"})
+        return respond({"error": "items must be a list"}, 400)
+    
+    results = []
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        request_id = item.get('request_id', 'unknown')
+        documents = item.get('documents', [])
+        query = item.get('query', '')
+        
+        # A malformed item is reported on its own instead of failing the batch
+        if not valid_documents(documents):
+            log_audit(trace_id, request_id, '/process/batch', 'error', {"error": "documents must be a list of objects"})
+            results.append({"request_id": request_id, "error": "documents must be a list of objects"})
+            continue
+        
+        summary, label, cached = PROCESSOR.process(documents)
+        
+        log_audit(trace_id, request_id, '/process/batch', 'cached' if cached else 'success', {
+            "query": query,
+            "documents_processed": len(documents),
+            "label": label
+        })
+        
+        results.append({
+            "request_id": request_id,
+            "summary": summary,
+            "label": label,
+            "document_count": len(documents)
+        })
+    
+    response = {
+        "trace_id": trace_id,
+        "results": results,
+        "count": len(results)
+    }
     
-    return jsonify(response), 200
+    return respond(response)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5003, debug=False)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5003')), debug=False)
 
@@ -0,0 +1,159 @@
+import functools
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from common.document_refs import first_sentence
+
+# Fields a response depends on, with the defaults the summary uses for missing ones;
+# references carry first_sentence instead of content
+DOCUMENT_DEFAULTS = (('id', ''), ('title', 'Untitled'), ('content', ''), ('category', 'Unknown'),
+                     ('first_sentence', None))
+
+_MISSING = object()
+
+def summarize_documents(documents):
+    """Create a summary from documents or document references
+    
+    A reference carries the first sentence of its content in its
+    first_sentence field.
+    """
+    if not documents:
+        return "No documents found to summarize."
+    
+    # Extract key information
+    titles = [doc.get('title', 'Untitled') for doc in documents]
+    # First-appearance order keeps the output identical across processes
+    categories = list(dict.fromkeys(doc.get('category', 'Unknown') for doc in documents))
+    
+    # Simple extractive summary - take first sentence from each document
+    summaries = []
+    for doc in documents:
+        if 'first_sentence' in doc:
+            sentence = doc['first_sentence']
+        else:
+            sentence = first_sentence(doc.get('content', ''))
+        if sentence:
+            summaries.append(sentence.strip())
+    
+    summary = f"Found {len(documents)} relevant document(s) in categories: {', '.join(categories)}. "
+    summary += "Key topics: " + "; ".join(titles[:3]) + ". "
+    
+    if summaries:
+        summary += "Summary: " + " | ".join(summaries[:2])
+    
+    return summary
+
+def generate_label(documents):
+    """Generate a label based on document categories"""
+    if not documents:
+        return "NO_RESULTS"
+    
+    categories = [doc.get('category', 'Unknown') for doc in documents]
+    most_common = max(dict.fromkeys(categories), key=categories.count)
+    
+    label_map = {
+        "AI": "ARTIFICIAL_INTELLIGENCE",
+        "Cloud": "CLOUD_COMPUTING",
+        "Architecture": "SOFTWARE_ARCHITECTURE",
+        "DevOps": "DEVOPS",
+        "API": "API_DESIGN",
+        "Programming": "PROGRAMMING",
+        "Database": "DATABASE",
+        "Security": "SECURITY"
+    }
+    
+    return label_map.get(most_common, "GENERAL")
+
+class LRUCache:
+    """Thread-safe, size-bounded mapping that evicts the least recently used key
+    
+    on_lookup(hit), if given, is called after every get(), e.g. to count
+    hits in a metric.
+    """
+    
+    def __init__(self, max_entries, on_lookup=None):
+        self.max_entries = max_entries
+        self.on_lookup = on_lookup
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if self.on_lookup is not None:
+            self.on_lookup(value is not _MISSING)
+        return default if value is _MISSING else value
+    
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+def document_digest(doc):
+    """SHA-256 of every field the summary and label depend on"""
+    digest = hashlib.sha256()
+    for field, default in DOCUMENT_DEFAULTS:
+        value = doc.get(field, default)
+        # Tagged and length-prefixed so values and field boundaries are unambiguous
+        tag, value = (b's', value) if isinstance(value, str) else (b'j', json.dumps(value, sort_keys=True))
+        value = value.encode('utf-8')
+        digest.update(b'%s%d:' % (tag, len(value)))
+        digest.update(value)
+    return digest.digest()
+
+class DocumentProcessor:
+    """summarize_documents/generate_label memoized on document content
+    
+    Whole results are cached under a hash of the ordered document list
+    (ids, titles, contents and categories), so a repeated retrieval result
+    skips processing entirely, whatever request_id it arrives with.
+    on_lookup(cache, hit) is called after every lookup, with cache
+    'results'.
+    """
+    
+    def __init__(self, max_results=1024, on_lookup=None):
+        self.results = LRUCache(max_results, functools.partial(on_lookup, 'results') if on_lookup else None)
+    
+    def process(self, documents):
+        """Return (summary, label, cached) for documents"""
+        digest = hashlib.sha256()
+        for doc in documents:
+            digest.update(document_digest(doc))
+        key = digest.digest()
+        
+        result = self.results.get(key)
+        if result is not None:
+            return result[0], result[1], True
+        
+        summary = summarize_documents(documents)
+        label = generate_label(documents)
+        self.results.put(key, (summary, label))
+        return summary, label, False
+    
+    def stats(self):
+        return {"results": self.results.stats()}
@@ -1,84 +1,215 @@
 from flask import Flask, request, jsonify
-import logging
+import base64
+import hashlib
 import json
+import logging
 import os
-from datetime import datetime
 import uuid
 
+from common.audit import AuditWriter
+from common.metrics import CallbackMetric, instrument_flask
+from common.serving import GRACEFUL_TIMEOUT, on_refork, prefork_master, refork_on_change, request_refork
+from common.wire import request_payload, respond
+from corpus import LiveCorpus
+from search_index import SEARCH_MODES
+from sharding import ShardedCorpus
+
 app = Flask(__name__)
 
 # Setup logging
-os.makedirs('/app/logs', exist_ok=True)
 logging.basicConfig(level=logging.INFO)
 
-# Load document database
-with open('/app/documents.json', 'r') as f:
-    DOCUMENTS = json.load(f)
+# Audit records are written in batches by a background thread
+AUDIT = AuditWriter.from_env('retriever-agent')
+
+# Document database
+DOCUMENTS_PATH = os.getenv('DOCUMENTS_PATH', '/app/documents.json')
+
+# Default ranking mode: 'bm25' or 'keyword' (original title-weighted scoring)
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'bm25')
+
+# Documents per /retrieve response unless the request sets top_k, the largest top_k
+# accepted, and how deep into a ranking cursors may page
+DEFAULT_TOP_K = 3
+MAX_TOP_K = int(os.getenv('MAX_TOP_K', '100'))
+MAX_RESULT_WINDOW = int(os.getenv('MAX_RESULT_WINDOW', '1000'))
+
+# Optional file the compact document store is written to and memory-mapped from
+DOCUMENT_STORE_PATH = os.getenv('DOCUMENT_STORE_PATH')
+
+# Rewrite the store without replaced and deleted documents once they make up
+# this fraction of its text
+DOCUMENT_STORE_COMPACT_RATIO = float(os.getenv('DOCUMENT_STORE_COMPACT_RATIO', '0.5'))
+
+# Watch DOCUMENTS_PATH and apply changes without a restart
+HOT_RELOAD = os.getenv('HOT_RELOAD', 'false').lower() == 'true'
+HOT_RELOAD_INTERVAL = float(os.getenv('HOT_RELOAD_INTERVAL', '2'))
+
+# Ranking modes of /retrieve/batch: one sparse matrix product ('tfidf', the
+# default) or a per-query search in any single-query mode
+BATCH_MODES = ('tfidf',) + SEARCH_MODES
+
+# Number of shard processes; above 1 the corpus is split across workers
+SHARDS = int(os.getenv('SHARDS', '1'))
+
+# Under the pre-fork server (common/gunicorn_conf.py) the master owns the
+# corpus: it reloads the file and re-forks the workers, which share the new
+# snapshot copy-on-write. Per-worker changes would diverge and be lost on
+# recycling, so the document mutation endpoints are disabled.
+PREFORK = prefork_master() is not None
+
+# Versioned corpus holding the inverted index and the sparse TF-IDF matrix
+if SHARDS > 1:
+    # Replaced workers may use the old shard pool until they have drained
+    CORPUS = ShardedCorpus(DOCUMENTS_PATH, SHARDS, store_path=DOCUMENT_STORE_PATH,
+                           retire_grace=max(ShardedCorpus.RETIRE_GRACE, GRACEFUL_TIMEOUT if PREFORK else 0))
+else:
+    CORPUS = LiveCorpus.from_file(DOCUMENTS_PATH, store_path=DOCUMENT_STORE_PATH,
+                                  compact_ratio=DOCUMENT_STORE_COMPACT_RATIO)
+    if PREFORK:
+        CORPUS.disable_mutation("Document mutation is not supported under the pre-fork server; "
+                                "edit DOCUMENTS_PATH and reload")
+
+# Corpus versions start again at 1 in a new process; the pair
+# (corpus_id, corpus_version) identifies the corpus being searched
+CORPUS_ID = uuid.uuid4().hex
+
+def reload_corpus():
+    """Refork hook: re-read DOCUMENTS_PATH in the master"""
+    version, changed = CORPUS.reload()
+    logging.info("Reloaded %s: %d document(s) changed, corpus version %d", DOCUMENTS_PATH, changed, version)
+
+if PREFORK:
+    on_refork(reload_corpus)
+if HOT_RELOAD:
+    CORPUS.watch(HOT_RELOAD_INTERVAL, reload=refork_on_change if PREFORK else None)
+
+# Request latency and in-flight metrics, served on /metrics
+instrument_flask(app)
+CallbackMetric('retriever_corpus_version', "Version of the corpus snapshot being searched", (),
+               lambda: {(): CORPUS.version}, kind='gauge')
+if SHARDS == 1:
+    def store_bytes():
+        stats = CORPUS.store_stats()
+        return {('live',): stats['live_bytes'], ('dead',): stats['dead_bytes']}
+    CallbackMetric('retriever_document_store_bytes', "Document store text bytes, live or dead (replaced or deleted)",
+                   ('state',), store_bytes, kind='gauge')
+    CallbackMetric('retriever_document_store_compactions_total', "Document store compactions", (),
+                   lambda: {(): CORPUS.compactions})
 
 def log_audit(trace_id, request_id, endpoint, status, details):
-    """Log request to audit.jsonl"""
-    log_entry = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "service": "retriever-agent",
-        "trace_id": trace_id,
-        "request_id": request_id,
-        "endpoint": endpoint,
-        "status": status,
-        "details": details
-    }
-    
-    with open('/app/logs/audit.jsonl', 'a') as f:
-        f.write(json.dumps(log_entry) + '\n')
+    """Queue a record for audit.jsonl"""
+    AUDIT.log(trace_id, request_id, endpoint, status, details)
 
-def search_documents(query, top_k=3):
-    """Simple keyword-based search"""
-    results = []
-    query_lower = query.lower()
-    
-    for doc in DOCUMENTS:
-        # Calculate simple relevance score based on keyword matches
-        score = 0
-        for word in query_lower.split():
-            if word in doc['content'].lower():
-                score += 1
-            if word in doc['title'].lower():
-                score += 2
-        
-        if score > 0:
-            results.append({
-                "id": doc['id'],
-                "title": doc['title'],
-                "content": doc['content'],
-                "category": doc['category'],
-                "score": score
-            })
-    
-    # Sort by score and return top_k
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return results[:top_k]
+def search_documents(query, top_k=3, mode=None, snapshot=None, offset=0, refs=False):
+    """Rank documents against the inverted index; refs returns document references"""
+    snapshot = snapshot or CORPUS.snapshot
+    return snapshot.search(query, top_k=top_k, mode=mode or SEARCH_MODE, offset=offset, refs=refs)
+
+def valid_top_k(top_k):
+    return isinstance(top_k, int) and not isinstance(top_k, bool) and 1 <= top_k <= MAX_TOP_K
+
+def query_error(query):
+    """Why query cannot be searched, or None if it can"""
+    if query is None or query == '':
+        return "Query is required"
+    if not isinstance(query, str):
+        return "Query must be a string"
+    return None
+
+def cursor_digest(query, mode):
+    return hashlib.sha256(f"{mode}\0{query}".encode('utf-8')).hexdigest()[:16]
+
+def encode_cursor(query, mode, offset, version):
+    """Opaque cursor for the page of query's ranking that starts at offset"""
+    position = json.dumps({"q": cursor_digest(query, mode), "o": offset, "v": version}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """The {q, o, v} position of a cursor; ValueError if it is malformed"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    offset = position.get('o') if isinstance(position, dict) else None
+    if not isinstance(offset, int) or not 0 <= offset < MAX_RESULT_WINDOW:
+        raise ValueError("Invalid cursor")
+    return position
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "service": "retriever-agent"}), 200
+    return jsonify({
+        "status": "healthy",
+        "service": "retriever-agent",
+        "corpus_id": CORPUS_ID,
+        "corpus_version": CORPUS.version
+    }), 200
 
 @app.route('/retrieve', methods=['POST'])
 def retrieve():
-    """Retrieve top 3 matching documents"""
-    data = request.get_json()
+    """Retrieve the top_k (default 3) matching documents, a page at a time"""
+    data = request_payload()
     
     trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
     request_id = data.get('request_id', 'unknown')
     query = data.get('query', '')
+    mode = data.get('mode', SEARCH_MODE)
+    refs = data.get('refs', False)
+    top_k = data.get('top_k', DEFAULT_TOP_K)
+    cursor = data.get('cursor')
+    
+    error = query_error(query)
+    if error:
+        log_audit(trace_id, request_id, '/retrieve', 'error', {"error": error})
+        return respond({"error": error}, 400)
+    
+    if mode not in SEARCH_MODES:
+        log_audit(trace_id, request_id, '/retrieve', 'error', {"error": f"Unknown search mode: {mode}"})
+        return respond({"error": f"Unknown search mode: {mode}"}, 400)
+    
+    if not valid_top_k(top_k):
+        error = f"top_k must be an integer from 1 to {MAX_TOP_K}"
+        log_audit(trace_id, request_id, '/retrieve', 'error', {"error": error})
+        return respond({"error": error}, 400)
+    
+    if not isinstance(refs, bool):
+        log_audit(trace_id, request_id, '/retrieve', 'error', {"error": "refs must be true or false"})
+        return respond({"error": "refs must be true or false"}, 400)
     
-    if not query:
-        log_audit(trace_id, request_id, '/retrieve', 'error', {"error": "Query is required"})
-        return jsonify({"error": "Query is required"}), 400
+    # Search documents against one consistent corpus snapshot
+    snapshot = CORPUS.snapshot
+    offset = 0
+    if cursor is not None:
+        try:
+            position = decode_cursor(cursor)
+        except ValueError as e:
+            log_audit(trace_id, request_id, '/retrieve', 'error', {"error": str(e)})
+            return respond({"error": str(e)}, 400)
+        if position.get('q') != cursor_digest(query, mode):
+            log_audit(trace_id, request_id, '/retrieve', 'error', {"error": "Cursor does not match this query"})
+            return respond({"error": "Cursor does not match this query"}, 400)
+        if position.get('v') != snapshot.version:
+            # Rankings of another corpus version would skip or repeat documents
+            error = "Corpus changed since the cursor was issued; start again without a cursor"
+            log_audit(trace_id, request_id, '/retrieve', 'error', {"error": error})
+            return respond({"error": error, "corpus_version": snapshot.version}, 409)
+        offset = position['o']
     
-    # Search documents
-    documents = search_documents(query, top_k=3)
+    # One extra hit tells whether there is a next page; with refs the hits are
+    # references (ids and summary fields instead of full content)
+    limit = min(top_k, MAX_RESULT_WINDOW - offset)
+    documents = search_documents(query, top_k=limit + 1, mode=mode, snapshot=snapshot, offset=offset, refs=refs)
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        if offset + limit < MAX_RESULT_WINDOW:
+            next_cursor = encode_cursor(query, mode, offset + limit, snapshot.version)
     
     log_audit(trace_id, request_id, '/retrieve', 'success', {
         "query": query,
+        "mode": mode,
+        "top_k": top_k,
+        "offset": offset,
         "documents_found": len(documents)
     })
     
@@ -87,11 +218,185 @@ def retrieve():
         "trace_id": trace_id,
         "query": query,
         "documents": documents,
-        "count": len(documents)
+        "count": len(documents),
+        "next_cursor": next_cursor,
+        "corpus_version": snapshot.version
     }
     
-    return jsonify(response), 200
+    return respond(response)
+
+@app.route('/retrieve/batch', methods=['POST'])
+def retrieve_batch():
+    """Retrieve the top_k (default 3) matching documents for many queries at once"""
+    data = request_payload()
+    
+    trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
+    items = data.get('queries') if isinstance(data, dict) else None
+    
+    if not isinstance(items, list):
+        log_audit(trace_id, 'batch', '/retrieve/batch', 'error', {"error": "queries must be a list"})
+        return respond({"error": "queries must be a list"}, 400)
+    
+    mode = data.get('mode', 'tfidf')
+    refs = data.get('refs', False)
+    top_k = data.get('top_k', DEFAULT_TOP_K)
+    if mode not in BATCH_MODES:
+        log_audit(trace_id, 'batch', '/retrieve/batch', 'error', {"error": f"Unknown search mode: {mode}"})
+        return respond({"error": f"Unknown search mode: {mode}"}, 400)
+    if not valid_top_k(top_k):
+        error = f"top_k must be an integer from 1 to {MAX_TOP_K}"
+        log_audit(trace_id, 'batch', '/retrieve/batch', 'error', {"error": error})
+        return respond({"error": error}, 400)
+    if not isinstance(refs, bool):
+        log_audit(trace_id, 'batch', '/retrieve/batch', 'error', {"error": "refs must be true or false"})
+        return respond({"error": "refs must be true or false"}, 400)
+    
+    snapshot = CORPUS.snapshot
+    valid = [item for item in items if isinstance(item, dict) and query_error(item.get('query')) is None]
+    if mode == 'tfidf':
+        # Score every non-empty query with a single sparse matrix product
+        rankings = snapshot.search_batch([item['query'] for item in valid], top_k=top_k, refs=refs)
+    else:
+        rankings = [search_documents(item['query'], top_k=top_k, mode=mode, snapshot=snapshot, refs=refs)
+                    for item in valid]
+    documents_by_item = {id(item): documents for item, documents in zip(valid, rankings)}
+    
+    results = []
+    for item in items:
+        request_id = item.get('request_id', 'unknown') if isinstance(item, dict) else 'unknown'
+        if id(item) not in documents_by_item:
+            error = query_error(item.get('query')) if isinstance(item, dict) else "Query is required"
+            log_audit(trace_id, request_id, '/retrieve/batch', 'error', {"error": error})
+            results.append({"request_id": request_id, "error": error})
+            continue
+        
+        documents = documents_by_item[id(item)]
+        log_audit(trace_id, request_id, '/retrieve/batch', 'success', {
+            "query": item['query'],
+            "mode": mode,
+            "documents_found": len(documents)
+        })
+        results.append({
+            "request_id": request_id,
+            "query": item['query'],
+            "documents": documents,
+            "count": len(documents)
+        })
+    
+    response = {
+        "trace_id": trace_id,
+        "results": results,
+        "count": len(results),
+        "corpus_version": snapshot.version
+    }
+    
+    return respond(response)
+
+@app.route('/documents', methods=['POST'])
+def add_document():
+    """Add a document to the live corpus"""
+    data = request_payload()
+    
+    trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
+    request_id = data.get('request_id', 'unknown') if isinstance(data, dict) else 'unknown'
+    
+    try:
+        version = CORPUS.add(data)
+    except NotImplementedError as e:
+        log_audit(trace_id, request_id, '/documents', 'error', {"error": str(e)})
+        return respond({"error": str(e)}, 501)
+    except ValueError as e:
+        log_audit(trace_id, request_id, '/documents', 'error', {"error": str(e)})
+        return respond({"error": str(e)}, 400)
+    except KeyError:
+        log_audit(trace_id, request_id, '/documents', 'error', {"error": "Document already exists"})
+        return respond({"error": f"Document already exists: {data['id']}"}, 409)
+    
+    log_audit(trace_id, request_id, '/documents', 'success', {
+        "action": "add",
+        "document_id": data['id'],
+        "corpus_version": version
+    })
+    
+    return respond({"id": data['id'], "corpus_version": version}, 201)
+
+@app.route('/documents/<doc_id>', methods=['PUT'])
+def update_document(doc_id):
+    """Replace a document in the live corpus"""
+    data = request_payload()
+    
+    trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
+    request_id = data.get('request_id', 'unknown') if isinstance(data, dict) else 'unknown'
+    
+    try:
+        version = CORPUS.update({**(data if isinstance(data, dict) else {}), "id": doc_id})
+    except NotImplementedError as e:
+        log_audit(trace_id, request_id, f'/documents/{doc_id}', 'error', {"error": str(e)})
+        return respond({"error": str(e)}, 501)
+    except ValueError as e:
+        log_audit(trace_id, request_id, f'/documents/{doc_id}', 'error', {"error": str(e)})
+        return respond({"error": str(e)}, 400)
+    except KeyError:
+        log_audit(trace_id, request_id, f'/documents/{doc_id}', 'error', {"error": "Document not found"})
+        return respond({"error": f"Document not found: {doc_id}"}, 404)
+    
+    log_audit(trace_id, request_id, f'/documents/{doc_id}', 'success', {
+        "action": "update",
+        "document_id": doc_id,
+        "corpus_version": version
+    })
+    
+    return respond({"id": doc_id, "corpus_version": version}, 200)
+
+@app.route('/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    """Remove a document from the live corpus"""
+    trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
+    request_id = request.args.get('request_id', 'unknown')
+    
+    try:
+        version = CORPUS.delete(doc_id)
+    except NotImplementedError as e:
+        log_audit(trace_id, request_id, f'/documents/{doc_id}', 'error', {"error": str(e)})
+        return respond({"error": str(e)}, 501)
+    except KeyError:
+        log_audit(trace_id, request_id, f'/documents/{doc_id}', 'error', {"error": "Document not found"})
+        return respond({"error": f"Document not found: {doc_id}"}, 404)
+    
+    log_audit(trace_id, request_id, f'/documents/{doc_id}', 'success', {
+        "action": "delete",
+        "document_id": doc_id,
+        "corpus_version": version
+    })
+    
+    return respond({"id": doc_id, "corpus_version": version}, 200)
+
+@app.route('/documents/reload', methods=['POST'])
+def reload_documents():
+    """Re-read DOCUMENTS_PATH and apply the documents that changed"""
+    trace_id = request.headers.get('X-Trace-ID', str(uuid.uuid4()))
+    
+    if PREFORK:
+        # The master reloads and gracefully replaces every worker, this one included
+        request_refork()
+        log_audit(trace_id, 'unknown', '/documents/reload', 'accepted', {
+            "corpus_version": CORPUS.version
+        })
+        return respond({"status": "reloading", "corpus_version": CORPUS.version}, 202)
+    
+    try:
+        version, changed = CORPUS.reload()
+    except (OSError, ValueError) as e:
+        log_audit(trace_id, 'unknown', '/documents/reload', 'error', {"error": str(e)})
+        return respond({"error": f"Reload failed: {str(e)}"}, 500)
+    
+    log_audit(trace_id, 'unknown', '/documents/reload', 'success', {
+        "documents_changed": changed,
+        "corpus_version": version
+    })
+    
+    return respond({"corpus_version": version, "documents_changed": changed}, 200)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002, debug=False)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5002')), debug=False)
 
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from document_store import DocumentStore
+from search_index import InvertedIndex
+from tfidf import TfidfMatrix
+
+DOCUMENT_FIELDS = ('id', 'title', 'content', 'category')
+
+logger = logging.getLogger(__name__)
+
+
+def validate_document(doc):
+    """Raise ValueError unless doc has every field as a string"""
+    if not isinstance(doc, dict):
+        raise ValueError("Document must be an object")
+    for field in DOCUMENT_FIELDS:
+        if not isinstance(doc.get(field), str) or not doc[field]:
+            raise ValueError(f"Document field '{field}' is required")
+    return {field: doc[field] for field in DOCUMENT_FIELDS}
+
+
+def load_documents(path):
+    """Read and validate a corpus file"""
+    with open(path, 'r') as f:
+        documents = [validate_document(doc) for doc in json.load(f)]
+    _unique_ids(documents)
+    return documents
+
+
+def _unique_ids(documents):
+    """Return the set of document ids, rejecting duplicates"""
+    ids = set()
+    for doc in documents:
+        if doc['id'] in ids:
+            raise ValueError(f"Duplicate document id: {doc['id']}")
+        ids.add(doc['id'])
+    return ids
+
+
+def file_stamp(path):
+    """(mtime, size) of path, or None if it cannot be read"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class FileWatcher:
+    """Background thread calling reload() whenever a file changes
+
+    reload() returns (version, documents changed), or None when it only
+    hands the change off (e.g. to a pre-fork master).
+    """
+
+    def __init__(self, path, reload, interval=2.0):
+        self.path = path
+        self.reload = reload
+        self.interval = interval
+        self.stamp = file_stamp(path)
+        self._thread = threading.Thread(target=self._run, name='corpus-watcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            stamp = file_stamp(self.path)
+            if stamp is None or stamp == self.stamp:
+                continue
+            # Record the stamp first so a broken file is only reported once
+            self.stamp = stamp
+            try:
+                result = self.reload()
+                if result is None:
+                    continue
+                version, changed = result
+                logger.info("Reloaded %s: %d document(s) changed, corpus version %d",
+                            self.path, changed, version)
+            except (OSError, ValueError) as e:
+                # Keep serving the last good snapshot until the file is fixed
+                logger.error("Hot reload of %s failed: %s", self.path, e)
+
+
+class CorpusSnapshot:
+    """Immutable view of the corpus and its search structures"""
+
+    def __init__(self, version, index, tfidf):
+        self.version = version
+        self.index = index
+        self.tfidf = tfidf
+
+    def search(self, query, top_k=3, mode='bm25', offset=0, refs=False):
+        return self.index.search(query, top_k=top_k, mode=mode, offset=offset, refs=refs)
+
+    def search_batch(self, queries, top_k=3, refs=False):
+        return self.tfidf.search_batch(queries, top_k=top_k, refs=refs)
+
+
+class LiveCorpus:
+    """Versioned corpus that can be mutated while it is being searched
+
+    Writers are serialised and build a new snapshot that shares every
+    unaffected postings list and matrix row with the previous one; the
+    snapshot reference is then swapped in a single assignment. Readers grab
+    `corpus.snapshot` once per request and never see a half-built state.
+
+    New text is appended to the document store, so once replaced and deleted
+    documents make up more than `compact_ratio` of its bytes the live ones
+    are copied to a new store (rewriting store_path) and the old one is
+    released with the last snapshot that uses it.
+    """
+
+    # Dead fraction of the store's text that triggers a compaction
+    COMPACT_RATIO = 0.5
+
+    def __init__(self, documents, path=None, store_path=None, compact_ratio=COMPACT_RATIO):
+        self.path = path
+        self.store_path = store_path
+        self.compact_ratio = compact_ratio
+        self.compactions = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._mutation_error = None
+        documents = [validate_document(doc) for doc in documents]
+        _unique_ids(documents)
+        store = DocumentStore(documents)
+        if store_path:
+            # Serve document text from a memory-mapped file instead of the heap
+            store.save(store_path)
+            store = DocumentStore.open(store_path)
+        index = InvertedIndex(store)
+        self.snapshot = CorpusSnapshot(1, index, TfidfMatrix(index))
+
+    @classmethod
+    def from_file(cls, path, store_path=None, compact_ratio=COMPACT_RATIO):
+        return cls(load_documents(path), path=path, store_path=store_path, compact_ratio=compact_ratio)
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def store_stats(self):
+        """Live and dead text bytes of the current snapshot's document store"""
+        index = self.snapshot.index
+        return {"live_bytes": index.live_bytes, "dead_bytes": index.dead_bytes(), "compactions": self.compactions}
+
+    def get(self, doc_id):
+        snapshot = self.snapshot
+        docno = snapshot.index.docnos.get(doc_id)
+        return None if docno is None else snapshot.index.document(docno)
+
+    def disable_mutation(self, reason):
+        """Make add/update/delete raise NotImplementedError(reason); reload still works"""
+        self._mutation_error = reason
+
+    def _check_mutable(self):
+        if self._mutation_error:
+            raise NotImplementedError(self._mutation_error)
+
+    def add(self, doc):
+        """Add a new document; raises KeyError if the id already exists"""
+        self._check_mutable()
+        doc = validate_document(doc)
+        with self._lock:
+            if doc['id'] in self.snapshot.index.docnos:
+                raise KeyError(doc['id'])
+            return self._apply(upserts=[doc])
+
+    def update(self, doc):
+        """Replace an existing document; raises KeyError if it is missing"""
+        self._check_mutable()
+        doc = validate_document(doc)
+        with self._lock:
+            if doc['id'] not in self.snapshot.index.docnos:
+                raise KeyError(doc['id'])
+            return self._apply(upserts=[doc])
+
+    def delete(self, doc_id):
+        """Remove a document; raises KeyError if it is missing"""
+        self._check_mutable()
+        with self._lock:
+            if doc_id not in self.snapshot.index.docnos:
+                raise KeyError(doc_id)
+            return self._apply(deletes=[doc_id])
+
+    def reload(self):
+        """Re-read the corpus file and apply only the documents that changed"""
+        with self._lock:
+            documents = load_documents(self.path)
+            current = self.snapshot.index
+            new_ids = {doc['id'] for doc in documents}
+            upserts = [doc for doc in documents if self._changed(current, doc)]
+            deletes = [doc_id for doc_id in current.docnos if doc_id not in new_ids]
+            if not upserts and not deletes:
+                return self.snapshot.version, 0
+            self._apply(upserts=upserts, deletes=deletes)
+            return self.snapshot.version, len(upserts) + len(deletes)
+
+    def _changed(self, index, doc):
+        docno = index.docnos.get(doc['id'])
+        return docno is None or index.document(docno).as_dict() != doc
+
+    def _apply(self, upserts=(), deletes=()):
+        """Build and publish the next snapshot; caller holds the lock"""
+        snapshot = self.snapshot
+        index = snapshot.index
+        next_docno = len(index.slots)
+
+        changes = {}
+        for doc in upserts:
+            docno = index.docnos.get(doc['id'])
+            if docno is None:
+                docno = next_docno
+                next_docno += 1
+            changes[docno] = doc
+        removed = [index.docnos[doc_id] for doc_id in deletes]
+
+        new_index = index.with_changes(upserts=changes, deletes=removed)
+        if new_index.dead_bytes() > self.compact_ratio * new_index.store.text_bytes():
+            new_index = new_index.compacted(self.store_path)
+            self.compactions += 1
+        new_tfidf = snapshot.tfidf.with_changes(new_index, set(changes) | set(removed))
+        self.snapshot = CorpusSnapshot(snapshot.version + 1, new_index, new_tfidf)
+        return self.snapshot.version
+
+    def watch(self, interval=2.0, reload=None):
+        """Poll the corpus file and call reload (default: self.reload) whenever it changes"""
+        if self._watcher is None and self.path:
+            self._watcher = FileWatcher(self.path, reload or self.reload, interval).start()
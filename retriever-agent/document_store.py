@@ -0,0 +1,204 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+
+# Fields stored as UTF-8 runs in the content buffer, in order, per slot
+TEXT_FIELDS = ('id', 'title', 'content')
+
+FILE_MAGIC = b'DOCSTORE1'
+FOOTER_SIZE = struct.Struct('<Q')
+
+
+class DocumentRecord:
+    """A single materialised document"""
+
+    __slots__ = ('id', 'title', 'content', 'category')
+
+    def __init__(self, id, title, content, category):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.category = category
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "content": self.content,
+            "category": self.category
+        }
+
+
+class DocumentStore:
+    """Append-only, array-backed document storage
+
+    Every document occupies a slot. Its id, title and content are UTF-8 runs
+    in one shared byte buffer delimited by an offsets array, and its category
+    is an interned code, so the store holds a handful of large objects
+    instead of a dict and four strings per document. Records are only
+    decoded when a slot is read.
+
+    A store saved with `save` can be reopened with `open`, which memory-maps
+    the file: the offsets, codes and buffer are then read straight from the
+    page cache and documents added later go to in-memory extension arrays.
+
+    Replaced and deleted documents keep their slots; an index that no longer
+    references them reclaims the space by copying its live documents to a
+    new store (InvertedIndex.compacted).
+    """
+
+    def __init__(self, documents=()):
+        self.categories = []
+        self._category_codes = {}
+        # Memory-mapped base segment (empty for in-memory stores)
+        self._mmap = None
+        self._base_offsets = memoryview(array('Q', [0]))
+        self._base_codes = memoryview(array('H'))
+        self._base_buffer = memoryview(b'')
+        # Writable extension segment
+        self._offsets = array('Q', [0])
+        self._codes = array('H')
+        self._buffer = bytearray()
+        for doc in documents:
+            self.append(doc)
+
+    def __len__(self):
+        return len(self._base_codes) + len(self._codes)
+
+    def _intern(self, category):
+        code = self._category_codes.get(category)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(category)
+            self._category_codes[category] = code
+        return code
+
+    def append(self, doc):
+        """Store doc (a mapping with id/title/content/category) and return its slot"""
+        for field in TEXT_FIELDS:
+            self._buffer += doc[field].encode('utf-8')
+            self._offsets.append(len(self._buffer))
+        # Code last: a slot is only visible to len() once fully written
+        self._codes.append(self._intern(doc['category']))
+        return len(self) - 1
+
+    def _segment(self, slot):
+        """(offsets, buffer, codes, index) of the segment holding slot"""
+        base_count = len(self._base_codes)
+        if slot < base_count:
+            return self._base_offsets, self._base_buffer, self._base_codes, slot
+        return self._offsets, self._buffer, self._codes, slot - base_count
+
+    def _fields(self, slot):
+        offsets, buffer, codes, index = self._segment(slot)
+        start = index * len(TEXT_FIELDS)
+        values = [
+            str(buffer[offsets[start + i]:offsets[start + i + 1]], 'utf-8')
+            for i in range(len(TEXT_FIELDS))
+        ]
+        return values, self.categories[codes[index]]
+
+    def get(self, slot):
+        """Materialise the record stored in slot"""
+        (doc_id, title, content), category = self._fields(slot)
+        return DocumentRecord(doc_id, title, content, category)
+
+    def field(self, slot, name, limit=None):
+        """Decode a single field of slot (at most its first `limit` bytes) without building a record"""
+        offsets, buffer, codes, index = self._segment(slot)
+        if name == 'category':
+            return self.categories[codes[index]]
+        start = index * len(TEXT_FIELDS) + TEXT_FIELDS.index(name)
+        end = offsets[start + 1] if limit is None else min(offsets[start] + limit, offsets[start + 1])
+        return str(buffer[offsets[start]:end], 'utf-8')
+
+    def text_bytes(self):
+        """Bytes of UTF-8 text held in every slot, live or not"""
+        return len(self._base_buffer) + len(self._buffer)
+
+    def slot_bytes(self, slot):
+        """Bytes of UTF-8 text held in slot"""
+        offsets, _, _, index = self._segment(slot)
+        start = index * len(TEXT_FIELDS)
+        return offsets[start + len(TEXT_FIELDS)] - offsets[start]
+
+    def nbytes(self):
+        """Bytes held by the store's arrays and buffers (excluding mapped pages)"""
+        return (
+            self._offsets.itemsize * len(self._offsets)
+            + self._codes.itemsize * len(self._codes)
+            + len(self._buffer)
+        )
+
+    def save(self, path):
+        """Write every slot to path in the memory-mappable file format
+
+        Layout: magic, UTF-8 buffer, offsets (u64), category codes (u16),
+        JSON footer, footer length (u64). The file is written next to path
+        and renamed into place so readers never map a partial file.
+        """
+        offsets = array('Q', [0])
+        codes = array('H')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(FILE_MAGIC)
+            size = 0
+            for slot in range(len(self)):
+                (doc_id, title, content), category = self._fields(slot)
+                for value in (doc_id, title, content):
+                    data = value.encode('utf-8')
+                    f.write(data)
+                    size += len(data)
+                    offsets.append(size)
+                codes.append(self._category_codes[category])
+
+            # Keep the offsets array 8-byte aligned inside the mapping
+            padding = -(len(FILE_MAGIC) + size) % offsets.itemsize
+            f.write(b'\0' * padding)
+            offsets_start = len(FILE_MAGIC) + size + padding
+            f.write(offsets.tobytes())
+            f.write(codes.tobytes())
+
+            footer = json.dumps({
+                "count": len(codes),
+                "categories": self.categories,
+                "buffer_start": len(FILE_MAGIC),
+                "buffer_size": size,
+                "offsets_start": offsets_start,
+                "codes_start": offsets_start + len(offsets) * offsets.itemsize
+            }).encode('utf-8')
+            f.write(footer)
+            f.write(FOOTER_SIZE.pack(len(footer)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a store written by save"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        if bytes(view[:len(FILE_MAGIC)]) != FILE_MAGIC:
+            raise ValueError(f"Not a document store file: {path}")
+
+        (footer_size,) = FOOTER_SIZE.unpack_from(view, len(view) - FOOTER_SIZE.size)
+        footer_start = len(view) - FOOTER_SIZE.size - footer_size
+        footer = json.loads(bytes(view[footer_start:footer_start + footer_size]))
+
+        count = footer['count']
+        offsets_end = footer['offsets_start'] + (count * len(TEXT_FIELDS) + 1) * 8
+        codes_end = footer['codes_start'] + count * 2
+        buffer_end = footer['buffer_start'] + footer['buffer_size']
+
+        store = cls()
+        store._mmap = mapped
+        store._base_offsets = view[footer['offsets_start']:offsets_end].cast('Q')
+        store._base_codes = view[footer['codes_start']:codes_end].cast('H')
+        store._base_buffer = view[footer['buffer_start']:buffer_end]
+        for category in footer['categories']:
+            store._intern(category)
+        return store
@@ -0,0 +1,575 @@
+import copy
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from document_store import DocumentStore
+
+# Tokens are maximal runs of lowercase ASCII letters and digits
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Double-quoted parts of a query must occur as consecutive tokens
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+# BM25F parameters (title matches are weighted like the keyword scorer)
+BM25_K1 = 1.2
+FIELD_WEIGHTS = {"title": 2.0, "content": 1.0}
+FIELD_B = {"title": 0.5, "content": 0.75}
+
+# Points awarded per query word by the keyword and substring scorers
+KEYWORD_WEIGHTS = {"title": 2, "content": 1}
+
+# BM25 bonus for query terms that are adjacent in the query and occur within
+# PROXIMITY_WINDOW tokens of each other in a field (1/distance² per occurrence)
+PROXIMITY_WEIGHT = 1.0
+PROXIMITY_WINDOW = 5
+
+SEARCH_MODES = ('bm25', 'keyword', 'substring')
+
+# Relative slack on MaxScore's pruning comparisons, covering float rounding in partial sums
+PRUNING_SLACK = 1e-9
+
+# Most terms occur once in a field; those postings share these position tuples
+SINGLE_POSITIONS = tuple((position,) for position in range(4096))
+
+# Slot value marking a deleted docno
+DELETED = 0xFFFFFFFF
+FIELDS = ('title', 'content')
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def parse_phrases(query):
+    """Token lists of the quoted phrases in query"""
+    return [tokens for tokens in map(tokenize, PHRASE_PATTERN.findall(query)) if tokens]
+
+
+def proximity(positions, other_positions, window=PROXIMITY_WINDOW):
+    """Sum of 1/distance² over occurrences of two terms at most window tokens apart
+
+    The distance is counted from the first term to the second; the second
+    term occurring before the first counts one token further away.
+    """
+    total = 0.0
+    for position in positions:
+        start = bisect_left(other_positions, max(0, position - window + 1))
+        for other in other_positions[start:]:
+            if other > position + window:
+                break
+            distance = other - position if other > position else position - other + 1
+            if distance <= window:
+                total += 1.0 / (distance * distance)
+    return total
+
+
+def _restrict(postings, docnos):
+    """(docno, value) items of postings, limited to docnos unless that is None"""
+    if docnos is None:
+        return postings.items()
+    if len(docnos) < len(postings):
+        return [(docno, postings[docno]) for docno in docnos if docno in postings]
+    return [(docno, value) for docno, value in postings.items() if docno in docnos]
+
+
+def hit_score(score):
+    return round(score, 4) if isinstance(score, float) else score
+
+
+def make_hit(doc, score):
+    """Build the /retrieve representation of a scored document"""
+    return {
+        "id": doc['id'],
+        "title": doc['title'],
+        "content": doc['content'],
+        "category": doc['category'],
+        "score": hit_score(score)
+    }
+
+
+def excerpt_bytes(content):
+    """UTF-8 length of content's first sentence (common.document_refs.first_sentence)"""
+    return len(content.partition('.')[0].encode('utf-8'))
+
+
+def bm25_idf(num_docs, df):
+    """BM25 inverse document frequency (always non-negative)"""
+    return math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+
+class CollectionStats:
+    """Corpus-wide document count, field lengths and document frequencies"""
+
+    def __init__(self, num_docs, total_lengths, doc_freq):
+        self.num_docs = num_docs
+        self.total_lengths = dict(total_lengths)
+        self.doc_freq = doc_freq
+        self.avg_lengths = {
+            field: (total / num_docs if num_docs else 0.0)
+            for field, total in self.total_lengths.items()
+        }
+
+    @classmethod
+    def combine(cls, parts):
+        """Sum the statistics of disjoint partitions of a corpus"""
+        num_docs = 0
+        total_lengths = {field: 0 for field in FIELDS}
+        doc_freq = Counter()
+        for part in parts:
+            num_docs += part.num_docs
+            for field in FIELDS:
+                total_lengths[field] += part.total_lengths[field]
+            doc_freq.update(part.doc_freq)
+        return cls(num_docs, total_lengths, doc_freq)
+
+    def for_terms(self, terms):
+        """Copy restricted to the document frequencies of terms"""
+        return CollectionStats(
+            self.num_docs, self.total_lengths,
+            {term: self.doc_freq[term] for term in terms if term in self.doc_freq}
+        )
+
+    def idf(self, term):
+        return bm25_idf(self.num_docs, self.doc_freq.get(term, 0))
+
+
+class InvertedIndex:
+    """Per-field postings, document frequencies and lengths for a corpus
+
+    Documents are addressed by docno (their position in the corpus) and
+    their text lives in a shared, append-only DocumentStore; `slots` maps
+    each docno to its store slot. Deleted documents keep their docno with a
+    DELETED slot so the docnos of the others stay stable.
+    """
+
+    def __init__(self, documents):
+        self.store = documents if isinstance(documents, DocumentStore) else DocumentStore(documents)
+        self.slots = array('L')
+        # field -> term -> {docno: tuple of token positions}; the term frequency is its length
+        self.postings = {field: {} for field in FIELDS}
+        # field -> token count per docno
+        self.lengths = {field: array('L') for field in FIELDS}
+        # field -> term -> (highest tf, shortest field length) over its postings; removals
+        # leave them stale, which keeps them valid upper bounds for MaxScore pruning
+        self.term_bounds = {field: {} for field in FIELDS}
+        self.total_lengths = {field: 0 for field in FIELDS}
+        # term -> number of documents containing it in any field
+        self.doc_freq = Counter()
+        # document id -> docno
+        self.docnos = {}
+        # UTF-8 bytes of each docno's first sentence, so references never decode the content
+        self.excerpts = array('L')
+        self.num_docs = 0
+        # Store text bytes of the documents this index references
+        self.live_bytes = 0
+        self._substring_terms = {}
+
+        for slot in range(len(self.store)):
+            self._index(slot, slot, self.store.get(slot))
+        self._update_averages()
+
+    def __len__(self):
+        return self.num_docs
+
+    def document(self, docno):
+        """Materialise the record for docno, or None if it was deleted"""
+        slot = self.slots[docno]
+        return None if slot == DELETED else self.store.get(slot)
+
+    def hit(self, docno, score, refs=False):
+        """The /retrieve hit for docno, or with refs its document reference
+
+        A reference (the format of common.document_refs.to_reference) only
+        decodes the id, title and the first sentence of the content, whose
+        length was recorded when the document was indexed.
+        """
+        if not refs:
+            return make_hit(self.document(docno), score)
+        slot, store = self.slots[docno], self.store
+        return {
+            "id": store.field(slot, 'id'),
+            "title": store.field(slot, 'title'),
+            "category": store.field(slot, 'category'),
+            "first_sentence": store.field(slot, 'content', limit=self.excerpts[docno]),
+            "score": hit_score(score)
+        }
+
+    def with_changes(self, upserts=None, deletes=()):
+        """Return a new index with documents added, replaced or removed
+
+        upserts maps docno -> document (a docno past the end appends), deletes
+        is an iterable of docnos. New text is appended to the shared store and
+        only the postings of affected terms are copied; every other postings
+        list is shared with this index, which is left untouched so concurrent
+        readers keep a consistent view.
+        """
+        upserts = upserts or {}
+        index = InvertedIndex.__new__(InvertedIndex)
+        index.store = self.store
+        index.slots = array('L', self.slots)
+        index.postings = {field: dict(postings) for field, postings in self.postings.items()}
+        index.lengths = {field: array('L', lengths) for field, lengths in self.lengths.items()}
+        index.term_bounds = {field: dict(bounds) for field, bounds in self.term_bounds.items()}
+        index.total_lengths = dict(self.total_lengths)
+        index.doc_freq = Counter(self.doc_freq)
+        index.docnos = dict(self.docnos)
+        index.excerpts = array('L', self.excerpts)
+        index.num_docs = self.num_docs
+        index.live_bytes = self.live_bytes
+        index._substring_terms = {}
+
+        copied = {field: set() for field in FIELDS}
+        for docno in set(deletes) | set(upserts):
+            if docno < len(index.slots) and index.slots[docno] != DELETED:
+                index._remove(docno, copied)
+        for docno in sorted(upserts):
+            doc = upserts[docno]
+            index._index(docno, index.store.append(doc), doc, copied)
+        index._update_averages()
+        return index
+
+    def dead_bytes(self):
+        """Store text bytes of replaced or deleted documents (shared stores count every index's)"""
+        return self.store.text_bytes() - self.live_bytes
+
+    def compacted(self, store_path=None):
+        """Return a copy of this index whose store holds only its live documents
+
+        Docnos, postings and statistics are shared unchanged; only the store
+        and the docno -> slot map are new. With store_path the new store is
+        saved there (atomically replacing the file) and memory-mapped; readers
+        of the old store keep their mapping of the replaced file.
+        """
+        store = DocumentStore()
+        slots = array('L', [DELETED]) * len(self.slots)
+        for docno, slot in enumerate(self.slots):
+            if slot != DELETED:
+                slots[docno] = store.append(self.store.get(slot))
+        if store_path:
+            store.save(store_path)
+            store = DocumentStore.open(store_path)
+        index = copy.copy(self)
+        index.store = store
+        index.slots = slots
+        index._substring_terms = {}
+        return index
+
+    def _field_postings(self, field, term, copied):
+        """Postings dict for term that is safe to modify in this index"""
+        field_postings = self.postings[field]
+        if copied is not None and term not in copied[field]:
+            field_postings[term] = dict(field_postings.get(term, {}))
+            copied[field].add(term)
+        return field_postings.setdefault(term, {})
+
+    def _index(self, docno, slot, doc, copied=None):
+        while len(self.slots) <= docno:
+            self.slots.append(DELETED)
+            self.excerpts.append(0)
+            for field in FIELDS:
+                self.lengths[field].append(0)
+        self.slots[docno] = slot
+        self.docnos[doc['id']] = docno
+        self.excerpts[docno] = excerpt_bytes(doc['content'])
+        self.num_docs += 1
+        self.live_bytes += self.store.slot_bytes(slot)
+
+        terms = set()
+        for field in FIELDS:
+            tokens = tokenize(doc[field])
+            self.lengths[field][docno] = len(tokens)
+            self.total_lengths[field] += len(tokens)
+            positions = {}
+            for position, term in enumerate(tokens):
+                positions.setdefault(term, []).append(position)
+            bounds = self.term_bounds[field]
+            for term, term_positions in positions.items():
+                if len(term_positions) == 1 and term_positions[0] < len(SINGLE_POSITIONS):
+                    term_positions = SINGLE_POSITIONS[term_positions[0]]
+                self._field_postings(field, term, copied)[docno] = tuple(term_positions)
+                terms.add(term)
+                bound = bounds.get(term)
+                tf = len(term_positions)
+                bounds[term] = (tf, len(tokens)) if bound is None else (
+                    max(bound[0], tf), min(bound[1], len(tokens)))
+        self.doc_freq.update(terms)
+
+    def _remove(self, docno, copied=None):
+        doc = self.document(docno)
+        self.live_bytes -= self.store.slot_bytes(self.slots[docno])
+        self.slots[docno] = DELETED
+        del self.docnos[doc.id]
+        self.num_docs -= 1
+
+        terms = set()
+        for field in FIELDS:
+            self.total_lengths[field] -= self.lengths[field][docno]
+            self.lengths[field][docno] = 0
+            for term in set(tokenize(doc[field])):
+                field_postings = self._field_postings(field, term, copied)
+                del field_postings[docno]
+                if not field_postings:
+                    del self.postings[field][term]
+                    del self.term_bounds[field][term]
+                terms.add(term)
+        self.doc_freq.subtract(terms)
+        for term in terms:
+            if self.doc_freq[term] <= 0:
+                del self.doc_freq[term]
+
+    def _update_averages(self):
+        self.avg_lengths = {
+            field: (total / self.num_docs if self.num_docs else 0.0)
+            for field, total in self.total_lengths.items()
+        }
+
+    def idf(self, term):
+        return bm25_idf(self.num_docs, self.doc_freq.get(term, 0))
+
+    def stats(self):
+        """Collection statistics of this index"""
+        return CollectionStats(self.num_docs, self.total_lengths, self.doc_freq)
+
+    def score_bm25(self, query, stats=None):
+        """Return {docno: score} using BM25F over title and content
+
+        stats overrides the collection statistics (IDF and average field
+        lengths), which lets a shard score with corpus-wide values.
+        """
+        stats = stats or self
+        scores = {}
+        for component in self._bm25_components(query):
+            for docno, score in self._component_scores(component, stats).items():
+                scores[docno] = scores.get(docno, 0.0) + score
+        return scores
+
+    def top_bm25(self, query, top_k, stats=None, candidates=None):
+        """Return the top_k (docno, score) pairs by BM25F, best first, pruned with MaxScore
+
+        Score components (query terms, then proximity pairs) are evaluated in
+        descending order of their score upper bounds. Once the bounds of the
+        components left add up to less than the k-th best partial score, no
+        document not seen yet can reach the top_k: the rest is only looked up
+        for documents still in contention, and those that cannot catch up
+        are dropped. Final scores are summed in the same order as
+        score_bm25(), so the result is exactly that of exhaustive ranking.
+        candidates, if given, restricts the documents considered.
+        """
+        if top_k <= 0:
+            return []
+        stats = stats or self
+        components = self._bm25_components(query)
+        bounds = [self._component_bound(component, stats) for component in components]
+        remaining = sum(bounds)
+        partial = {}
+        scored = [{} for _ in components]
+        for i in sorted(range(len(components)), key=lambda i: -bounds[i]):
+            remaining -= bounds[i]
+            scored[i] = self._component_scores(components[i], stats, candidates)
+            for docno, score in scored[i].items():
+                partial[docno] = partial.get(docno, 0.0) + score
+            if len(partial) < top_k:
+                continue
+            threshold = heapq.nlargest(top_k, partial.values())[-1]
+            slack = PRUNING_SLACK * threshold
+            if remaining < threshold - slack:
+                partial = {docno: score for docno, score in partial.items()
+                           if score + remaining >= threshold - slack}
+                candidates = partial.keys()
+
+        totals = []
+        for docno in partial:
+            total = 0.0
+            for scores in scored:
+                score = scores.get(docno)
+                if score is not None:
+                    total += score
+            totals.append((-total, docno))
+        return [(docno, -total) for total, docno in heapq.nsmallest(top_k, totals)]
+
+    def _bm25_components(self, query):
+        """Query terms with their counts, then neighbouring term pairs, in summation order"""
+        terms = tokenize(query)
+        components = [('term', term, qtf) for term, qtf in Counter(terms).items() if term in self.doc_freq]
+        if PROXIMITY_WEIGHT:
+            pairs = dict.fromkeys((first, second) for first, second in zip(terms, terms[1:])
+                                  if first != second and first in self.doc_freq and second in self.doc_freq)
+            components += [('pair', first, second) for first, second in pairs]
+        return components
+
+    def _component_scores(self, component, stats, docnos=None):
+        """{docno: score} of one BM25 component, over docnos only unless that is None"""
+        kind, first, second = component
+        if kind == 'term':
+            return self._term_scores(first, second, stats, docnos)
+        return self._proximity_scores(first, second, stats, docnos)
+
+    def _component_bound(self, component, stats):
+        """Upper bound of a BM25 component's score in any document"""
+        kind, first, second = component
+        if kind == 'pair':
+            # The saturated proximity close / (k1 + close) stays below 1
+            return PROXIMITY_WEIGHT * min(stats.idf(first), stats.idf(second))
+        weighted_tf = 0.0
+        for field in FIELDS:
+            bound = self.term_bounds[field].get(first)
+            if bound:
+                max_tf, min_length = bound
+                b = FIELD_B[field]
+                norm = 1 - b + b * min_length / (stats.avg_lengths[field] or 1.0)
+                weighted_tf += FIELD_WEIGHTS[field] * max_tf / norm
+        return second * stats.idf(first) * weighted_tf / (BM25_K1 + weighted_tf)
+
+    def _term_scores(self, term, qtf, stats, docnos=None):
+        idf = stats.idf(term)
+        # Length-normalised, field-weighted term frequency per document
+        weighted_tf = {}
+        for field in FIELDS:
+            field_postings = self.postings[field].get(term)
+            if not field_postings:
+                continue
+            weight = FIELD_WEIGHTS[field]
+            b = FIELD_B[field]
+            avg_length = stats.avg_lengths[field] or 1.0
+            lengths = self.lengths[field]
+            for docno, positions in _restrict(field_postings, docnos):
+                norm = 1 - b + b * lengths[docno] / avg_length
+                weighted_tf[docno] = weighted_tf.get(docno, 0.0) + weight * len(positions) / norm
+        return {docno: qtf * idf * tf / (BM25_K1 + tf) for docno, tf in weighted_tf.items()}
+
+    def _proximity_scores(self, first, second, stats, docnos=None):
+        """Boost for documents where two terms that are neighbours in the query occur close together
+
+        The pair's field-weighted proximity is saturated like a BM25 term
+        frequency and weighted by the rarer term's IDF.
+        """
+        weighted = {}
+        for field in FIELDS:
+            first_postings = self.postings[field].get(first)
+            second_postings = self.postings[field].get(second)
+            if not first_postings or not second_postings:
+                continue
+            shorter, longer = sorted((first_postings, second_postings), key=len)
+            for docno, _ in _restrict(shorter, docnos):
+                if docno not in longer:
+                    continue
+                close = proximity(first_postings[docno], second_postings[docno])
+                if close:
+                    weighted[docno] = weighted.get(docno, 0.0) + FIELD_WEIGHTS[field] * close
+        idf = min(stats.idf(first), stats.idf(second))
+        return {docno: PROXIMITY_WEIGHT * idf * close / (BM25_K1 + close) for docno, close in weighted.items()}
+
+    def phrase_docnos(self, phrase):
+        """Docnos with the tokens of phrase at consecutive positions of a field
+
+        Candidates are the documents in every term's postings; each one's
+        position lists are then intersected, shifted by the term's offset.
+        """
+        matches = set()
+        for field in FIELDS:
+            field_postings = [self.postings[field].get(term) for term in phrase]
+            if not all(field_postings):
+                continue
+            candidates = min(field_postings, key=len).keys()
+            for docno in candidates:
+                if docno in matches or not all(docno in postings for postings in field_postings):
+                    continue
+                starts = set(field_postings[0][docno])
+                for offset, postings in enumerate(field_postings[1:], start=1):
+                    starts.intersection_update(position - offset for position in postings[docno])
+                    if not starts:
+                        break
+                if starts:
+                    matches.add(docno)
+        return matches
+
+    def score_keyword(self, query):
+        """Return {docno: score} using title-weighted whole-word scoring
+
+        Each query token scores 1 if the content contains it as a token and 2
+        if the title does, so "ai" no longer matches "maintainable".
+        """
+        scores = {}
+        for term in tokenize(query):
+            for field in FIELDS:
+                points = KEYWORD_WEIGHTS[field]
+                for docno in self.postings[field].get(term, ()):
+                    scores[docno] = scores.get(docno, 0) + points
+        return scores
+
+    def score_substring(self, query):
+        """Return {docno: score} using the original title-weighted substring scoring
+
+        Each query word scores 1 if it occurs anywhere in the content and 2 if
+        it occurs in the title. Alphanumeric words are resolved against the
+        vocabulary instead of scanning every document; other words fall back
+        to a text scan so the substring semantics are preserved exactly.
+        """
+        scores = {}
+        for word in query.lower().split():
+            for field in FIELDS:
+                points = KEYWORD_WEIGHTS[field]
+                for docno in self._docs_containing(word, field):
+                    scores[docno] = scores.get(docno, 0) + points
+        return scores
+
+    def _docs_containing(self, word, field):
+        """Docnos whose field contains word as a substring"""
+        if TOKEN_PATTERN.fullmatch(word):
+            docnos = set()
+            field_postings = self.postings[field]
+            for term in self._terms_containing(word):
+                docnos.update(field_postings.get(term, ()))
+            return docnos
+        return {
+            docno for docno, slot in enumerate(self.slots)
+            if slot != DELETED and word in self.store.field(slot, field).lower()
+        }
+
+    def _terms_containing(self, word):
+        """Vocabulary terms that contain word, memoised per index"""
+        terms = self._substring_terms.get(word)
+        if terms is None:
+            terms = [term for term in self.doc_freq if word in term]
+            self._substring_terms[word] = terms
+        return terms
+
+    def rank(self, query, top_k=3, mode='bm25', stats=None, prune=True):
+        """Return the top_k (docno, score) pairs, best first
+
+        In the bm25 and keyword modes every quoted phrase must match; the
+        substring mode keeps the original semantics, quotes included. bm25
+        is evaluated with MaxScore pruning unless prune is false; the other
+        modes score every matching document and keep the top_k in a heap.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        matches = None
+        if mode != 'substring':
+            for phrase in parse_phrases(query):
+                found = self.phrase_docnos(phrase)
+                matches = found if matches is None else matches & found
+        if mode == 'bm25' and prune:
+            return self.top_bm25(query, top_k, stats, matches)
+
+        if mode == 'bm25':
+            scores = self.score_bm25(query, stats)
+        elif mode == 'keyword':
+            scores = self.score_keyword(query)
+        else:
+            scores = self.score_substring(query)
+        if matches is not None:
+            scores = {docno: score for docno, score in scores.items() if docno in matches}
+        # Highest score first; ties keep corpus order
+        return heapq.nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def search(self, query, top_k=3, mode='bm25', offset=0, refs=False):
+        """Rank documents for query and return top_k hits (references with refs), skipping the first offset"""
+        # Only the returned documents are materialised from the store
+        return [self.hit(docno, score, refs)
+                for docno, score in self.rank(query, offset + top_k, mode)[offset:]]
@@ -0,0 +1,241 @@
+import hashlib
+import heapq
+import itertools
+import json
+import multiprocessing
+import threading
+import time
+
+from corpus import FileWatcher, load_documents
+from document_store import DocumentStore
+from search_index import CollectionStats, InvertedIndex, tokenize
+from tfidf import TfidfMatrix, query_weights, tfidf_idf
+
+
+def _shard_main(conn, shard_id, num_shards, store_path):
+    """Worker process serving one shard of the corpus
+
+    Documents are assigned round-robin, so local docno n of shard s is
+    global docno n * num_shards + s. Hits are returned as
+    (raw score, global docno, hit) so the coordinator can merge them exactly.
+    """
+    index = tfidf = None
+    while True:
+        message = conn.recv()
+        command = message[0]
+        if command == 'stop':
+            break
+        try:
+            if command == 'load':
+                store = DocumentStore(message[1])
+                if store_path:
+                    store.save(store_path)
+                    store = DocumentStore.open(store_path)
+                index = InvertedIndex(store)
+                result = index.stats()
+            elif command == 'init_tfidf':
+                tfidf = TfidfMatrix(index, stats=message[1])
+                result = None
+            elif command == 'search':
+                _, query, top_k, mode, stats, refs = message
+                result = [
+                    (score, docno * num_shards + shard_id, index.hit(docno, score, refs))
+                    for docno, score in index.rank(query, top_k, mode, stats)
+                ]
+            elif command == 'batch':
+                _, weights_list, top_k, refs = message
+                result = [
+                    [(score, docno * num_shards + shard_id, index.hit(docno, score, refs))
+                     for docno, score in ranked]
+                    for ranked in tfidf.top_k_weighted(weights_list, top_k)
+                ]
+            else:
+                raise ValueError(f"Unknown shard command: {command}")
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class Shard:
+    """Handle on one shard worker process; the lock guards its pipe
+
+    The lock is a process-shared one, so server workers forked after the
+    pool was built can share its shards.
+    """
+
+    def __init__(self, context, shard_id, num_shards, store_path):
+        self.conn, child = context.Pipe()
+        self.lock = context.Lock()
+        self.process = context.Process(
+            target=_shard_main,
+            args=(child, shard_id, num_shards, store_path),
+            name=f'retriever-shard-{shard_id}',
+            daemon=True
+        )
+        self.process.start()
+        child.close()
+
+
+class ShardPool:
+    """One corpus snapshot partitioned across worker processes
+
+    Every query is scattered to all shards in parallel. BM25 statistics
+    (document count, field lengths, document frequencies) are kept
+    corpus-wide by the coordinator and shipped with each query, so every
+    shard scores exactly as a single index would. Local top-k lists are
+    merged on (score desc, global docno asc), which reproduces the
+    single-index ranking and tie-breaking.
+    """
+
+    def __init__(self, num_shards, version=1, store_path=None):
+        # Shards are forked before the corpus is loaded so they do not
+        # inherit a copy of the documents that belong to other shards
+        context = multiprocessing.get_context('fork')
+        self.version = version
+        self.num_shards = num_shards
+        self._shards = [
+            Shard(context, shard_id, num_shards,
+                  f'{store_path}.shard{shard_id}' if store_path else None)
+            for shard_id in range(num_shards)
+        ]
+        self.stats = None
+
+    def load(self, documents):
+        """Send each shard its slice and build the corpus-wide statistics"""
+        shard_stats = self._scatter([
+            ('load', documents[shard_id::self.num_shards]) for shard_id in range(self.num_shards)
+        ])
+        self.stats = CollectionStats.combine(shard_stats)
+        self._scatter([('init_tfidf', self.stats.for_terms(part.doc_freq)) for part in shard_stats])
+        return self
+
+    def _scatter(self, messages):
+        """Send messages[i] to shard i and return the replies in shard order"""
+        sent = []
+        try:
+            for shard, message in zip(self._shards, messages):
+                shard.lock.acquire()
+                sent.append(shard)
+                shard.conn.send(message)
+        finally:
+            # Always drain the replies of every shard we wrote to, so a
+            # failure cannot leave a stale reply in a pipe
+            replies = []
+            for shard in sent:
+                try:
+                    replies.append(shard.conn.recv())
+                except (EOFError, OSError) as e:
+                    replies.append((False, f"Shard {shard.process.name} is gone: {e}"))
+                finally:
+                    shard.lock.release()
+
+        errors = [result for ok, result in replies if not ok]
+        if errors:
+            raise RuntimeError(f"Shard error: {errors[0]}")
+        return [result for _, result in replies]
+
+    def search(self, query, top_k=3, mode='bm25', offset=0, refs=False):
+        stats = self.stats.for_terms(set(tokenize(query))) if mode == 'bm25' else None
+        # Each shard may hold the whole page, so each returns its local top offset + top_k
+        replies = self._scatter([('search', query, offset + top_k, mode, stats, refs)] * self.num_shards)
+        return _merge(replies, offset + top_k)[offset:]
+
+    def search_batch(self, queries, top_k=3, refs=False):
+        weights_list = [query_weights(query, self._tfidf_idf) for query in queries]
+        replies = self._scatter([('batch', weights_list, top_k, refs)] * self.num_shards)
+        return [_merge(per_query, top_k) for per_query in zip(*replies)]
+
+    def _tfidf_idf(self, term):
+        df = self.stats.doc_freq.get(term, 0)
+        return tfidf_idf(self.stats.num_docs, df) if df else None
+
+    def close(self, grace=0.0):
+        """Stop the workers once their in-flight requests have finished"""
+        time.sleep(grace)
+        for shard in self._shards:
+            with shard.lock:
+                try:
+                    shard.conn.send(('stop',))
+                except OSError:
+                    pass
+            shard.process.join(timeout=5)
+
+
+def _digests(documents):
+    """{document id: SHA-1 of the document}"""
+    return {doc['id']: hashlib.sha1(json.dumps(doc, sort_keys=True).encode('utf-8')).digest()
+            for doc in documents}
+
+
+def _merge(replies, top_k):
+    """Merge per-shard ranked hit lists into the global top_k"""
+    merged = heapq.merge(*replies, key=lambda entry: (-entry[0], entry[1]))
+    return [hit for _, _, hit in itertools.islice(merged, top_k)]
+
+
+class ShardedCorpus:
+    """Corpus file served by a pool of shard processes
+
+    Reloads build a complete new pool and swap it in, so requests always
+    search one consistent snapshot. Per-document mutation is not supported.
+    """
+
+    # Seconds a replaced pool keeps serving requests that already hold it
+    RETIRE_GRACE = 5.0
+
+    def __init__(self, path, num_shards, store_path=None, retire_grace=RETIRE_GRACE):
+        self.path = path
+        self.num_shards = num_shards
+        self.store_path = store_path
+        self.retire_grace = retire_grace
+        self._lock = threading.Lock()
+        self._watcher = None
+        documents = load_documents(path)
+        self.snapshot = self._build(1, documents)
+        # document id -> digest of the document the current pool was built from
+        self._digests = _digests(documents)
+
+    def _build(self, version, documents):
+        pool = ShardPool(self.num_shards, version, self.store_path)
+        try:
+            return pool.load(documents)
+        except Exception:
+            pool.close()
+            raise
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def add(self, doc):
+        raise NotImplementedError("Document mutation is not supported in sharded mode")
+
+    def update(self, doc):
+        raise NotImplementedError("Document mutation is not supported in sharded mode")
+
+    def delete(self, doc_id):
+        raise NotImplementedError("Document mutation is not supported in sharded mode")
+
+    def reload(self):
+        """Load the corpus file into a fresh pool and swap it in, unless no document changed
+
+        Returns (version, documents added, replaced or removed), like LiveCorpus.reload().
+        """
+        with self._lock:
+            documents = load_documents(self.path)
+            digests = _digests(documents)
+            changed = sum(1 for doc_id, digest in digests.items() if self._digests.get(doc_id) != digest)
+            changed += sum(1 for doc_id in self._digests if doc_id not in digests)
+            if not changed:
+                return self.snapshot.version, 0
+            old = self.snapshot
+            self.snapshot = self._build(old.version + 1, documents)
+            self._digests = digests
+        threading.Thread(target=old.close, args=(self.retire_grace,), daemon=True).start()
+        return self.snapshot.version, changed
+
+    def watch(self, interval=2.0, reload=None):
+        """Poll the corpus file and call reload (default: self.reload) whenever it changes"""
+        if self._watcher is None and self.path:
+            self._watcher = FileWatcher(self.path, reload or self.reload, interval).start()
@@ -0,0 +1,173 @@
+import math
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from search_index import FIELD_WEIGHTS, FIELDS, tokenize
+
+
+class TfidfMatrix:
+    """Sparse TF-IDF document-term matrix for scoring many queries at once
+
+    The matrix stores log-scaled, field-weighted term frequencies; IDF
+    weights and document norms are applied at query time, so a batch of
+    queries is scored (cosine similarity) with a single sparse matrix
+    product and corpus changes only rewrite the affected rows.
+    """
+
+    def __init__(self, index, stats=None):
+        """Build the matrix for index
+
+        stats overrides the collection statistics used for IDF, which lets a
+        shard weight its slice of the corpus with corpus-wide values.
+        """
+        stats = stats or index.stats()
+        self.index = index
+        self.vocabulary = {}
+        docnos = range(len(index.slots))
+        self.tf = self._tf_rows(index, docnos, len(index.slots))
+        self.doc_freq = np.zeros(len(self.vocabulary), dtype=np.float64)
+        for term, col in self.vocabulary.items():
+            self.doc_freq[col] = stats.doc_freq.get(term, 0)
+        self._refresh_weights(stats.num_docs)
+
+    def with_changes(self, index, docnos):
+        """Return a new matrix for index where only docnos have changed"""
+        matrix = TfidfMatrix.__new__(TfidfMatrix)
+        matrix.index = index
+        matrix.vocabulary = dict(self.vocabulary)
+
+        patch = matrix._tf_rows(index, docnos, len(index.slots))
+        tf = self.tf.copy()
+        tf.resize(patch.shape)
+        # Zero out the changed rows, then add their new contents
+        keep = np.ones(patch.shape[0], dtype=np.float64)
+        keep[list(docnos)] = 0
+        tf = sparse.diags(keep) @ tf + patch
+        tf.eliminate_zeros()
+        matrix.tf = tf.tocsr()
+
+        # Only terms of changed documents have a different document frequency
+        affected = set()
+        for docno in docnos:
+            affected.update(_row_columns(matrix.tf, docno))
+            if docno < self.tf.shape[0]:
+                affected.update(_row_columns(self.tf, docno))
+        matrix.doc_freq = np.zeros(len(matrix.vocabulary), dtype=np.float64)
+        matrix.doc_freq[:len(self.doc_freq)] = self.doc_freq
+        terms = list(matrix.vocabulary)
+        for col in affected:
+            matrix.doc_freq[col] = index.doc_freq.get(terms[col], 0)
+        matrix._refresh_weights(index.num_docs)
+        return matrix
+
+    def _tf_rows(self, index, docnos, num_rows):
+        """CSR matrix holding the log-scaled term frequencies of docnos"""
+        rows, cols, values = [], [], []
+        for docno in docnos:
+            doc = index.document(docno)
+            if doc is None:
+                continue
+            weighted_tf = Counter()
+            for field in FIELDS:
+                weight = FIELD_WEIGHTS[field]
+                for term in tokenize(doc[field]):
+                    weighted_tf[term] += weight
+            for term, tf in weighted_tf.items():
+                col = self.vocabulary.setdefault(term, len(self.vocabulary))
+                rows.append(docno)
+                cols.append(col)
+                values.append(1 + math.log(tf))
+        return sparse.csr_matrix(
+            (np.array(values, dtype=np.float64), (rows, cols)),
+            shape=(num_rows, len(self.vocabulary))
+        )
+
+    def _refresh_weights(self, num_docs):
+        """Recompute IDF weights and document norms from term frequencies"""
+        self.idf = np.log((1 + num_docs) / (1 + self.doc_freq)) + 1
+        norms = np.sqrt(self.tf.multiply(self.tf) @ (self.idf ** 2))
+        self.inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+
+    def term_idf(self, term):
+        """IDF of term, or None if no document contains it"""
+        col = self.vocabulary.get(term)
+        if col is None or not self.doc_freq[col]:
+            return None
+        return float(self.idf[col])
+
+    def query_matrix(self, weights_list):
+        """Encode query weights as rows pre-multiplied by the document-side IDF"""
+        rows, cols, values = [], [], []
+        for row, weights in enumerate(weights_list):
+            for term, weight in weights.items():
+                col = self.vocabulary.get(term)
+                if col is None:
+                    continue
+                rows.append(row)
+                cols.append(col)
+                values.append(weight * self.idf[col])
+        return sparse.csr_matrix(
+            (np.array(values, dtype=np.float64), (rows, cols)),
+            shape=(len(weights_list), len(self.vocabulary))
+        )
+
+    def top_k_weighted(self, weights_list, top_k=3):
+        """Return [(docno, score), ...] per query weight vector, best first"""
+        scores = (self.query_matrix(weights_list) @ self.tf.T @ sparse.diags(self.inv_norms)).tocsr()
+        results = []
+        for row in range(len(weights_list)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            results.append(_top_k(scores.indices[start:end], scores.data[start:end], top_k))
+        return results
+
+    def top_k_batch(self, queries, top_k=3):
+        """Return [(docno, score), ...] per query, best first"""
+        return self.top_k_weighted([query_weights(query, self.term_idf) for query in queries], top_k)
+
+    def search_batch(self, queries, top_k=3, refs=False):
+        """Return the /retrieve hit list (references with refs) for every query in the batch"""
+        return [
+            [self.index.hit(docno, score, refs) for docno, score in ranked]
+            for ranked in self.top_k_batch(queries, top_k)
+        ]
+
+
+def tfidf_idf(num_docs, df):
+    """Smoothed TF-IDF inverse document frequency"""
+    return math.log((1 + num_docs) / (1 + df)) + 1
+
+
+def query_weights(query, idf):
+    """Unit-length TF-IDF weights {term: weight} of a query
+
+    idf(term) returns the term's IDF, or None for terms absent from the corpus.
+    """
+    weights = {}
+    for term, qtf in Counter(tokenize(query)).items():
+        term_idf = idf(term)
+        if term_idf is not None:
+            weights[term] = (1 + math.log(qtf)) * term_idf
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    return {term: weight / norm for term, weight in weights.items()}
+
+
+def _row_columns(matrix, row):
+    """Column indices of the non-zero entries in a CSR row"""
+    return matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]].tolist()
+
+
+def _top_k(docnos, values, top_k):
+    """Select the top_k (docno, score) pairs; ties are broken by docno"""
+    positive = values > 0
+    docnos, values = docnos[positive], values[positive]
+    if top_k <= 0 or len(values) == 0:
+        return []
+    if len(values) > top_k:
+        # argpartition finds the k-th best score; keep everything tied with it
+        kth = values[np.argpartition(-values, top_k - 1)[top_k - 1]]
+        keep = values >= kth
+        docnos, values = docnos[keep], values[keep]
+    order = np.lexsort((docnos, -values))[:top_k]
+    return [(int(docnos[i]), float(values[i])) for i in order]
@@ -0,0 +1,63 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each service imports its modules by bare name from its own directory
+for name in ('kong', 'retriever-agent', 'policy-service', 'processor-agent', 'orchestrator'):
+    path = os.path.join(REPO_ROOT, name)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(scope='session')
+def sample_documents():
+    """The corpus shipped with the retriever"""
+    with open(os.path.join(REPO_ROOT, 'retriever-agent', 'documents.json')) as f:
+        return json.load(f)
+
+
+# Settings every service app is imported with in the tests
+APP_ENV = {
+    'POLICY_RULES_PATH': os.path.join(REPO_ROOT, 'policy-service', 'policy_rules.json'),
+    'DOCUMENTS_PATH': os.path.join(REPO_ROOT, 'retriever-agent', 'documents.json'),
+    'QUERY_CACHE_SIZE': '0',
+}
+
+
+@pytest.fixture(scope='session')
+def service_app(tmp_path_factory):
+    """load(service) -> that service's app module, imported once per session
+
+    Modules register their metrics at import, so each app.py can only be
+    imported once; tests swap module globals (PIPELINE, IDEMPOTENCY, ...)
+    with monkeypatch instead of reloading.
+    """
+    loaded = {}
+
+    def load(service):
+        if service not in loaded:
+            directory = tmp_path_factory.mktemp(service)
+            env = dict(APP_ENV, AUDIT_LOG_PATH=str(directory / 'audit.jsonl'),
+                       IDEMPOTENCY_DB_PATH=str(directory / 'idempotency.db'))
+            saved = {name: os.environ.get(name) for name in env}
+            os.environ.update(env)
+            try:
+                name = service.replace('-', '_') + '_app'
+                spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, service, 'app.py'))
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            finally:
+                for key, value in saved.items():
+                    if value is None:
+                        os.environ.pop(key, None)
+                    else:
+                        os.environ[key] = value
+            loaded[service] = module
+        return loaded[service]
+
+    return load
@@ -0,0 +1,24 @@
+"""Synthetic corpora and queries shared by the tests"""
+
+import random
+
+CATEGORIES = ['AI', 'Cloud', 'Architecture', 'DevOps']
+
+
+def random_documents(count, seed, vocabulary=30, max_words=40):
+    """Documents over a small vocabulary, so terms repeat within and across documents"""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    return [{
+        "id": f"doc-{i:04d}",
+        "title": " ".join(rng.choices(words, k=rng.randint(1, 5))),
+        "content": " ".join(rng.choices(words, k=rng.randint(1, max_words))),
+        "category": rng.choice(CATEGORIES)
+    } for i in range(count)]
+
+
+def random_queries(count, seed, vocabulary=30):
+    """Queries of one to four terms, some outside the vocabulary, some repeated"""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary + 5)]
+    return [" ".join(rng.choices(words, k=rng.randint(1, 4))) for _ in range(count)]
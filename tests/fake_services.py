@@ -0,0 +1,80 @@
+"""Stand-ins for the policy, retriever and processor services, served by aiohttp on a background thread"""
+
+import asyncio
+import threading
+
+from aiohttp import web
+
+
+class FakeServices:
+    """One HTTP server answering /policy, /retrieve and /process like the real services
+
+    Queries containing 'banned' are denied and retrievals of queries
+    containing 'slow' take `slow_seconds`. `calls` counts requests per
+    path and `peers` holds the client address of every connection used;
+    `url` is the base URL of every service.
+    """
+
+    def __init__(self, slow_seconds=2.0):
+        self.slow_seconds = slow_seconds
+        self.calls = {}
+        self.peers = set()
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='fake-services', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post('/policy', self.policy)
+        app.router.add_post('/retrieve', self.retrieve)
+        app.router.add_post('/process', self.process)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+
+    async def _body(self, request):
+        self.calls[request.path] = self.calls.get(request.path, 0) + 1
+        self.peers.add(request.transport.get_extra_info('peername'))
+        return await request.json()
+
+    async def policy(self, request):
+        data = await self._body(request)
+        allowed = 'banned' not in data['query']
+        return web.json_response({
+            "allowed": allowed,
+            "reason": "Policy check passed" if allowed else "Matched rule banned",
+            "matched_rules": [] if allowed else ["banned"],
+            "request_id": data['request_id']
+        })
+
+    async def retrieve(self, request):
+        data = await self._body(request)
+        if 'slow' in data['query']:
+            await asyncio.sleep(self.slow_seconds)
+        return web.json_response({"documents": [
+            {"id": f"doc-{word}", "title": word.title(), "content": f"About {word}. More.", "category": "AI"}
+            for word in data['query'].split()
+        ]})
+
+    async def process(self, request):
+        data = await self._body(request)
+        documents = data['documents']
+        return web.json_response({
+            "request_id": data['request_id'],
+            "summary": " ".join(doc['content'].split('.')[0] for doc in documents),
+            "label": "AI",
+            "document_count": len(documents)
+        })
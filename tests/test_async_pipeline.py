@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from async_pipeline import AsyncDistributedPipeline, AsyncServiceClient
+from downstream import ServiceClient
+from pipeline import DistributedPipeline
+from tests.fake_services import FakeServices
+
+
+@pytest.fixture
+def services():
+    with FakeServices(slow_seconds=1.0) as services:
+        yield services
+
+
+def run_async(services, name, request_id, query):
+    """(policy_data, processor_data, seconds) of one AsyncDistributedPipeline.run()"""
+    async def run():
+        pipeline = AsyncDistributedPipeline(*(AsyncServiceClient(f'{step}-{name}', services.url)
+                                              for step in ('policy', 'retriever', 'processor')))
+        await pipeline.open()
+        try:
+            started = time.perf_counter()
+            policy_data, processor_data = await pipeline.run('trace', request_id, query)
+            return policy_data, processor_data, time.perf_counter() - started
+        finally:
+            await pipeline.close()
+
+    return asyncio.run(run())
+
+
+def cancelled_retrievals(name):
+    return REGISTRY.get_sample_value('downstream_request_duration_seconds_count', {
+        "service": f'retriever-{name}', "path": '/retrieve', "status": 'cancelled'
+    }) or 0
+
+
+def test_denied_query_cancels_the_speculative_retrieval(services):
+    policy_data, processor_data, seconds = run_async(services, 'denied', 'r1', 'banned slow topic')
+    assert policy_data['allowed'] is False and processor_data is None
+    # The retrieval started with the policy check, then was dropped instead of awaited
+    assert cancelled_retrievals('denied') == 1
+    assert seconds < services.slow_seconds
+    assert '/process' not in services.calls
+
+
+def test_allowed_query_matches_the_sync_pipeline(services):
+    _, async_result, _ = run_async(services, 'allowed', 'r1', 'machine learning')
+    pipeline = DistributedPipeline(*(ServiceClient(f'{step}-sync', services.url)
+                                     for step in ('policy', 'retriever', 'processor')))
+    documents = pipeline.retrieve('trace', 'r1', 'machine learning')
+    sync_result = pipeline.process('trace', 'r1', 'machine learning', documents)
+    assert async_result == sync_result
+    assert async_result['document_count'] == 2
+    assert cancelled_retrievals('allowed') == 0
+
+
+def test_allowed_query_waits_for_the_retrieval(services):
+    policy_data, processor_data, seconds = run_async(services, 'slow', 'r1', 'slow topic')
+    assert policy_data['allowed'] is True and processor_data['document_count'] == 2
+    assert seconds >= services.slow_seconds
+    assert services.calls == {'/policy': 1, '/retrieve': 1, '/process': 1}
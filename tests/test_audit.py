@@ -0,0 +1,45 @@
+import glob
+import json
+import os
+
+from common.audit import AuditWriter
+
+
+def read_records(*paths):
+    return [json.loads(line) for path in paths for line in open(path)]
+
+
+def test_records_are_written_in_order_in_batches(tmp_path):
+    path = str(tmp_path / 'audit.jsonl')
+    writer = AuditWriter(path, 'svc', batch_size=10, flush_interval=5.0)
+    for number in range(25):
+        writer.log('t', f'r{number}', '/e', 'ok', {"n": number})
+    assert writer.flush()
+    writer.close()
+    records = read_records(path)
+    assert [record['details']['n'] for record in records] == list(range(25))
+    assert {record['service'] for record in records} == {'svc'}
+    assert writer.stats()['written'] == 25 and writer.stats()['batches'] <= 4
+
+
+def test_rotation_keeps_backup_count_files(tmp_path):
+    path = str(tmp_path / 'audit.jsonl')
+    writer = AuditWriter(path, 'svc', batch_size=1, max_bytes=400, backup_count=2)
+    for number in range(40):
+        writer.log('t', f'r{number}', '/e', 'ok', {"n": number})
+        writer.flush()
+    writer.close()
+    assert sorted(glob.glob(path + '*')) == [path, path + '.1', path + '.2', path + '.lock']
+    assert all(os.path.getsize(name) <= 400 for name in (path, path + '.1', path + '.2'))
+    numbers = [record['details']['n'] for record in read_records(path + '.2', path + '.1', path)]
+    # The newest records survive, oldest first across the rotated files
+    assert numbers == list(range(40 - len(numbers), 40))
+    assert writer.stats()['rotations'] > 2
+
+
+def test_writes_after_close_go_straight_to_the_file(tmp_path):
+    path = str(tmp_path / 'audit.jsonl')
+    writer = AuditWriter(path, 'svc')
+    writer.close()
+    writer.log('t', 'r1', '/e', 'ok', {})
+    assert [record['request_id'] for record in read_records(path)] == ['r1']
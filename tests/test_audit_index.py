@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+import common.audit_index as audit_index
+from common.audit_index import AuditIndex
+
+
+def record(number, service='retriever-agent', status='success', trace_id=None, padding=0):
+    return {
+        "timestamp": f"2025-10-14T17:{number % 60:02d}:00",
+        "trace_id": trace_id or f"t{number}",
+        "request_id": f"r{number}",
+        "service": service,
+        "status": status,
+        "details": {"padding": "x" * padding}
+    }
+
+
+def append(path, records):
+    with open(path, 'a') as f:
+        for item in records:
+            f.write(json.dumps(item) + '\n')
+
+
+def total(index, **filters):
+    return sum(row['count'] for row in index.counts(**filters))
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = tmp_path / 'audit.jsonl'
+    path.touch()
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path, log):
+    return AuditIndex(log, str(tmp_path / 'audit-index.db'))
+
+
+def test_incremental_indexing_and_lookups(index, log):
+    append(log, [record(n) for n in range(5)])
+    assert index.update() == 5
+    append(log, [record(5, trace_id='t1')])
+    assert index.update() == 1
+    assert index.update() == 0
+    assert [item['request_id'] for item in index.trace('t1')] == ['r1', 'r5']
+    assert index.request('r3') == [record(3)]
+    assert total(index) == 6
+
+
+def test_partial_line_waits_for_its_newline(index, log):
+    append(log, [record(0)])
+    with open(log, 'a') as f:
+        f.write(json.dumps(record(1))[:20])
+    assert index.update() == 1
+    with open(log, 'a') as f:
+        f.write(json.dumps(record(1))[20:] + '\n')
+    assert index.update() == 1
+    assert index.request('r1') == [record(1)]
+
+
+def test_truncated_file_is_not_counted_twice(index, log):
+    append(log, [record(n) for n in range(4)])
+    index.update()
+    with open(log, 'w') as f:
+        f.write(json.dumps(record(0)) + '\n')
+    append(log, [record(10, status='denied')])
+    index.update()
+    assert total(index) == 2
+    assert total(index, status='denied') == 1
+    assert index.request('r2') == []
+
+
+def test_counts_outlive_deleted_rotated_files(index, log):
+    append(log, [record(n) for n in range(3)])
+    index.update()
+    os.rename(log, log + '.1')
+    append(log, [record(n) for n in range(3, 5)])
+    index.update()
+    assert total(index) == 5
+    os.remove(log + '.1')
+    index.update()
+    assert total(index) == 5
+    assert index.request('r0') == []
+    assert index.request('r4') == [record(4)]
+
+
+def test_lines_longer_than_a_read_are_indexed_whole(index, log, monkeypatch):
+    monkeypatch.setattr(audit_index, 'READ_CHUNK', 64)
+    records = [record(0, padding=10), record(1, padding=300), record(2), record(3, padding=150)]
+    append(log, records)
+    assert index.update() == 4
+    assert [index.request(f'r{n}') for n in range(4)] == [[item] for item in records]
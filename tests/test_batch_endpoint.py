@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from idempotency import CACHED, OWNER, IdempotencyStore
+from pipeline import StepError
+
+
+class StubPipeline:
+    """Batch steps answering from fixed rules; records the request_ids each step saw
+
+    Queries containing 'deny' are denied, 'noretrieve' and 'noprocess' fail
+    their item in that step, and failing_step raises for the whole call.
+    """
+
+    def __init__(self, failing_step=None):
+        self.failing_step = failing_step
+        self.calls = {}
+
+    def _called(self, step, items):
+        self.calls.setdefault(step, []).append([item['request_id'] for item in items])
+        if step == self.failing_step:
+            raise StepError(step, f"{step.capitalize()} service error")
+
+    def check_policy_batch(self, trace_id, items):
+        self._called('policy', items)
+        return [{"allowed": 'deny' not in item['query'], "reason": "Matched rule deny"} for item in items]
+
+    def retrieve_batch(self, trace_id, items):
+        self._called('retriever', items)
+        return [{"error": "bad query"} if 'noretrieve' in item['query']
+                else {"documents": [{"id": item['query']}]} for item in items]
+
+    def process_batch(self, trace_id, items):
+        self._called('processor', items)
+        return [{"error": "bad documents"} if 'noprocess' in item['query']
+                else {"summary": f"about {item['query']}", "label": "L", "document_count": 1} for item in items]
+
+
+@pytest.fixture
+def orchestrator(service_app, monkeypatch, tmp_path):
+    module = service_app('orchestrator')
+    monkeypatch.setattr(module, 'IDEMPOTENCY', IdempotencyStore(str(tmp_path / 'idempotency.db'), lease=30.0))
+    monkeypatch.setattr(module, 'PIPELINE', StubPipeline())
+    return module
+
+
+def post_batch(module, items):
+    response = module.app.test_client().post('/process-requests', json={"requests": items})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_items_fail_on_their_own(orchestrator):
+    body = post_batch(orchestrator, [
+        {"request_id": "ok", "query": "fine"},
+        {"request_id": "denied", "query": "deny this"},
+        {"request_id": "no-docs", "query": "noretrieve"},
+        {"request_id": "no-summary", "query": "noprocess"},
+        {"request_id": "no-query"},
+        "not an object",
+    ])
+    results = body['results']
+    assert [result['status'] for result in results] == ['success', 'denied', 'error', 'error', 'error', 'error']
+    assert results[0]['summary'] == 'about fine'
+    assert results[2]['error'] == "Retriever service error"
+    assert results[3]['error'] == "Processor service error"
+    assert results[4]['error'] == "query is required"
+    assert body['statuses'] == {"success": 1, "denied": 1, "error": 4}
+    assert orchestrator.PIPELINE.calls == {
+        "policy": [["ok", "denied", "no-docs", "no-summary"]],
+        "retriever": [["ok", "no-docs", "no-summary"]],
+        "processor": [["ok", "no-summary"]],
+    }
+    # Only the success is stored; the failed items' claims were released
+    assert orchestrator.IDEMPOTENCY.try_claim('ok')[0] == CACHED
+    assert orchestrator.IDEMPOTENCY.try_claim('no-summary')[0] == OWNER
+
+
+def test_failed_step_fails_only_the_items_that_reached_it(orchestrator, monkeypatch):
+    monkeypatch.setattr(orchestrator, 'PIPELINE', StubPipeline(failing_step='retriever'))
+    results = post_batch(orchestrator, [
+        {"request_id": "a", "query": "one"},
+        {"request_id": "b", "query": "deny two"},
+        {"request_id": "c", "query": "three"},
+    ])['results']
+    assert [result['status'] for result in results] == ['error', 'denied', 'error']
+    assert results[0]['error'] == "Retriever service error"
+    assert 'processor' not in orchestrator.PIPELINE.calls
+    assert orchestrator.IDEMPOTENCY.try_claim('a')[0] == OWNER
+
+
+def test_duplicates_in_a_batch_run_once(orchestrator):
+    results = post_batch(orchestrator, [
+        {"request_id": "r1", "query": "fine"},
+        {"request_id": "r1", "query": "fine"},
+        {"request_id": "r2", "query": "deny"},
+        {"request_id": "r2", "query": "deny"},
+    ])['results']
+    assert orchestrator.PIPELINE.calls['policy'] == [["r1", "r2"]]
+    assert [result['status'] for result in results] == ['success', 'cached', 'denied', 'denied']
+    assert results[1]['summary'] == results[0]['summary']
+
+
+def test_completed_items_are_replayed(orchestrator):
+    first = post_batch(orchestrator, [{"request_id": "r1", "query": "fine"}])['results'][0]
+    orchestrator.PIPELINE.calls.clear()
+    results = post_batch(orchestrator, [
+        {"request_id": "r1", "query": "fine"},
+        {"request_id": "r2", "query": "other"},
+    ])['results']
+    assert orchestrator.PIPELINE.calls['policy'] == [["r2"]]
+    assert results[0] == dict(first, status='cached')
+    assert results[1]['status'] == 'success'
+
+
+@pytest.mark.parametrize('owner_finishes', [True, False])
+def test_item_claimed_elsewhere_waits_for_the_owner(orchestrator, owner_finishes):
+    store = orchestrator.IDEMPOTENCY
+    state, claim = store.try_claim('r1')
+    assert state == OWNER
+    bodies = []
+    batch = threading.Thread(target=lambda: bodies.append(post_batch(orchestrator, [
+        {"request_id": "r1", "query": "fine"},
+        {"request_id": "r2", "query": "other"},
+    ])))
+    batch.start()
+    time.sleep(0.2)
+    # The batch ran the free item and is waiting on the claimed one
+    assert orchestrator.PIPELINE.calls['policy'] == [["r2"]]
+    if owner_finishes:
+        store.complete('r1', claim, {"request_id": "r1", "summary": "from the owner", "label": "L",
+                                     "document_count": 1})
+    else:
+        store.release('r1', claim)
+    batch.join(timeout=10)
+    result = bodies[0]['results'][0]
+    if owner_finishes:
+        assert result['status'] == 'cached' and result['summary'] == "from the owner"
+        assert orchestrator.PIPELINE.calls['policy'] == [["r2"]]
+    else:
+        # The owner gave up, so the batch ran the item itself in a second round
+        assert result['status'] == 'success' and result['summary'] == "about fine"
+        assert orchestrator.PIPELINE.calls['policy'] == [["r2"], ["r1"]]
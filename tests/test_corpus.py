@@ -0,0 +1,118 @@
+import json
+import random
+
+import msgpack
+import pytest
+
+from corpus import LiveCorpus
+from search_index import InvertedIndex
+from tests.corpora import random_documents, random_queries
+from tfidf import TfidfMatrix
+
+
+def by_id(index, ranked):
+    return [(index.document(docno).id, score) for docno, score in ranked]
+
+
+def assert_same_rankings(index, tfidf, documents, queries):
+    """index and tfidf rank like structures built from scratch over documents"""
+    fresh = InvertedIndex(documents)
+    fresh_tfidf = TfidfMatrix(fresh)
+    for query in queries:
+        for mode in ('bm25', 'keyword', 'substring'):
+            expected = dict(by_id(fresh, fresh.rank(query, 100, mode)))
+            assert dict(by_id(index, index.rank(query, 100, mode))) == pytest.approx(expected)
+    for got, expected in zip(tfidf.top_k_batch(queries, 100), fresh_tfidf.top_k_batch(queries, 100)):
+        assert dict(by_id(index, got)) == pytest.approx(dict(by_id(fresh, expected)))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_mutations_match_a_rebuild(seed):
+    rng = random.Random(seed)
+    documents = random_documents(30, seed)
+    corpus = LiveCorpus(documents)
+    current = {doc['id']: doc for doc in documents}
+    extra = iter(random_documents(60, seed + 100))
+    for _ in range(40):
+        action = rng.choice(['add', 'update', 'delete'])
+        if action == 'add':
+            doc = dict(next(extra), id=f"new-{len(current)}-{rng.random()}")
+            corpus.add(doc)
+            current[doc['id']] = doc
+        elif action == 'update' and current:
+            doc = dict(next(extra), id=rng.choice(sorted(current)))
+            corpus.update(doc)
+            current[doc['id']] = doc
+        elif current:
+            doc_id = rng.choice(sorted(current))
+            corpus.delete(doc_id)
+            del current[doc_id]
+    snapshot = corpus.snapshot
+    assert len(snapshot.index) == len(current)
+    assert_same_rankings(snapshot.index, snapshot.tfidf, list(current.values()), random_queries(15, seed))
+
+
+def test_old_snapshots_are_untouched():
+    documents = random_documents(20, 1)
+    corpus = LiveCorpus(documents)
+    before = corpus.snapshot
+    expected = before.index.rank('w1 w2', 10)
+    corpus.delete(documents[0]['id'])
+    corpus.update(dict(documents[1], content='w1 w1 w1 w2'))
+    assert before.index.rank('w1 w2', 10) == expected
+    assert corpus.version == before.version + 2
+
+
+def test_mutation_errors():
+    corpus = LiveCorpus(random_documents(3, 2))
+    with pytest.raises(KeyError):
+        corpus.add(random_documents(1, 2)[0])
+    with pytest.raises(KeyError):
+        corpus.update({"id": "missing", "title": "t", "content": "c", "category": "X"})
+    with pytest.raises(KeyError):
+        corpus.delete('missing')
+    with pytest.raises(ValueError):
+        corpus.add({"id": "x", "title": "t"})
+
+
+def test_reload_applies_only_changes(tmp_path):
+    path = tmp_path / 'documents.json'
+    documents = random_documents(10, 4)
+    path.write_text(json.dumps(documents))
+    corpus = LiveCorpus.from_file(str(path))
+    assert corpus.reload() == (1, 0)
+
+    documents[0] = dict(documents[0], content='w9 w9')
+    del documents[1]
+    documents.append({"id": "added", "title": "w3", "content": "w4", "category": "X"})
+    path.write_text(json.dumps(documents))
+    assert corpus.reload() == (2, 3)
+    assert_same_rankings(corpus.snapshot.index, corpus.snapshot.tfidf, documents, random_queries(10, 4))
+
+
+@pytest.fixture
+def retriever_app(service_app, tmp_path, monkeypatch, sample_documents):
+    """retriever-agent/app.py on a copy of the sample corpus"""
+    path = tmp_path / 'documents.json'
+    path.write_text(json.dumps(sample_documents))
+    module = service_app('retriever-agent')
+    monkeypatch.setattr(module, 'CORPUS', LiveCorpus.from_file(str(path)))
+    return module.app.test_client()
+
+
+def test_document_endpoints_negotiate_msgpack(retriever_app):
+    doc = {"id": "doc-new", "title": "Vector Search", "content": "Vector search basics.", "category": "AI"}
+    headers = {'Content-Type': 'application/msgpack', 'Accept': 'application/msgpack'}
+    response = retriever_app.post('/documents', data=msgpack.packb(doc), headers=headers)
+    assert response.status_code == 201 and response.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(response.data) == {"id": "doc-new", "corpus_version": 2}
+
+    response = retriever_app.post('/documents', data=msgpack.packb(doc), headers=headers)
+    assert response.status_code == 409
+    assert 'error' in msgpack.unpackb(response.data)
+
+    response = retriever_app.put('/documents/doc-new', json=dict(doc, content="Updated."))
+    assert response.status_code == 200 and response.get_json()['corpus_version'] == 3
+    response = retriever_app.delete('/documents/doc-new', headers={'Accept': 'application/msgpack'})
+    assert msgpack.unpackb(response.data) == {"id": "doc-new", "corpus_version": 4}
+    assert retriever_app.delete('/documents/doc-new').status_code == 404
@@ -0,0 +1,56 @@
+import pytest
+
+from corpus import LiveCorpus
+from document_store import DocumentStore
+from tests.corpora import random_documents
+
+
+def test_store_round_trip(tmp_path):
+    documents = random_documents(20, 1) + [{"id": "ü", "title": "naïve", "content": "日本語", "category": "X"}]
+    store = DocumentStore(documents)
+    assert [store.get(slot).as_dict() for slot in range(len(store))] == documents
+    path = str(tmp_path / 'store.bin')
+    store.save(path)
+    mapped = DocumentStore.open(path)
+    mapped.append({"id": "extra", "title": "t", "content": "c", "category": "New"})
+    assert [mapped.get(slot).as_dict() for slot in range(len(documents))] == documents
+    assert mapped.field(len(documents), 'category') == 'New'
+    assert mapped.text_bytes() == sum(mapped.slot_bytes(slot) for slot in range(len(mapped)))
+
+
+@pytest.mark.parametrize('mapped', [False, True])
+def test_rewrites_are_reclaimed(tmp_path, mapped):
+    documents = random_documents(10, 2)
+    store_path = str(tmp_path / 'store.bin') if mapped else None
+    corpus = LiveCorpus(documents, store_path=store_path)
+    live = corpus.store_stats()['live_bytes']
+    old = corpus.snapshot
+
+    for round in range(50):
+        for doc in documents:
+            corpus.update(dict(doc, content=f"{doc['content']} r{round % 3}"))
+    stats = corpus.store_stats()
+    assert stats['compactions'] > 0
+    # Never more than the live text plus the dead fraction allowed before a compaction
+    assert corpus.snapshot.index.store.text_bytes() <= 2 * stats['live_bytes']
+    assert abs(stats['live_bytes'] - live) <= 3 * len(documents)
+
+    # Every document reads back as last written; older snapshots still read their own
+    for doc in documents:
+        assert corpus.get(doc['id']).content.startswith(doc['content'])
+    assert [old.index.document(docno).as_dict() for docno in range(len(documents))] == documents
+    assert corpus.snapshot.search('w1 w2') == LiveCorpus(
+        [corpus.get(doc['id']).as_dict() for doc in documents]).snapshot.search('w1 w2')
+
+
+def test_deletes_are_reclaimed():
+    documents = random_documents(20, 3)
+    corpus = LiveCorpus(documents)
+    for doc in documents[:15]:
+        corpus.delete(doc['id'])
+    assert corpus.compactions >= 1
+    index = corpus.snapshot.index
+    assert len(index.store) == 5 and index.dead_bytes() <= 0.5 * index.store.text_bytes()
+    assert [corpus.get(doc['id']).as_dict() for doc in documents[15:]] == documents[15:]
+    corpus.add(documents[0])
+    assert corpus.get(documents[0]['id']).as_dict() == documents[0]
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from downstream import PoolStats, ServiceClient
+from tests.fake_services import FakeServices
+
+POLICY_REQUEST = {"request_id": "r1", "query": "machine learning"}
+
+
+@pytest.fixture(scope='module')
+def services():
+    with FakeServices(slow_seconds=0.2) as services:
+        yield services
+
+
+@pytest.fixture
+def client(services, request):
+    clients = []
+
+    def make(**kwargs):
+        client = ServiceClient(f'policy-{request.node.name}', services.url, **kwargs)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+def call(client, times):
+    for _ in range(times):
+        status, body = client.post('/policy', POLICY_REQUEST)
+        assert status == 200 and body['allowed'] is True
+
+
+def counters(client):
+    stats = client.pool_stats()
+    return {key: stats[key] for key in ('created', 'reused', 'in_use', 'discarded', 'expired')}
+
+
+def test_pool_stats_counts_checkouts_and_checkins():
+    stats = PoolStats()
+    stats.checkout(reused=False)
+    stats.checkout(reused=True)
+    assert stats.as_dict() == {"created": 1, "reused": 1, "in_use": 2, "discarded": 0, "expired": 0}
+    stats.checkin(kept=True)
+    stats.checkin(kept=False)
+    stats.expire()
+    assert stats.as_dict() == {"created": 1, "reused": 1, "in_use": 0, "discarded": 1, "expired": 1}
+
+
+def test_sequential_calls_reuse_one_connection(services, client):
+    services.peers.clear()
+    service = client()
+    call(service, 5)
+    assert counters(service) == {"created": 1, "reused": 4, "in_use": 0, "discarded": 0, "expired": 0}
+    # The server saw a single client connection
+    assert len(services.peers) == 1
+
+
+def test_no_keep_alive_opens_a_connection_per_call(services, client):
+    services.peers.clear()
+    service = client(keep_alive=0)
+    call(service, 3)
+    assert counters(service) == {"created": 3, "reused": 0, "in_use": 0, "discarded": 0, "expired": 0}
+    assert len(services.peers) == 3
+
+
+def test_idle_connection_expires_before_reuse(client):
+    service = client(keep_alive=0.05)
+    call(service, 2)
+    time.sleep(0.1)
+    call(service, 1)
+    assert counters(service) == {"created": 2, "reused": 1, "in_use": 0, "discarded": 0, "expired": 1}
+
+
+def test_connection_beyond_the_pool_size_is_discarded(services, client):
+    service = client(pool_size=1)
+    threads = [threading.Thread(target=service.post, args=('/retrieve', {"request_id": "r1", "query": "slow"}))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Both calls needed a connection; only one fits back in the pool
+    assert counters(service) == {"created": 2, "reused": 0, "in_use": 0, "discarded": 1, "expired": 0}
+    call(service, 1)
+    assert counters(service)['reused'] == 1
@@ -0,0 +1,154 @@
+import importlib.util
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import types
+
+import pytest
+import requests
+
+from common import serving
+from tests.conftest import REPO_ROOT
+
+# A WSGI app answering "<worker pid> <refork count>"; its refork hook counts in the master
+REFORK_APP = """
+from common import serving
+
+GENERATION = [0]
+serving.on_refork(lambda: GENERATION.__setitem__(0, GENERATION[0] + 1))
+
+
+def app(environ, start_response):
+    import os
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [f"{os.getpid()} {GENERATION[0]}".encode()]
+"""
+
+
+@pytest.fixture
+def environ():
+    """os.environ, restored afterwards: loading the config writes to it"""
+    saved = dict(os.environ)
+    yield os.environ
+    os.environ.clear()
+    os.environ.update(saved)
+
+
+@pytest.fixture
+def load_conf(environ):
+    def load():
+        spec = importlib.util.spec_from_file_location('gunicorn_conf_under_test',
+                                                      os.path.join(REPO_ROOT, 'common', 'gunicorn_conf.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    return load
+
+
+@pytest.fixture
+def refork_hooks(monkeypatch):
+    hooks = []
+    monkeypatch.setattr(serving, '_refork_hooks', hooks)
+    return hooks
+
+
+def test_settings_come_from_the_environment(environ, load_conf):
+    environ.update(PORT='5123', WORKERS='3', THREADS='2', MAX_REQUESTS='0')
+    conf = load_conf()
+    assert conf.bind == '0.0.0.0:5123'
+    assert (conf.workers, conf.threads, conf.max_requests) == (3, 2, 0)
+    assert conf.preload_app is True
+    # Read by the app it preloads
+    assert environ[serving.MASTER_PID_ENV] == str(os.getpid())
+    assert serving.prefork_master() == os.getpid()
+
+
+def test_owned_metrics_directory_is_created_and_removed(environ, load_conf):
+    environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    conf = load_conf()
+    directory = environ['PROMETHEUS_MULTIPROC_DIR']
+    assert conf.MULTIPROC_DIR_OWNED and os.path.isdir(directory)
+    conf.on_exit(server=None)
+    assert not os.path.exists(directory)
+
+
+def test_given_metrics_directory_is_cleaned_but_kept(environ, load_conf, tmp_path):
+    directory = tmp_path / 'metrics'
+    environ['PROMETHEUS_MULTIPROC_DIR'] = str(directory)
+    conf = load_conf()
+    assert not conf.MULTIPROC_DIR_OWNED and directory.is_dir()
+    (directory / 'counter_123.db').write_bytes(b'')
+    (directory / 'README').write_text('kept')
+    conf.on_starting(server=None)
+    assert [path.name for path in directory.iterdir()] == ['README']
+    conf.on_exit(server=None)
+    assert directory.is_dir()
+
+
+def test_dead_worker_is_marked(environ, load_conf, tmp_path, monkeypatch):
+    from prometheus_client import multiprocess
+    environ['PROMETHEUS_MULTIPROC_DIR'] = str(tmp_path)
+    dead = []
+    monkeypatch.setattr(multiprocess, 'mark_process_dead', dead.append)
+    load_conf().child_exit(server=None, worker=types.SimpleNamespace(pid=4321))
+    assert dead == [4321]
+
+
+def test_reload_runs_the_refork_hooks(environ, load_conf, tmp_path, refork_hooks):
+    environ['PROMETHEUS_MULTIPROC_DIR'] = str(tmp_path)
+    calls = []
+    serving.on_refork(lambda: calls.append('first'))
+    serving.on_refork(lambda: 1 / 0)
+    serving.on_refork(lambda: calls.append('last'))
+    # A failing hook is logged and the others still run
+    load_conf().on_reload(server=None)
+    assert calls == ['first', 'last']
+
+
+def test_refork_request_signals_the_master(monkeypatch):
+    monkeypatch.delenv(serving.MASTER_PID_ENV, raising=False)
+    assert serving.request_refork() is False
+    signals = []
+    monkeypatch.setattr(serving.os, 'kill', lambda pid, sig: signals.append((pid, sig)))
+    monkeypatch.setenv(serving.MASTER_PID_ENV, '4321')
+    assert serving.request_refork() is True
+    assert signals == [(4321, signal.SIGHUP)]
+
+
+def test_refork_replaces_workers_with_the_reloaded_state(environ, tmp_path):
+    (tmp_path / 'refork_app.py').write_text(REFORK_APP)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(environ, PORT=str(port), WORKERS='1', PYTHONPATH=os.pathsep.join([REPO_ROOT, str(tmp_path)]))
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'python:common.gunicorn_conf',
+                               'refork_app:app'], cwd=str(tmp_path), env=env, start_new_session=True,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def answer(until, timeout=20):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                pid, generation = map(int, requests.get(f'http://127.0.0.1:{port}/', timeout=1).text.split())
+                if until(pid, generation):
+                    return pid, generation
+            except requests.RequestException:
+                pass
+            time.sleep(0.1)
+        pytest.fail("gunicorn did not answer as expected")
+
+    try:
+        first_pid, _ = answer(lambda pid, generation: generation == 0)
+        environ[serving.MASTER_PID_ENV] = str(master.pid)
+        assert serving.request_refork() is True
+        # A new worker, forked after the hook ran in the master
+        pid, generation = answer(lambda pid, generation: pid != first_pid)
+        assert generation == 1
+    finally:
+        os.killpg(master.pid, signal.SIGTERM)
+        master.wait(15)
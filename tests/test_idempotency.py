@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from idempotency import CACHED, OWNER, PENDING, IdempotencyStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / 'idempotency.db'), lease=30.0)
+
+
+def test_first_claim_owns_and_duplicates_replay(store):
+    response, claim = store.claim('r1')
+    assert response is None and claim is not None
+    assert store.try_claim('r1') == (PENDING, None)
+    store.complete('r1', claim, {"summary": "s"})
+    assert store.claim('r1') == ({"summary": "s"}, None)
+    assert store.try_claim('r1') == (CACHED, {"summary": "s"})
+
+
+def test_release_lets_a_duplicate_take_over(store):
+    _, claim = store.claim('r1')
+    store.release('r1', claim)
+    state, _ = store.try_claim('r1')
+    assert state == OWNER
+
+
+def test_stale_owner_cannot_complete_or_release_a_taken_over_claim(store):
+    _, stale = store.claim('r1')
+    store.lease = 0.0
+    time.sleep(0.01)
+    state, current = store.try_claim('r1')
+    assert state == OWNER and current != stale
+    store.lease = 30.0
+
+    store.complete('r1', stale, {"summary": "stale"})
+    store.release('r1', stale)
+    assert store.try_claim('r1') == (PENDING, None)
+    assert store.stats()['pending'] == 1
+
+    store.complete('r1', current, {"summary": "current"})
+    assert store.try_claim('r1') == (CACHED, {"summary": "current"})
+
+
+def test_release_after_complete_keeps_the_response(store):
+    _, claim = store.claim('r1')
+    store.complete('r1', claim, {"summary": "s"})
+    store.release('r1', claim)
+    assert store.try_claim('r1') == (CACHED, {"summary": "s"})
+
+
+def test_waiting_duplicate_gets_the_owners_response(store):
+    _, claim = store.claim('r1')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(store.claim('r1')))
+    waiter.start()
+    time.sleep(0.05)
+    store.complete('r1', claim, {"summary": "s"})
+    waiter.join(timeout=5)
+    assert results == [({"summary": "s"}, None)]
+
+
+def test_async_calls_match_the_sync_ones(store):
+    async def run():
+        response, claim = await store.claim_async('r1')
+        assert response is None
+        await store.complete_async('r1', claim, {"summary": "s"})
+        assert await store.claim_async('r1') == ({"summary": "s"}, None)
+        _, other = await store.claim_async('r2')
+        await store.release_async('r2', other)
+        return await store.claim_async('r2')
+
+    response, claim = asyncio.run(run())
+    assert response is None and claim is not None
+
+
+def test_entries_are_bounded(tmp_path):
+    store = IdempotencyStore(str(tmp_path / 'idempotency.db'), max_entries=3)
+    for number in range(10):
+        _, claim = store.claim(f'r{number}')
+        store.complete(f'r{number}', claim, {"n": number})
+    assert store.stats()['entries'] == 3
+    assert store.try_claim('r9') == (CACHED, {"n": 9})
@@ -0,0 +1,78 @@
+import copy
+import os
+
+import pytest
+
+import kong_config
+from kong_config import TAG, describe, desired_config, diff, flatten, validate
+
+from tests.conftest import REPO_ROOT
+
+
+def test_rendered_config_is_valid(tmp_path):
+    config = desired_config()
+    assert validate(config) == []
+    path = tmp_path / 'kong.yml'
+    path.write_text(kong_config.render(config))
+    assert kong_config.load(str(path)) == config
+    assert validate(kong_config.load(os.path.join(REPO_ROOT, 'kong', 'kong.yml'))) == []
+
+
+def test_duplicate_route_name_is_rejected():
+    config = desired_config()
+    routes = config['services'][0]['routes']
+    routes.append(dict(copy.deepcopy(routes[0]), paths=['/elsewhere']))
+    assert validate(config) == ["route 'process-request-route': routes need a unique name"]
+
+
+def test_duplicate_service_name_is_rejected():
+    config = desired_config()
+    config['services'].append({"name": "orchestrator-service", "url": "http://other:5000", "tags": [TAG]})
+    errors = validate(config)
+    assert len(errors) == 1 and errors[0].endswith("services need a unique name")
+
+
+def test_flatten_keys_routes_by_name():
+    flat = flatten(desired_config())
+    assert sorted(flat['routes']) == sorted(name for name, _, _ in kong_config.ROUTES)
+    assert flat['routes']['process-request-route']['service'] == 'orchestrator-service'
+    assert flat['services']['orchestrator-service']['url'] == 'http://orchestrator:5000'
+    assert ('file-log', None, None, None) in flat['plugins']
+
+
+def test_diff_of_identical_configs_is_empty():
+    assert diff(flatten(desired_config()), flatten(desired_config())) == []
+
+
+def test_diff_describes_added_removed_and_changed_routes():
+    current = desired_config()
+    routes = current['services'][0]['routes']
+    # Missing from the gateway, out of date there, and only there
+    routes.remove(next(route for route in routes if route['name'] == 'process-requests-route'))
+    next(route for route in routes if route['name'] == 'process-request-route')['paths'] = ['/old']
+    routes.append({"name": "legacy-route", "paths": ["/legacy"], "methods": ["POST"], "tags": [TAG]})
+    routes.append({"name": "manual-route", "paths": ["/manual"], "methods": ["GET"]})
+
+    changes = diff(flatten(desired_config()), flatten(current))
+    assert changes == [
+        ('update', 'routes', 'process-request-route', [('paths', ['/old'], ['/process-request'])]),
+        ('create', 'routes', 'process-requests-route', []),
+        ('delete', 'routes', 'legacy-route', []),
+        ('delete', 'routes', 'manual-route', None),
+    ]
+    assert [describe(change) for change in changes] == [
+        "~ route process-request-route\n    paths: ['/old'] -> ['/process-request']",
+        "+ route process-requests-route",
+        "- route legacy-route",
+        "- route manual-route (not managed here: kept on a database-backed gateway)",
+    ]
+
+
+@pytest.mark.parametrize('admin_url, gateway', [
+    ('http://kong:8001', 'http://localhost:8000'),
+    ('http://kong-postgres:8001', 'http://localhost:8010'),
+    ('http://localhost:8011', 'http://localhost:8010'),
+    ('https://gateway.example.com:8444', 'http://gateway.example.com:8000'),
+])
+def test_gateway_url_follows_the_target_gateway(admin_url, gateway):
+    assert kong_config.gateway_url(admin_url) == gateway
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+from prometheus_client import Counter
+from common.metrics import IN_FLIGHT
+Counter('test_requests_total', 'Requests', ('endpoint',)).labels('/a').inc({count})
+IN_FLIGHT.inc()
+"""
+
+SCRAPE = """
+from prometheus_client import multiprocess
+from common.metrics import CallbackMetric, render
+CallbackMetric('test_version', 'Version', (), lambda: {{(): 7}}, kind='gauge')
+for pid in {dead}:
+    multiprocess.mark_process_dead(pid)
+print(render().decode())
+"""
+
+
+def run(code, multiproc_dir):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(multiproc_dir))
+    return subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, env=env, capture_output=True,
+                          text=True, check=True)
+
+
+def test_render_merges_processes_and_drops_dead_gauges(tmp_path):
+    workers = [subprocess.Popen([sys.executable, '-c', WORKER.format(count=count)], cwd=REPO_ROOT,
+                                env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path)))
+               for count in (2, 3)]
+    for worker in workers:
+        assert worker.wait() == 0
+
+    lines = run(SCRAPE.format(dead=[workers[0].pid]), tmp_path).stdout.splitlines()
+    # Counters of exited workers stay in the totals; live gauges only count running ones
+    assert 'test_requests_total{endpoint="/a"} 5.0' in lines
+    assert 'http_requests_in_flight 1.0' in lines
+    assert 'test_version 7.0' in lines
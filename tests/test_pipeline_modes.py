@@ -0,0 +1,81 @@
+import itertools
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from downstream import ServiceClient
+from idempotency import IdempotencyStore
+from pipeline import DistributedPipeline, MonolithPipeline
+from tests.conftest import APP_ENV
+
+QUERIES = [
+    'machine learning', 'cloud computing', 'neural networks deep learning', 'api design',
+    '"machine learning" systems', 'unknownterm', 'banned topic', 'FORBIDDEN cloud', 'illegal machine learning',
+]
+
+
+@pytest.fixture(scope='module')
+def pipelines(service_app):
+    """{mode: pipeline}: the distributed one calls the real service apps over HTTP"""
+    servers = {}
+    for step, service in (('policy', 'policy-service'), ('retriever', 'retriever-agent'),
+                          ('processor', 'processor-agent')):
+        server = make_server('127.0.0.1', 0, service_app(service).app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[step] = server
+    distributed = DistributedPipeline(*(ServiceClient(f'{step}-modes', f'http://127.0.0.1:{servers[step].port}')
+                                        for step in ('policy', 'retriever', 'processor')))
+    monolith = MonolithPipeline(lambda *args, **kwargs: None, APP_ENV['POLICY_RULES_PATH'],
+                                APP_ENV['DOCUMENTS_PATH'])
+    yield {"distributed": distributed, "monolith": monolith}
+    for server in servers.values():
+        server.shutdown()
+
+
+@pytest.fixture
+def orchestrator(service_app, monkeypatch, tmp_path):
+    module = service_app('orchestrator')
+    stores = itertools.count()
+
+    def run(pipeline, path, body):
+        # A fresh store per call, so nothing is replayed from the other mode
+        monkeypatch.setattr(module, 'IDEMPOTENCY', IdempotencyStore(str(tmp_path / f'{next(stores)}.db')))
+        monkeypatch.setattr(module, 'PIPELINE', pipeline)
+        response = module.app.test_client().post(path, json=body)
+        return response.status_code, response.get_json()
+
+    return run
+
+
+def without_trace(body):
+    return {key: value for key, value in body.items() if key != 'trace_id'}
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_single_requests_match(pipelines, orchestrator, query):
+    distributed = orchestrator(pipelines['distributed'], '/process-request', {"request_id": "r1", "query": query})
+    monolith = orchestrator(pipelines['monolith'], '/process-request', {"request_id": "r1", "query": query})
+    assert distributed[0] == monolith[0]
+    assert without_trace(distributed[1]) == without_trace(monolith[1])
+    if distributed[0] == 200 and query != 'unknownterm':
+        assert distributed[1]['summary'] and distributed[1]['document_count'] > 0
+
+
+def test_policy_decisions_match(pipelines):
+    def decision(mode, query):
+        data = pipelines[mode].check_policy('trace', 'r1', query)
+        return data['allowed'], data['reason'], data['matched_rules']
+
+    for query in QUERIES:
+        assert decision('distributed', query) == decision('monolith', query)
+    assert decision('monolith', 'banned topic')[0] is False
+
+
+def test_batches_match(pipelines, orchestrator):
+    items = [{"request_id": f"r{number}", "query": query} for number, query in enumerate(QUERIES)]
+    distributed = orchestrator(pipelines['distributed'], '/process-requests', {"requests": items})[1]
+    monolith = orchestrator(pipelines['monolith'], '/process-requests', {"requests": items})[1]
+    assert [without_trace(result) for result in distributed['results']] \
+        == [without_trace(result) for result in monolith['results']]
+    assert distributed['statuses'] == monolith['statuses'] == {"success": 6, "denied": 3}
@@ -0,0 +1,78 @@
+import random
+import re
+
+import pytest
+
+from policy_engine import PolicyEngine, PolicyRule, required_literal
+
+REGEXES = [
+    r'\x41BC', r'\101bc', r'\N{LATIN SMALL LETTER A}bc', r'Abc', r'ab{,2}c',
+    r'ab{2}c', r'ab{1,}c', r'a+bcd', r'ab?cd', r'ssn\s*\d{3}', r'kiss', r'(?x) k e y',
+    r'foo\.bar', r'[a]bc\]', r'x(?:ab|cd)y', r'ab|cd', r'(?-i:ABC)d', r'\bcard\b',
+]
+TEXTS = [
+    'ABC', 'abc', 'ac', 'abbc', 'abbbc', 'aaabcd', 'acd', 'abcd', 'SSN 123', 'ſsn 123',
+    'KİSS', 'kıss', 'kiſſ', 'KEY', 'foo.bar', 'fooxbar', 'abc]', 'xaby', 'xcdy', 'cd',
+    'ABCD', 'abcd', 'my CARD', 'cards', 'KKEY',
+]
+
+
+def reference_matches(rules, query):
+    """Ids of the rules query matches, checking every rule on its own"""
+    matched = []
+    for rule in rules:
+        if rule.type == 'regex':
+            if re.search(rule.pattern, query, re.IGNORECASE):
+                matched.append(rule.id)
+            continue
+        text, term = query.lower(), rule.pattern.lower()
+        for start in range(len(text) - len(term) + 1):
+            if text.startswith(term, start):
+                before = text[start - 1] if start else ' '
+                after = text[start + len(term):start + len(term) + 1] or ' '
+                if not rule.whole_word or not any(c.isalnum() or c == '_' for c in before + after):
+                    matched.append(rule.id)
+                    break
+    return matched
+
+
+@pytest.mark.parametrize('pattern', REGEXES)
+def test_literal_is_in_every_match(pattern):
+    literal = required_literal(pattern)
+    for text in TEXTS:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            assert literal in text.lower(), (pattern, text, literal)
+
+
+def test_escapes_and_repeats_give_the_literal_re_reads():
+    assert required_literal(r'\x41BC') == 'abc'
+    assert required_literal(r'\101bc') == 'abc'
+    assert required_literal(r'\N{LATIN SMALL LETTER A}bc') == 'abc'
+    assert required_literal('ab{,2}c') == 'a'
+    assert required_literal('ab|cd') == ''
+
+
+def test_prefilter_finds_every_rule_match():
+    rules = [PolicyRule(f'r{number}', 'regex', pattern) for number, pattern in enumerate(REGEXES)]
+    rules += [PolicyRule('t0', 'term', 'banned'), PolicyRule('t1', 'term', 'card', whole_word=True)]
+    engine = PolicyEngine(rules)
+    for text in TEXTS + ['banned ABC', 'card', 'discard']:
+        expected = reference_matches(rules, text)
+        assert [rule.id for rule in engine.matched_rules(text)] == expected, text
+        assert engine.check(text).allowed == (not expected)
+
+
+def test_prefilter_matches_reference_on_random_rules():
+    rng = random.Random(6)
+    alphabet = 'abcsiK'
+    pieces = ['a', 'b', 'c', 's', 'i', r'\x61', r'\142', '.', r'\d', '[ab]', 'b?', 'c+', 'a{,2}', 'b{2}', '(?:a|bc)']
+    rules = []
+    for number in range(40):
+        pattern = ''.join(rng.choice(pieces) for _ in range(rng.randint(1, 5)))
+        rules.append(PolicyRule(f'r{number}', 'regex', pattern))
+    rules.append(PolicyRule('t0', 'term', 'abc', whole_word=True))
+    engine = PolicyEngine(rules)
+    for _ in range(300):
+        text = ''.join(rng.choice(alphabet + ' 1ſİ') for _ in range(rng.randint(0, 12)))
+        assert [rule.id for rule in engine.matched_rules(text)] == reference_matches(rules, text), text
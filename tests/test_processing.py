@@ -0,0 +1,39 @@
+from processing import DocumentProcessor, LRUCache, document_digest, generate_label, summarize_documents
+
+DOCUMENTS = [
+    {"id": "a", "title": "Neural nets", "content": "Deep learning works. It scales.", "category": "AI"},
+    {"id": "b", "title": "Clouds", "content": "Elastic compute. Pay per use.", "category": "Cloud"},
+]
+
+
+def test_cached_results_match_uncached_processing():
+    lookups = []
+    processor = DocumentProcessor(on_lookup=lambda cache, hit: lookups.append((cache, hit)))
+    expected = (summarize_documents(DOCUMENTS), generate_label(DOCUMENTS))
+    assert processor.process(DOCUMENTS) == expected + (False,)
+    # Same content in new dicts, as another request would send it
+    assert processor.process([dict(doc) for doc in DOCUMENTS]) == expected + (True,)
+    assert lookups == [('results', False), ('results', True)]
+
+
+def test_content_changes_miss_the_result_cache():
+    processor = DocumentProcessor()
+    processor.process(DOCUMENTS)
+    changed = [DOCUMENTS[0], dict(DOCUMENTS[1], category="AI")]
+    assert processor.process(changed) == (summarize_documents(changed), generate_label(changed), False)
+    assert processor.stats()['results']['misses'] == 2
+
+
+def test_digest_keeps_field_boundaries():
+    assert document_digest({"title": "ab", "content": "c"}) != document_digest({"title": "a", "content": "bc"})
+    assert document_digest({"id": "1"}) != document_digest({"id": 1})
+
+
+def test_lru_evicts_the_least_recently_used_key():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.stats() == {"entries": 2, "max_entries": 2, "hits": 1, "misses": 1, "evictions": 1}
@@ -0,0 +1,28 @@
+import pytest
+
+DOCUMENTS = [{"id": "a", "title": "Neural nets", "content": "Deep learning works. It scales.", "category": "AI"}]
+
+
+@pytest.fixture
+def client(service_app):
+    return service_app('processor-agent').app.test_client()
+
+
+@pytest.mark.parametrize('documents', ["a document", {"id": "a"}, ["a document"], [DOCUMENTS[0], None], 3])
+def test_process_rejects_documents_that_are_not_a_list_of_objects(client, documents):
+    response = client.post('/process', json={"request_id": "r1", "query": "q", "documents": documents})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "documents must be a list of objects"}
+
+
+def test_process_matches_the_batch_endpoint(client):
+    single = client.post('/process', json={"request_id": "r1", "query": "q", "documents": DOCUMENTS})
+    batch = client.post('/process/batch', json={"items": [
+        {"request_id": "r1", "query": "q", "documents": DOCUMENTS},
+        {"request_id": "r2", "query": "q", "documents": "a document"},
+    ]})
+    assert single.status_code == batch.status_code == 200
+    results = batch.get_json()['results']
+    assert {key: single.get_json()[key] for key in ('summary', 'label', 'document_count')} \
+        == {key: results[0][key] for key in ('summary', 'label', 'document_count')}
+    assert results[1] == {"request_id": "r2", "error": "documents must be a list of objects"}
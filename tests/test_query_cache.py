@@ -0,0 +1,72 @@
+import time
+
+from query_cache import QueryCache, normalize_query
+
+V1 = {"corpus": ["c", 1], "policy": "p1"}
+V2 = {"corpus": ["c", 2], "policy": "p1"}
+
+
+class Versions:
+    def __init__(self, current=V1):
+        self.current = current
+
+    def __call__(self):
+        return self.current
+
+
+def test_normalized_spellings_share_an_entry_but_need_a_policy_check():
+    cache = QueryCache(Versions())
+    versions = cache.current_versions()
+    cache.store('Machine  learning', {"summary": "s"}, versions)
+    assert normalize_query(' MACHINE learning\t') == 'machine learning'
+    assert cache.lookup('Machine  learning', versions) == ({"summary": "s"}, True)
+    assert cache.lookup('machine learning', versions) == ({"summary": "s"}, False)
+    cache.allow('machine learning')
+    assert cache.lookup('machine learning', versions) == ({"summary": "s"}, True)
+
+
+def test_version_change_drops_every_entry():
+    source = Versions()
+    cache = QueryCache(source)
+    cache.store('q', {"summary": "s"}, cache.current_versions())
+    source.current = V2
+    versions = cache.current_versions()
+    assert cache.lookup('q', versions) is None
+    assert cache.stats()['entries'] == 0 and cache.stats()['invalidations'] == 1
+
+
+def test_results_of_replaced_or_unknown_versions_are_not_stored():
+    source = Versions()
+    cache = QueryCache(source)
+    stale = cache.current_versions()
+    source.current = V2
+    current = cache.current_versions()
+    cache.store('q', {"summary": "old"}, stale)
+    assert cache.lookup('q', current) is None
+
+    source.current = None
+    assert cache.current_versions() is None
+    cache.store('q', {"summary": "s"}, None)
+    assert cache.lookup('q', None) is None
+
+
+def test_entries_expire_and_are_bounded():
+    cache = QueryCache(Versions(), max_entries=2, ttl=0.05)
+    versions = cache.current_versions()
+    for query in ('a', 'b', 'c'):
+        cache.store(query, {"summary": query}, versions)
+    assert cache.lookup('a', versions) is None
+    assert cache.stats()['evictions'] == 1
+    time.sleep(0.06)
+    assert cache.lookup('b', versions) is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_allowed_spellings_are_bounded():
+    cache = QueryCache(Versions(), max_variants=2)
+    versions = cache.current_versions()
+    cache.store('q', {"summary": "s"}, versions)
+    cache.allow('Q')
+    cache.allow(' q')
+    assert cache.lookup('Q', versions)[1] is True
+    assert cache.lookup(' q', versions)[1] is False
@@ -0,0 +1,51 @@
+import pytest
+
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def opened_breaker(reset_timeout=0.0):
+    """Breaker opened by two failures, with one call let through before it opened still running"""
+    breaker = CircuitBreaker('svc', consecutive_failures=2, reset_timeout=reset_timeout)
+    stale = breaker.acquire()
+    for _ in range(2):
+        breaker.record(breaker.acquire(), False)
+    assert breaker.state == OPEN
+    return breaker, stale
+
+
+def test_stale_success_does_not_close_the_breaker():
+    breaker, stale = opened_breaker(reset_timeout=60.0)
+    breaker.record(stale, True)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+
+def test_stale_outcome_does_not_settle_the_probe():
+    breaker, stale = opened_breaker()
+    probe = breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    breaker.record(stale, True)
+    assert breaker.state == HALF_OPEN
+    breaker.record(probe, True)
+    assert breaker.state == CLOSED
+
+
+def test_stale_cancel_does_not_let_a_second_probe_through():
+    breaker, stale = opened_breaker()
+    probe = breaker.acquire()
+    breaker.cancel(stale)
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+    breaker.record(probe, False)
+    assert breaker.state == OPEN
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    breaker, _ = opened_breaker()
+    breaker.cancel(breaker.acquire())
+    probe = breaker.acquire()
+    assert probe is not None
+    breaker.record(probe, True)
+    assert breaker.state == CLOSED
+    assert breaker.acquire() is None
@@ -0,0 +1,66 @@
+import pytest
+
+
+@pytest.fixture
+def client(service_app):
+    return service_app('retriever-agent').app.test_client()
+
+
+@pytest.mark.parametrize('query, error', [
+    (None, "Query is required"), ('', "Query is required"),
+    (42, "Query must be a string"), (["machine", "learning"], "Query must be a string"),
+    ({"text": "machine learning"}, "Query must be a string"),
+])
+def test_retrieve_rejects_a_missing_or_non_string_query(client, query, error):
+    body = {"request_id": "r1"} if query is None else {"request_id": "r1", "query": query}
+    response = client.post('/retrieve', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+
+
+def test_batch_reports_bad_queries_per_item(client):
+    response = client.post('/retrieve/batch', json={"queries": [
+        {"request_id": "ok", "query": "machine learning"},
+        {"request_id": "number", "query": 42},
+        {"request_id": "list", "query": ["machine learning"]},
+        {"request_id": "empty", "query": ""},
+        {"request_id": "missing"},
+        "not an object",
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results[0]['request_id'] == "ok" and results[0]['count'] > 0
+    assert results[1:] == [
+        {"request_id": "number", "error": "Query must be a string"},
+        {"request_id": "list", "error": "Query must be a string"},
+        {"request_id": "empty", "error": "Query is required"},
+        {"request_id": "missing", "error": "Query is required"},
+        {"request_id": "unknown", "error": "Query is required"},
+    ]
+
+
+@pytest.mark.parametrize('mode', ['tfidf', 'keyword'])
+def test_batch_of_only_bad_queries_still_answers(client, mode):
+    response = client.post('/retrieve/batch', json={"mode": mode, "queries": [{"request_id": "r1", "query": 7}]})
+    assert response.status_code == 200
+    assert response.get_json()['results'] == [{"request_id": "r1", "error": "Query must be a string"}]
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/retrieve', {"request_id": "r1", "query": "machine learning"}),
+    ('/retrieve/batch', {"queries": [{"request_id": "r1", "query": "machine learning"}]}),
+])
+@pytest.mark.parametrize('refs', ["false", "true", 0, 1, None])
+def test_refs_must_be_a_bool(client, path, body, refs):
+    response = client.post(path, json=dict(body, refs=refs))
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "refs must be true or false"}
+
+
+def test_refs_return_references(client):
+    full = client.post('/retrieve', json={"request_id": "r1", "query": "machine learning", "refs": False})
+    refs = client.post('/retrieve', json={"request_id": "r1", "query": "machine learning", "refs": True})
+    assert full.status_code == refs.status_code == 200
+    full_documents, references = full.get_json()['documents'], refs.get_json()['documents']
+    assert [doc['id'] for doc in references] == [doc['id'] for doc in full_documents]
+    assert 'content' in full_documents[0] and 'content' not in references[0]
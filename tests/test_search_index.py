@@ -0,0 +1,170 @@
+import math
+
+import pytest
+
+from common.document_refs import to_reference
+from tests.corpora import random_documents, random_queries
+from search_index import (BM25_K1, DELETED, FIELD_B, FIELD_WEIGHTS, FIELDS, KEYWORD_WEIGHTS, PROXIMITY_WEIGHT,
+                          PROXIMITY_WINDOW, InvertedIndex, tokenize)
+
+
+def reference_bm25(documents, query):
+    """BM25F with the proximity bonus, computed straight from the document text"""
+    tokens = [{field: tokenize(doc[field]) for field in FIELDS} for doc in documents]
+    num_docs = len(documents)
+    avg = {field: sum(len(t[field]) for t in tokens) / num_docs for field in FIELDS}
+
+    def idf(term):
+        df = sum(1 for t in tokens if any(term in t[field] for field in FIELDS))
+        return math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+    terms = tokenize(query)
+    vocabulary = {term for t in tokens for field in FIELDS for term in t[field]}
+    pairs = {(a, b) for a, b in zip(terms, terms[1:]) if a != b and a in vocabulary and b in vocabulary}
+    scores = {}
+    for docno, t in enumerate(tokens):
+        score = 0.0
+        for term in set(terms) & vocabulary:
+            tf = sum(FIELD_WEIGHTS[field] * t[field].count(term)
+                     / (1 - FIELD_B[field] + FIELD_B[field] * len(t[field]) / avg[field]) for field in FIELDS)
+            score += terms.count(term) * idf(term) * tf / (BM25_K1 + tf)
+        for first, second in pairs:
+            close = 0.0
+            for field in FIELDS:
+                for i, a in enumerate(t[field]):
+                    for j, b in enumerate(t[field]):
+                        if a == first and b == second:
+                            distance = j - i if j > i else i - j + 1
+                            if distance <= PROXIMITY_WINDOW:
+                                close += FIELD_WEIGHTS[field] / distance ** 2
+            if close:
+                score += PROXIMITY_WEIGHT * min(idf(first), idf(second)) * close / (BM25_K1 + close)
+        if any(term in vocabulary and any(term in t[field] for field in FIELDS) for term in terms):
+            scores[docno] = score
+    return scores
+
+
+def reference_keyword(documents, query, substring=False):
+    """Title-weighted word scoring by scanning every document"""
+    scores = {}
+    words = query.lower().split() if substring else tokenize(query)
+    for docno, doc in enumerate(documents):
+        score = 0
+        for word in words:
+            for field in FIELDS:
+                text = doc[field].lower()
+                if (word in text) if substring else (word in tokenize(text)):
+                    score += KEYWORD_WEIGHTS[field]
+        if score:
+            scores[docno] = score
+    return scores
+
+
+def ranked(scores, top_k):
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bm25_matches_reference(seed):
+    documents = random_documents(40, seed)
+    index = InvertedIndex(documents)
+    for query in random_queries(20, seed):
+        expected = reference_bm25(documents, query)
+        assert index.score_bm25(query) == pytest.approx(expected)
+
+
+def test_bm25_on_sample_corpus(sample_documents):
+    index = InvertedIndex(sample_documents)
+    for query in ('machine learning', 'cloud computing', 'neural networks deep learning', 'api'):
+        assert index.score_bm25(query) == pytest.approx(reference_bm25(sample_documents, query))
+    hits = index.search('machine learning')
+    assert [hit['id'] for hit in hits][0] == 'doc-001'
+    assert set(hits[0]) == {'id', 'title', 'content', 'category', 'score'}
+
+
+@pytest.mark.parametrize('mode', ['keyword', 'substring'])
+def test_keyword_modes_match_reference(mode):
+    documents = random_documents(40, 11)
+    index = InvertedIndex(documents)
+    queries = random_queries(20, 11) + ['w1', 'W1 w2', '1', 'w', 'w1-w2']
+    for query in queries:
+        expected = reference_keyword(documents, query, substring=mode == 'substring')
+        scorer = index.score_keyword if mode == 'keyword' else index.score_substring
+        assert scorer(query) == expected
+        assert index.rank(query, 5, mode) == ranked(expected, 5)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pruned_bm25_matches_exhaustive_ranking(seed):
+    documents = random_documents(200, seed, vocabulary=60, max_words=80)
+    index = InvertedIndex(documents)
+    changed = index.with_changes({3: documents[7], 200: documents[0]}, deletes=[5, 11])
+    queries = random_queries(30, seed, vocabulary=60) + ['"w1 w2" w3', 'w4 "w5 w6"', 'w1 w1 w2 w2 w3 w9 w10 w11']
+    for current in (index, changed):
+        for query in queries:
+            for top_k in (1, 3, 10, 250):
+                assert current.rank(query, top_k) == current.rank(query, top_k, prune=False), (query, top_k)
+
+
+def test_keyword_matches_whole_words_only():
+    index = InvertedIndex([{"id": "a", "title": "Maintainable", "content": "text", "category": "X"}])
+    assert index.score_keyword('ai') == {}
+    assert index.score_substring('ai') == {0: 2}
+
+
+def test_rank_edge_cases():
+    documents = random_documents(10, 3)
+    index = InvertedIndex(documents)
+    assert index.rank('', 3) == []
+    assert index.rank('unknownterm', 3) == []
+    assert index.rank('w1', 0) == []
+    everything = index.rank('w1 w2 w3', 100)
+    assert len(everything) == len(index.score_bm25('w1 w2 w3'))
+    assert InvertedIndex([]).rank('w1', 3) == []
+    with pytest.raises(ValueError):
+        index.rank('w1', 3, mode='vector')
+
+
+def test_ties_keep_corpus_order():
+    documents = [{"id": f"d{i}", "title": "same", "content": "same words", "category": "X"} for i in range(5)]
+    index = InvertedIndex(documents)
+    for mode in ('bm25', 'keyword', 'substring'):
+        assert [docno for docno, _ in index.rank('same', 3, mode)] == [0, 1, 2]
+
+
+def test_phrases_filter_bm25_and_keyword():
+    documents = [
+        {"id": "a", "title": "t", "content": "machine learning systems", "category": "X"},
+        {"id": "b", "title": "t", "content": "learning machine systems", "category": "X"},
+    ]
+    index = InvertedIndex(documents)
+    assert [docno for docno, _ in index.rank('"machine learning"', 3)] == [0]
+    assert [docno for docno, _ in index.rank('"machine learning"', 3, 'keyword')] == [0]
+    assert index.rank('"learning systems" "machine learning"', 3)[0][0] == 0
+    assert index.rank('"systems machine"', 3) == []
+
+
+def test_search_pages_with_offset():
+    documents = random_documents(30, 5)
+    index = InvertedIndex(documents)
+    full = index.search('w1 w2', top_k=9)
+    assert index.search('w1 w2', top_k=3, offset=3) == full[3:6]
+
+
+def test_references_match_full_hits(tmp_path):
+    documents = [
+        {"id": "a", "title": "Café", "content": "Naïve résumé. Second sentence.", "category": "x"},
+        {"id": "b", "title": "No period", "content": "just words here", "category": "y"},
+        {"id": "c", "title": "Empty", "content": "", "category": "x"},
+        {"id": "d", "title": "Lead", "content": ".starts with a period", "category": "z"},
+    ]
+    index = InvertedIndex(documents).with_changes({
+        0: dict(documents[0], content="Changed ünïcode. Tail"),
+        4: {"id": "e", "title": "New", "content": "Added later. More", "category": "y"}
+    }, deletes=[1])
+    for current in (index, index.compacted(str(tmp_path / 'store.bin'))):
+        for docno, slot in enumerate(current.slots):
+            if slot != DELETED:
+                for score in (1.234567, 3):
+                    assert current.hit(docno, score, refs=True) == to_reference(current.hit(docno, score))
+    assert [hit['first_sentence'] for hit in index.search('new', refs=True)] == ['Added later']
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from common.document_refs import to_reference
+from corpus import LiveCorpus
+from sharding import ShardedCorpus
+from tests.corpora import random_documents, random_queries
+
+
+def same_hits(got, expected):
+    assert [hit['id'] for hit in got] == [hit['id'] for hit in expected]
+    assert [hit['score'] for hit in got] == pytest.approx([hit['score'] for hit in expected], abs=1e-4)
+
+
+@pytest.fixture
+def corpus_file(tmp_path):
+    path = tmp_path / 'documents.json'
+    documents = random_documents(60, 7)
+    path.write_text(json.dumps(documents))
+    return path, documents
+
+
+@pytest.mark.parametrize('num_shards', [2, 3])
+def test_sharded_search_matches_single_index(corpus_file, num_shards):
+    path, documents = corpus_file
+    single = LiveCorpus(documents).snapshot
+    sharded = ShardedCorpus(str(path), num_shards)
+    try:
+        queries = random_queries(20, 7)
+        for query in queries:
+            for mode in ('bm25', 'keyword', 'substring'):
+                same_hits(sharded.snapshot.search(query, top_k=5, mode=mode),
+                          single.search(query, top_k=5, mode=mode))
+            same_hits(sharded.snapshot.search(query, top_k=3, offset=4), single.search(query, top_k=3, offset=4))
+            refs = sharded.snapshot.search(query, top_k=5, refs=True)
+            same_hits(refs, single.search(query, top_k=5))
+            assert refs == [to_reference(hit) for hit in sharded.snapshot.search(query, top_k=5)]
+        for got, expected in zip(sharded.snapshot.search_batch(queries, top_k=5, refs=True),
+                                 single.search_batch(queries, 5)):
+            assert got == [to_reference(hit) for hit in expected]
+    finally:
+        sharded.snapshot.close()
+
+
+def test_reload_reports_changes_and_keeps_version_without_them(corpus_file):
+    path, documents = corpus_file
+    sharded = ShardedCorpus(str(path), 2, retire_grace=0)
+    try:
+        pool = sharded.snapshot
+        assert sharded.reload() == (1, 0)
+        assert sharded.snapshot is pool
+
+        documents[0] = dict(documents[0], content='w1 w1 w1')
+        del documents[5]
+        documents.append({"id": "added", "title": "w2", "content": "w3", "category": "X"})
+        path.write_text(json.dumps(documents))
+        assert sharded.reload() == (2, 3)
+        same_hits(sharded.snapshot.search('w1 w2 w3', top_k=10),
+                  LiveCorpus(documents).snapshot.search('w1 w2 w3', top_k=10))
+    finally:
+        sharded.snapshot.close()
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from idempotency import CACHED, OWNER, IdempotencyStore
+from pipeline import StepError
+from streaming import encode_event, stream_format
+
+
+class StubPipeline:
+    """Single-request steps; queries containing 'deny' are denied, failing_step raises"""
+
+    def __init__(self, failing_step=None):
+        self.failing_step = failing_step
+
+    def _step(self, step):
+        if step == self.failing_step:
+            raise StepError(step, f"{step.capitalize()} service error")
+
+    def check_policy(self, trace_id, request_id, query):
+        self._step('policy')
+        allowed = 'deny' not in query
+        return {"allowed": allowed, "reason": "ok" if allowed else "Matched rule deny", "matched_rules": []}
+
+    def retrieve(self, trace_id, request_id, query):
+        self._step('retriever')
+        return [{"id": "d1", "title": "T", "content": "C.", "category": "AI"}]
+
+    def process(self, trace_id, request_id, query, documents):
+        self._step('processor')
+        return {"summary": "S", "label": "AI", "document_count": len(documents)}
+
+
+@pytest.fixture
+def orchestrator(service_app, monkeypatch, tmp_path):
+    module = service_app('orchestrator')
+    monkeypatch.setattr(module, 'IDEMPOTENCY', IdempotencyStore(str(tmp_path / 'idempotency.db')))
+    monkeypatch.setattr(module, 'PIPELINE', StubPipeline())
+    return module
+
+
+def parse_ndjson(body):
+    return [(event['event'], event['data']) for event in map(json.loads, body.decode('utf-8').splitlines())]
+
+
+def parse_sse(body):
+    events = []
+    for block in body.decode('utf-8').split('\n\n'):
+        if block:
+            fields = dict(line.split(': ', 1) for line in block.split('\n'))
+            events.append((fields['event'], json.loads(fields['data'])))
+    assert body.endswith(b'\n\n')
+    return events
+
+
+def stream(module, query, accept=None, request_id='r1'):
+    headers = {'Accept': accept} if accept else {}
+    response = module.app.test_client().post('/process-request/stream', json={"request_id": request_id,
+                                                                              "query": query}, headers=headers)
+    assert response.status_code == 200
+    parse = parse_sse if response.mimetype == 'text/event-stream' else parse_ndjson
+    events = parse(response.data)
+    # As a server does once the last event is sent
+    response.close()
+    return response, events
+
+
+def test_format_follows_accept():
+    assert stream_format('text/event-stream') == 'sse'
+    assert stream_format('application/json, text/event-stream;q=0.5') == 'sse'
+    assert stream_format('application/x-ndjson') == stream_format(None) == 'ndjson'
+    assert encode_event('ndjson', 'policy', {"a": 1}) == b'{"event": "policy", "data": {"a": 1}}\n'
+    assert encode_event('sse', 'policy', {"a": 1}) == b'event: policy\ndata: {"a": 1}\n\n'
+
+
+@pytest.mark.parametrize('accept', [None, 'text/event-stream'])
+def test_stages_arrive_in_order(orchestrator, accept):
+    response, events = stream(orchestrator, 'machine learning', accept)
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.mimetype == ('text/event-stream' if accept else 'application/x-ndjson')
+    assert [event for event, _ in events] == ['started', 'policy', 'documents', 'result']
+    trace_id = events[0][1]['trace_id']
+    assert events[2][1]['count'] == 1
+    assert events[3][1] == {"request_id": "r1", "trace_id": trace_id, "summary": "S", "label": "AI",
+                            "document_count": 1}
+    assert orchestrator.IDEMPOTENCY.try_claim('r1') == (CACHED, events[3][1])
+
+
+@pytest.mark.parametrize('accept', [None, 'text/event-stream'])
+def test_denied_query_ends_the_stream(orchestrator, accept):
+    _, events = stream(orchestrator, 'deny me', accept)
+    assert [event for event, _ in events] == ['started', 'policy', 'denied']
+    assert events[1][1]['allowed'] is False
+    assert events[2][1]['reason'] == "Matched rule deny"
+
+
+@pytest.mark.parametrize('failing_step, stages', [('retriever', ['policy']), ('processor', ['policy', 'documents'])])
+@pytest.mark.parametrize('accept', [None, 'text/event-stream'])
+def test_stage_failure_mid_stream_sends_an_error_event(orchestrator, monkeypatch, accept, failing_step, stages):
+    monkeypatch.setattr(orchestrator, 'PIPELINE', StubPipeline(failing_step=failing_step))
+    _, events = stream(orchestrator, 'machine learning', accept)
+    assert [event for event, _ in events] == ['started', *stages, 'error']
+    assert events[-1][1]['error'] == f"{failing_step.capitalize()} service error"
+    # Nothing stored, and the claim is released once the stream closes
+    assert orchestrator.IDEMPOTENCY.try_claim('r1')[0] == OWNER
+
+
+def test_completed_request_replays_as_one_result(orchestrator):
+    _, first = stream(orchestrator, 'machine learning')
+    _, events = stream(orchestrator, 'machine learning')
+    assert [event for event, _ in events] == ['started', 'result']
+    assert events[1][1] == first[-1][1]
@@ -0,0 +1,66 @@
+import math
+from collections import Counter
+
+import pytest
+
+from search_index import FIELD_WEIGHTS, FIELDS, InvertedIndex, tokenize
+from tests.corpora import random_documents, random_queries
+from tfidf import TfidfMatrix
+
+
+def reference_scores(documents, query):
+    """Cosine similarity of smoothed TF-IDF vectors, one document at a time"""
+    num_docs = len(documents)
+    rows = []
+    for doc in documents:
+        tf = Counter()
+        for field in FIELDS:
+            for term in tokenize(doc[field]):
+                tf[term] += FIELD_WEIGHTS[field]
+        rows.append(tf)
+    df = Counter(term for row in rows for term in row)
+    idf = {term: math.log((1 + num_docs) / (1 + count)) + 1 for term, count in df.items()}
+
+    query_vector = {term: (1 + math.log(qtf)) * idf[term]
+                    for term, qtf in Counter(tokenize(query)).items() if term in idf}
+    query_norm = math.sqrt(sum(w * w for w in query_vector.values()))
+    scores = {}
+    for docno, row in enumerate(rows):
+        vector = {term: (1 + math.log(tf)) * idf[term] for term, tf in row.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        dot = sum(weight * vector.get(term, 0.0) for term, weight in query_vector.items())
+        if dot > 0:
+            scores[docno] = dot / (norm * query_norm)
+    return scores
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_batch_matches_reference(seed):
+    documents = random_documents(50, seed)
+    matrix = TfidfMatrix(InvertedIndex(documents))
+    queries = random_queries(30, seed)
+    for query, result in zip(queries, matrix.top_k_batch(queries, top_k=5)):
+        expected = reference_scores(documents, query)
+        best = sorted(expected.items(), key=lambda item: (-item[1], item[0]))[:5]
+        assert [docno for docno, _ in result] == [docno for docno, _ in best]
+        assert [score for _, score in result] == pytest.approx([score for _, score in best])
+
+
+def test_batch_edge_cases():
+    documents = [{"id": f"d{i}", "title": "same", "content": "same text", "category": "X"} for i in range(4)]
+    matrix = TfidfMatrix(InvertedIndex(documents))
+    ranked = matrix.top_k_batch(['same', 'unknown', '', 'same'], top_k=2)
+    # Ties are broken by docno
+    assert [docno for docno, _ in ranked[0]] == [0, 1]
+    assert ranked[1] == [] and ranked[2] == []
+    assert ranked[3] == ranked[0]
+    assert matrix.top_k_batch(['same'], top_k=0) == [[]]
+    assert matrix.top_k_batch([], top_k=3) == []
+
+
+def test_search_batch_returns_hits(sample_documents):
+    matrix = TfidfMatrix(InvertedIndex(sample_documents))
+    hits = matrix.search_batch(['machine learning', 'cloud computing'])
+    assert len(hits) == 2 and all(1 <= len(per_query) <= 3 for per_query in hits)
+    assert hits[0][0]['id'] == 'doc-001'
+    assert hits[1][0]['category'] == 'Cloud'
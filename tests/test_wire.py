@@ -0,0 +1,49 @@
+import msgpack
+import pytest
+from flask import Flask
+
+from common import wire
+
+PAYLOAD = {"query": "machine learning", "documents": [{"id": "a", "score": 1.25, "tags": None}], "count": 1}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return wire.respond(wire.request_payload())
+
+    return app
+
+
+@pytest.mark.parametrize('content_type', ['application/json', 'application/msgpack',
+                                          'application/x-msgpack; charset=binary'])
+def test_encode_decode_round_trip(content_type):
+    assert wire.decode(wire.encode(PAYLOAD, content_type), content_type) == PAYLOAD
+
+
+def test_content_type_for_rejects_unknown_formats():
+    assert wire.content_type_for('msgpack') == wire.MSGPACK
+    with pytest.raises(ValueError):
+        wire.content_type_for('xml')
+
+
+def test_json_stays_the_default_response(app):
+    client = app.test_client()
+    response = client.post('/echo', data=msgpack.packb(PAYLOAD), content_type=wire.MSGPACK)
+    assert response.mimetype == wire.JSON and response.get_json() == PAYLOAD
+    response = client.post('/echo', json=PAYLOAD, headers={'Accept': 'application/json, application/msgpack'})
+    assert response.mimetype == wire.JSON
+
+
+def test_msgpack_response_when_ranked_first(app):
+    response = app.test_client().post('/echo', json=PAYLOAD,
+                                      headers={'Accept': 'application/msgpack, application/json;q=0.5'})
+    assert response.mimetype == wire.MSGPACK and msgpack.unpackb(response.data) == PAYLOAD
+
+
+def test_malformed_msgpack_body_is_a_400(app):
+    response = app.test_client().post('/echo', data=b'\xc1', content_type=wire.MSGPACK)
+    assert response.status_code == 400